@@ -0,0 +1,359 @@
+########################################################################################
+#  _______  _______  _______ _________ _______  _______  _______  _______              #
+# (       )(  ___  )(  ____ \\__   __/(  ____ \(       )(  ___  )(  ____ ) Ragnarok    #
+# | () () || (   ) || (    \/   ) (   | (    \/| () () || (   ) || (    )| MUD         #
+# | || || || (___) || |         | |   | |      | || || || (___) || (____)| Magic       #
+# | |(_)| ||  ___  || | ____    | |   | |      | |(_)| ||  ___  ||  _____) Mapper      #
+# | |   | || (   ) || | \_  )   | |   | |      | |   | || (   ) || (       Client      #
+# | )   ( || )   ( || (___) |___) (___| (____/\| )   ( || )   ( || )       (rag.com)   #
+# |/     \||/     \|(_______)\_______/(_______/|/     \||/     \||/                    #
+#   ______    __       _______         _______  _        _______           _______     #
+#  / ____ \  /  \     (  __   )       (  ___  )( \      (  ____ )|\     /|(  ___  )    #
+# ( (    \/  \/) )    | (  )  |       | (   ) || (      | (    )|| )   ( || (   ) |    #
+# | (____      | |    | | /   | _____ | (___) || |      | (____)|| (___) || (___) |    #
+# |  ___ \     | |    | (/ /) |(_____)|  ___  || |      |  _____)|  ___  ||  ___  |    #
+# | (   ) )    | |    |   / | |       | (   ) || |      | (      | (   ) || (   ) |    #
+# ( (___) )_ __) (_ _ |  (__) |       | )   ( || (____/\| )      | )   ( || )   ( | _  #
+#  \_____/(_)\____/(_)(_______)       |/     \|(_______/|/       |/     \||/     \|(_) #
+#                                                                                      #
+########################################################################################
+#
+# RAGNAROK MAGIC MAPPER SOURCE CODE: Build manifest for incremental map compiles
+#
+
+from RagnarokMUD.MagicMapper.MapSource import MapDefSymbol
+import os, os.path, hashlib, json
+
+MANIFEST_FILENAME = '.manifest'
+MANIFEST_VERSION = 2
+
+def encode_symbol_value(value):
+    '''Return the value of a realm global symbol in a form which can be saved
+    as JSON (a /name is saved as {"/": "name"}).  Raises ValueError if the
+    value isn't something we know how to save.'''
+    if isinstance(value, MapDefSymbol):
+        return {'/': value.name}
+    if isinstance(value, (list, tuple)):
+        return [encode_symbol_value(v) for v in value]
+    if isinstance(value, (str, int, float)):
+        return value
+    raise ValueError('cannot save global symbol value {0}'.format(repr(value)))
+
+def decode_symbol_value(data):
+    "Inverse of encode_symbol_value."
+    if isinstance(data, dict):
+        return MapDefSymbol(data['/'])
+    if isinstance(data, list):
+        return [decode_symbol_value(v) for v in data]
+    return data
+
+def symbol_fingerprint(value):
+    '''Return a short string which is different for different values of a
+    realm global symbol (or None if the symbol is undefined).'''
+    if value is None:
+        return None
+    try:
+        text = json.dumps(encode_symbol_value(value), sort_keys=True)
+    except ValueError:
+        text = repr(value)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()[:16]
+
+class BuildManifest (object):
+    '''Record of what make_world compiled on a previous run, kept in the
+    output directory so the next run can recompile only what changed.
+
+    The manifest is a JSON file <dest_tree>/.manifest of the form:
+      {
+        "version": 2,
+        "options": { compiler options the outputs depend on },
+        "files": {
+          "<source filename>": {
+            "creator": creator name or null for base maps,
+            "mtime":   source file modification time,
+            "size":    source file size in bytes,
+            "sha1":    hex digest of the source file's contents
+                       (null if it failed to compile),
+            "pages":   [page numbers the file contributed to],
+            "rooms":   [room IDs the file defined],
+            "room_pages": [page number of each of those rooms],
+            "reads":   {realm global symbol: fingerprint of the value it had
+                        before the file was read, for each one the file used},
+            "defines": {realm global symbol: fingerprint of the value the
+                        file left it with, for each one the file defined},
+            "values":  {realm global symbol: that value (see encode_symbol_value),
+                        or null if it can't be saved},
+            "room_symbols": {room ID: {symbol: fingerprint}} for the symbols
+                        each room's map read,
+            "bg_symbols": {page number: {symbol: fingerprint}} for the symbols
+                        the file's backgrounds for each page read
+          }, ...
+        }
+      }
+
+    (See symbol_fingerprint for what the fingerprints are.)
+
+    If the manifest is missing, unreadable, from a different version, or
+    was written with different compiler options, it is treated as empty
+    (so everything is considered changed).
+    '''
+
+    def __init__(self, dest_tree, options=None):
+        self.filename = os.path.join(dest_tree, MANIFEST_FILENAME)
+        self.options = options or {}
+        self.files = {}
+        self._stat_cache = {}
+        self.load()
+
+    def load(self):
+        "Read the manifest from disk, if there is a usable one."
+        self.files = {}
+        try:
+            with open(self.filename, encoding='utf-8') as manifest_file:
+                data = json.load(manifest_file)
+        except (OSError, ValueError):
+            return
+
+        if data.get('version') == MANIFEST_VERSION and data.get('options') == self.options:
+            self.files = data.get('files', {})
+
+    def save(self):
+        "Write the manifest to disk (replacing the old one all at once)."
+        dest_dir = os.path.dirname(self.filename)
+        if dest_dir and not os.path.exists(dest_dir):
+            os.makedirs(dest_dir)
+
+        with open(self.filename + '.new', 'w', encoding='utf-8') as manifest_file:
+            json.dump({
+                'version': MANIFEST_VERSION,
+                'options': self.options,
+                'files':   self.files,
+            }, manifest_file, indent=1, sort_keys=True)
+        os.replace(self.filename + '.new', self.filename)
+
+    def _file_signature(self, src_filename):
+        "Return (mtime, size, sha1) for a source file, hashing it only if needed."
+        if src_filename not in self._stat_cache:
+            st = os.stat(src_filename)
+            entry = self.files.get(src_filename)
+            if entry is not None and entry.get('sha1') and entry.get('mtime') == st.st_mtime and entry.get('size') == st.st_size:
+                digest = entry['sha1']
+            else:
+                with open(src_filename, 'rb') as source:
+                    digest = hashlib.sha1(source.read()).hexdigest()
+            self._stat_cache[src_filename] = (st.st_mtime, st.st_size, digest)
+        return self._stat_cache[src_filename]
+
+    def forget_signatures(self):
+        "Forget what we know about the source files on disk, so they will be looked at again (for long-running callers)."
+        self._stat_cache = {}
+
+    def file_changed(self, src_filename):
+        '''Has the source file changed since the manifest was written?
+        Files whose modification time and size are unchanged are assumed
+        to be the same without reading them; otherwise we compare the
+        content hash.  New files and files which failed to compile last
+        time are always considered changed.'''
+        entry = self.files.get(src_filename)
+        if entry is None or not entry.get('sha1'):
+            return True
+        return self._file_signature(src_filename)[2] != entry['sha1']
+
+    def files_to_compile(self, source_files, pages=None):
+        '''Given the list of (src_filename, creator_name) tuples found in
+        the source trees, return the set of filenames which need to be
+        recompiled.
+
+        That is every changed or new file, plus every file contributing
+        to any page which one of those files (or a removed file) contributed
+        to, repeated until nothing more is added.  If pages is given, files
+        contributing to those pages are included as well.
+
+        Files which use realm global symbols defined elsewhere are not
+        included just for that; see symbol_readers_changed.'''
+
+        dirty = set()
+        dirty_pages = set(pages or ())
+
+        present = set(src_filename for src_filename, creator_name in source_files)
+        for src_filename, entry in self.files.items():
+            if src_filename not in present:
+                dirty_pages.update(entry.get('pages', []))
+
+        for src_filename, creator_name in source_files:
+            if self.file_changed(src_filename):
+                dirty.add(src_filename)
+
+        while True:
+            added = False
+            for src_filename, creator_name in source_files:
+                if src_filename in dirty:
+                    entry = self.files.get(src_filename, {})
+                    if not dirty_pages.issuperset(entry.get('pages', [])):
+                        dirty_pages.update(entry.get('pages', []))
+                        added = True
+                elif dirty_pages.intersection(self.files.get(src_filename, {}).get('pages', [])):
+                    dirty.add(src_filename)
+                    added = True
+            if not added:
+                return dirty
+
+    def symbol_readers_changed(self, source_files, new_symbols=None):
+        '''Return the set of filenames from the (src_filename, creator_name)
+        source_files which read a realm global symbol that would now have
+        a different value when the file is read than it did when it was
+        last compiled, because a file before it in the same realm now
+        defines it differently (or not at all).
+
+        new_symbols maps the names of files which were just compiled to
+        their symbol_fields; for those, this is used instead of what
+        the manifest says.'''
+
+        new_symbols = new_symbols or {}
+        realms = {}
+        stale = set()
+        for src_filename, creator_name in source_files:
+            entry = new_symbols.get(src_filename, self.files.get(src_filename))
+            if entry is None:
+                continue
+            symbols = realms.setdefault(creator_name, {})
+            for symbol, fingerprint in entry.get('reads', {}).items():
+                if symbols.get(symbol) != fingerprint:
+                    stale.add(src_filename)
+            symbols.update(entry.get('defines', {}))
+        return stale
+
+    def symbol_seeds(self, source_files, dirty_files):
+        '''For compiling only the dirty_files from the (src_filename,
+        creator_name) source_files, work out the realm global symbols which
+        the other files (which we aren't going to read) would have defined.
+
+        Returns (seeds, trailing, missing).  seeds maps each dirty file to
+        the symbols defined by the files in its realm since the last dirty
+        one (to be added to the realm's symbols before compiling it), and
+        trailing maps each creator name to the symbols defined after the
+        last dirty file in that realm.  missing is the set of files whose
+        definitions we couldn't save, so they need to be compiled too.'''
+
+        seeds = {}
+        trailing = {}
+        missing = set()
+        for src_filename, creator_name in source_files:
+            pending = trailing.setdefault(creator_name, {})
+            if src_filename in dirty_files:
+                seeds[src_filename] = dict(pending)
+                pending.clear()
+                continue
+            values = self.files.get(src_filename, {}).get('values', {})
+            for symbol, value in values.items():
+                if value is None:
+                    missing.add(src_filename)
+                else:
+                    pending[symbol] = decode_symbol_value(value)
+        return seeds, trailing, missing
+
+    @staticmethod
+    def symbol_fields(file_symbols):
+        '''Convert the symbol use recorded for a file by MapSource.add_from_file
+        into the fields kept for it in the manifest.'''
+        values = {}
+        for symbol, value in file_symbols.get('defines', {}).items():
+            try:
+                values[symbol] = encode_symbol_value(value)
+            except ValueError:
+                values[symbol] = None
+        return {
+            'reads':   dict((symbol, symbol_fingerprint(value)) for symbol, value in file_symbols.get('reads', {}).items()),
+            'defines': dict((symbol, symbol_fingerprint(value)) for symbol, value in file_symbols.get('defines', {}).items()),
+            'values':  values,
+            'room_symbols': dict((room_id, dict((symbol, symbol_fingerprint(value)) for symbol, value in symbols.items()))
+                for room_id, symbols in file_symbols.get('rooms', {}).items()),
+            'bg_symbols': dict((str(page_no), dict((symbol, symbol_fingerprint(value)) for symbol, value in symbols.items()))
+                for page_no, symbols in file_symbols.get('bg', {}).items()),
+        }
+
+    def room_symbols(self, src_filenames):
+        "Return a dictionary mapping room ID to the symbol fingerprints its map read, for the rooms from the given files."
+        rooms = {}
+        for src_filename in src_filenames:
+            rooms.update(self.files.get(src_filename, {}).get('room_symbols', {}))
+        return rooms
+
+    def rooms_defined(self, exclude=()):
+        "Return a dictionary mapping room ID to page number for all rooms in the manifest, except for those from the excluded files."
+        rooms = {}
+        for src_filename, entry in self.files.items():
+            if src_filename not in exclude:
+                for room_id, page_no in zip(entry.get('rooms', []), entry.get('room_pages', [])):
+                    rooms[room_id] = page_no
+        return rooms
+
+    def pages_defined(self, exclude=()):
+        "Return the set of page numbers contributed to by files in the manifest, except for the excluded files."
+        pages = set()
+        for src_filename, entry in self.files.items():
+            if src_filename not in exclude:
+                pages.update(entry.get('pages', []))
+        return pages
+
+    def record_file(self, src_filename, creator_name, rooms, ok=True, symbols=None):
+        '''Note that the source file was compiled, producing the given rooms
+        (a list of (room_id, page_number) tuples).  If ok is false, the file
+        had errors, so it will be considered changed on the next run.
+        symbols is the file's symbol_fields, if known.'''
+        mtime, size, digest = self._file_signature(src_filename)
+        self.files[src_filename] = {
+            'creator':    creator_name,
+            'mtime':      mtime,
+            'size':       size,
+            'sha1':       digest if ok else None,
+            'pages':      sorted(set(page_no for room_id, page_no in rooms)),
+            'rooms':      [room_id for room_id, page_no in rooms],
+            'room_pages': [page_no for room_id, page_no in rooms],
+        }
+        if symbols is not None:
+            self.files[src_filename].update(symbols)
+
+    def forget_file(self, src_filename):
+        "Remove a source file from the manifest."
+        self.files.pop(src_filename, None)
+        self._stat_cache.pop(src_filename, None)
+#@[00]@| Ragnarok MagicMapper 6.1.0-alpha.0
+#@[01]@|
+#@[10]@| Copyright © 2010, 2018, 2020, 2021, 2022 by Steven L. Willoughby, Aloha, Oregon, USA.
+#@[11]@| All Rights Reserved. Licensed under the terms and conditions of the BSD-3-Clause
+#@[12]@| License as described in the accompanying LICENSE file distributed with MagicMapper.
+#@[13]@|
+#@[20]@| Based on earlier code from the Ragnarok MudShell (MSH) client,
+#@[21]@| Copyright © 1993, 2000-2003 by Steven L. Willoughby, Aloha, Oregon, USA.
+#@[22]@| MSH is licensed under the terms and conditions of the BSD-3-Clause
+#@[23]@|
+#@[30]@| Redistribution and use in source and binary forms, with or without
+#@[31]@| modification, are permitted provided that the following conditions
+#@[32]@| are met:
+#@[33]@| 1. Redistributions of source code must retain the above copyright
+#@[34]@|    notice, this list of conditions and the following disclaimer.
+#@[35]@| 2. Redistributions in binary form must reproduce the above copy-
+#@[36]@|    right notice, this list of conditions and the following dis-
+#@[37]@|    claimer in the documentation and/or other materials provided
+#@[38]@|    with the distribution.
+#@[39]@| 3. Neither the name of the copyright holder nor the names of its
+#@[40]@|    contributors may be used to endorse or promote products derived
+#@[41]@|    from this software without specific prior written permission.
+#@[42]@|
+#@[43]@| THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND
+#@[44]@| CONTRIBUTORS “AS IS” AND ANY EXPRESS OR IMPLIED WARRANTIES,
+#@[45]@| INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+#@[46]@| MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+#@[47]@| DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS
+#@[48]@| BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY,
+#@[49]@| OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+#@[50]@| PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+#@[51]@| PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+#@[52]@| THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+#@[53]@| TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF
+#@[54]@| THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+#@[55]@| SUCH DAMAGE.
+#@[56]@|
+#@[60]@| This software is not intended for any use or application in which
+#@[61]@| the safety of lives or property would be at risk due to failure or
+#@[62]@| defect of the software.
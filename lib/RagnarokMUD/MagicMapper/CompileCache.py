@@ -0,0 +1,247 @@
+########################################################################################
+#  _______  _______  _______ _________ _______  _______  _______  _______              #
+# (       )(  ___  )(  ____ \\__   __/(  ____ \(       )(  ___  )(  ____ ) Ragnarok    #
+# | () () || (   ) || (    \/   ) (   | (    \/| () () || (   ) || (    )| MUD         #
+# | || || || (___) || |         | |   | |      | || || || (___) || (____)| Magic       #
+# | |(_)| ||  ___  || | ____    | |   | |      | |(_)| ||  ___  ||  _____) Mapper      #
+# | |   | || (   ) || | \_  )   | |   | |      | |   | || (   ) || (       Client      #
+# | )   ( || )   ( || (___) |___) (___| (____/\| )   ( || )   ( || )       (rag.com)   #
+# |/     \||/     \|(_______)\_______/(_______/|/     \||/     \||/                    #
+#   ______    __       _______         _______  _        _______           _______     #
+#  / ____ \  /  \     (  __   )       (  ___  )( \      (  ____ )|\     /|(  ___  )    #
+# ( (    \/  \/) )    | (  )  |       | (   ) || (      | (    )|| )   ( || (   ) |    #
+# | (____      | |    | | /   | _____ | (___) || |      | (____)|| (___) || (___) |    #
+# |  ___ \     | |    | (/ /) |(_____)|  ___  || |      |  _____)|  ___  ||  ___  |    #
+# | (   ) )    | |    |   / | |       | (   ) || |      | (      | (   ) || (   ) |    #
+# ( (___) )_ __) (_ _ |  (__) |       | )   ( || (____/\| )      | )   ( || )   ( | _  #
+#  \_____/(_)\____/(_)(_______)       |/     \|(_______/|/       |/     \||/     \|(_) #
+#                                                                                      #
+########################################################################################
+#
+# RAGNAROK MAGIC MAPPER SOURCE CODE: On-disk cache of compiled map blocks
+#
+
+from RagnarokMUD.MagicMapper.BuildManifest import encode_symbol_value, decode_symbol_value, symbol_fingerprint
+import RagnarokMUD.MagicMapper.BasicUnits
+import RagnarokMUD.MagicMapper.MapFlags
+import RagnarokMUD.MagicMapper.MapSource
+import os, os.path, hashlib, json
+
+CACHE_FORMAT_VERSION = 1
+DEFAULT_CACHE_SIZE = 256 * 1024 * 1024
+
+#
+# The modules whose code determines what a map block compiles into.
+#
+_COMPILER_MODULES = (
+    RagnarokMUD.MagicMapper.MapSource,
+    RagnarokMUD.MagicMapper.MapFlags,
+    RagnarokMUD.MagicMapper.BasicUnits,
+)
+
+_compiler_version = None
+
+def compiler_version():
+    '''Return a string identifying the map compiler: the cache format version
+    and a hash of the source code of the compiler and the modules it gets
+    element codes and values from, so that anything compiled by a different
+    version of them is never used.'''
+    global _compiler_version
+    if _compiler_version is None:
+        digest = hashlib.sha1()
+        for module in _COMPILER_MODULES:
+            source_file = module.__file__
+            if source_file.endswith('.pyc'):
+                source_file = source_file[:-1]
+            with open(source_file, 'rb') as source:
+                digest.update(hashlib.sha1(source.read()).digest())
+        _compiler_version = '{0}:{1}'.format(CACHE_FORMAT_VERSION, digest.hexdigest())
+    return _compiler_version
+
+class CompileCache (object):
+    '''A cache of compiled map blocks (the contents of map and bg fields),
+    kept as files in a plain directory so it survives between builds and
+    can be shared between build hosts (e.g., over NFS).
+
+    A block's compiled element list depends on its source text, the values
+    of any realm global symbols it reads, and the compiler itself, so the
+    cache is keyed by a hash of all three.  Since we can't know which
+    symbols a block reads until we compile it, this takes two files:
+        <directory>/xx/<source key>.s   the names of the symbols the block
+                                        read the last time it was compiled
+        <directory>/xx/<block key>.c    the compiled block for a particular
+                                        set of values of those symbols
+    where the source key is the hash of the source text and compiler
+    version, the block key adds the values of the symbols to that, and xx
+    is the first two characters of the key.  The .c file holds a JSON
+    object:
+        {
+          "elements": the compiled element list,
+          "defines":  {symbol: value} for realm global symbols the block
+                      defines (see BuildManifest.encode_symbol_value),
+          "own_reads": [symbols the block read after defining them itself]
+        }
+    Blocks which fail to compile, or which define symbols whose values
+    can't be saved, aren't cached.
+
+    Files are written under temporary names and renamed into place, so
+    several builds can use the same cache at once.  Each time a cached
+    block is used, its file's modification time is updated; trim removes
+    the least recently used files once the cache is bigger than max_size
+    bytes.
+
+    The hits and misses attributes count how many blocks were found or
+    not found in the cache.
+    '''
+
+    def __init__(self, directory, max_size=DEFAULT_CACHE_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+    def _filename(self, key, suffix):
+        return os.path.join(self.directory, key[:2], key + suffix)
+
+    def _read(self, filename):
+        try:
+            with open(filename, encoding='utf-8') as cache_file:
+                return json.load(cache_file)
+        except (OSError, ValueError):
+            return None
+
+    def _write(self, filename, data):
+        try:
+            text = json.dumps(data, separators=(',', ':'))
+        except (TypeError, ValueError):
+            return
+        try:
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            temp_name = '{0}.{1}.tmp'.format(filename, os.getpid())
+            with open(temp_name, 'w', encoding='utf-8') as cache_file:
+                cache_file.write(text)
+            os.replace(temp_name, filename)
+        except OSError:
+            pass
+
+    def _block_key(self, source_key, global_symbols, symbols):
+        return hashlib.sha1(json.dumps([source_key] + [[symbol, symbol_fingerprint(global_symbols.get(symbol))]
+            for symbol in sorted(symbols)]).encode('utf-8')).hexdigest()
+
+    def compile(self, map_source, source, global_symbols):
+        '''Return map_source.compile(source, global_symbols=global_symbols),
+        taking it from the cache if we can.  Either way, global_symbols
+        and map_source.symbols_read end up as compile would have left them.'''
+
+        source_key = hashlib.sha1((compiler_version() + '\0' + source).encode('utf-8')).hexdigest()
+        symbols = self._read(self._filename(source_key, '.s'))
+        if isinstance(symbols, list):
+            block_filename = self._filename(self._block_key(source_key, global_symbols, symbols), '.c')
+            block = self._read(block_filename)
+            if isinstance(block, dict) and all(field in block for field in ('elements', 'defines', 'own_reads')):
+                try:
+                    os.utime(block_filename)
+                except OSError:
+                    pass
+                self.hits += 1
+                map_source.symbols_read = dict((symbol, global_symbols.get(symbol)) for symbol in symbols)
+                for symbol, value in block['defines'].items():
+                    global_symbols[symbol] = decode_symbol_value(value)
+                for symbol in block['own_reads']:
+                    map_source.symbols_read[symbol] = global_symbols.get(symbol)
+                map_source.token_count = 0
+                map_source.loop_iterations = 0
+                map_source.steps = 0
+                map_source.operations_removed = 0
+                return block['elements']
+
+        self.misses += 1
+        incoming = dict(global_symbols)
+        elements = map_source.compile(source, global_symbols=global_symbols)
+        try:
+            defines = dict((symbol, encode_symbol_value(value)) for symbol, value in global_symbols.items()
+                if symbol not in incoming or incoming[symbol] is not value)
+        except ValueError:
+            return elements
+
+        symbols = sorted(map_source.symbols_read)
+        #
+        # the block key uses the values the symbols had before this block
+        # was compiled, which are the ones in incoming.
+        #
+        self._write(self._filename(self._block_key(source_key, incoming, symbols), '.c'),
+            {'elements': elements, 'defines': defines, 'own_reads': [symbol for symbol in symbols
+                if symbol not in incoming or map_source.symbols_read[symbol] is not incoming[symbol]]})
+        self._write(self._filename(source_key, '.s'), symbols)
+        return elements
+
+    def trim(self):
+        '''If the cache holds more than max_size bytes, remove the least
+        recently used files until it doesn't.  Returns the number of files
+        removed.'''
+
+        entries = []
+        total = 0
+        for dir_entry in os.scandir(self.directory) if os.path.isdir(self.directory) else ():
+            if not dir_entry.is_dir():
+                continue
+            for cache_entry in os.scandir(dir_entry.path):
+                try:
+                    st = cache_entry.stat()
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, cache_entry.path))
+                total += st.st_size
+
+        removed = 0
+        entries.sort()
+        for mtime, size, path in entries:
+            if total <= self.max_size:
+                break
+            try:
+                os.unlink(path)
+                removed += 1
+            except OSError:
+                pass
+            total -= size
+        return removed
+#@[00]@| Ragnarok MagicMapper 6.1.0-alpha.0
+#@[01]@|
+#@[10]@| Copyright © 2010, 2018, 2020, 2021, 2022 by Steven L. Willoughby, Aloha, Oregon, USA.
+#@[11]@| All Rights Reserved. Licensed under the terms and conditions of the BSD-3-Clause
+#@[12]@| License as described in the accompanying LICENSE file distributed with MagicMapper.
+#@[13]@|
+#@[20]@| Based on earlier code from the Ragnarok MudShell (MSH) client,
+#@[21]@| Copyright © 1993, 2000-2003 by Steven L. Willoughby, Aloha, Oregon, USA.
+#@[22]@| MSH is licensed under the terms and conditions of the BSD-3-Clause
+#@[23]@|
+#@[30]@| Redistribution and use in source and binary forms, with or without
+#@[31]@| modification, are permitted provided that the following conditions
+#@[32]@| are met:
+#@[33]@| 1. Redistributions of source code must retain the above copyright
+#@[34]@|    notice, this list of conditions and the following disclaimer.
+#@[35]@| 2. Redistributions in binary form must reproduce the above copy-
+#@[36]@|    right notice, this list of conditions and the following dis-
+#@[37]@|    claimer in the documentation and/or other materials provided
+#@[38]@|    with the distribution.
+#@[39]@| 3. Neither the name of the copyright holder nor the names of its
+#@[40]@|    contributors may be used to endorse or promote products derived
+#@[41]@|    from this software without specific prior written permission.
+#@[42]@|
+#@[43]@| THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND
+#@[44]@| CONTRIBUTORS “AS IS” AND ANY EXPRESS OR IMPLIED WARRANTIES,
+#@[45]@| INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+#@[46]@| MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+#@[47]@| DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS
+#@[48]@| BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY,
+#@[49]@| OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+#@[50]@| PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+#@[51]@| PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+#@[52]@| THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+#@[53]@| TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF
+#@[54]@| THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+#@[55]@| SUCH DAMAGE.
+#@[56]@|
+#@[60]@| This software is not intended for any use or application in which
+#@[61]@| the safety of lives or property would be at risk due to failure or
+#@[62]@| defect of the software.
@@ -105,6 +105,7 @@ class ConfigurationManager (configparser.SafeConfigParser):
                 },
                 'server': {
                     'base_url':             'https://www.rag.com/magicmap',
+                    'data_format':          '6',     # 7 for binary map data
                 },
         }.items():
             self.add_section(section_name)
@@ -33,6 +33,15 @@ import RagnarokMUD.MagicMapper.MapPage
 from   RagnarokMUD.MagicMapper.GUI.ScrolledCanvas import ScrolledCanvas
 from   RagnarokMUD.MagicMapper.BasicUnits         import Point, Color, GreyLevel, FontSelection, DashPattern
 from   RagnarokMUD.MagicMapper.Bezier             import make_bezier
+from   RagnarokMUD.MagicMapper.MapFlags           import flag_mask, CURRENT_LOCATION, ROOM_DARK, \
+                                                         ROOM_OUTDOOR, ROOM_PHANTOM, ROOM_PROTO, \
+                                                         ROOM_TEXTFONT, EXIT_CONCEALED, EXIT_DOOR, \
+                                                         EXIT_DOORWAYS, EXIT_DOUBLE, EXIT_GAPS, \
+                                                         EXIT_IN, EXIT_LOCKED, EXIT_MAGIC, \
+                                                         EXIT_OFFPAGE, EXIT_OUT, EXIT_PORTCULLIS, \
+                                                         EXIT_SECRET, EXIT_SPECIAL, EXIT_TURNSTILE, \
+                                                         PATH_BEZIER, PATH_CLOSED, PATH_FILLED, \
+                                                         PATH_SPLINE
 
 class MapDataFormatError (Exception):
     "Problem with internal data representation of the map locations."
@@ -74,8 +83,6 @@ class MapCanvas (ScrolledCanvas):
         self._shade_pattern = re.compile(r'\$(\d\d)')
         self._color_pattern = re.compile(r'\#([0-9a-fA-F]{6})')
         self._xcolor_pattern = re.compile(r'\*([0-9a-fA-F]{6})')
-        self._exit_pattern = re.compile(r'[MDgpTCSt]')
-        self._gap_pattern = re.compile(r'[MgpT]')
         self.config = config
         self.zoom_factor = 1.0
         self.image_dir = image_dir
@@ -286,14 +293,15 @@ class MapCanvas (ScrolledCanvas):
         #
         dash_pattern = None
         x_color = None
+        mask = flag_mask(flags)
 
-        line_width = 2 if 'o' in flags else 1
-        if '@' in flags:
-            line_color = Color(.5,.5,0) if 'o' in flags else Color(1,0,0)
-            door_color = fill_color = Color(.7,.7,0) if 'd' in flags else Color(1,1,0)
+        line_width = 2 if mask & ROOM_OUTDOOR else 1
+        if mask & CURRENT_LOCATION:
+            line_color = Color(.5,.5,0) if mask & ROOM_OUTDOOR else Color(1,0,0)
+            door_color = fill_color = Color(.7,.7,0) if mask & ROOM_DARK else Color(1,1,0)
         else:
-            line_color = GreyLevel(.5) if 'o' in flags else GreyLevel(0)
-            fill_color = GreyLevel(.7) if 'd' in flags else GreyLevel(1)      
+            line_color = GreyLevel(.5) if mask & ROOM_OUTDOOR else GreyLevel(0)
+            fill_color = GreyLevel(.7) if mask & ROOM_DARK else GreyLevel(1)      
             door_color = GreyLevel(1)
 
         shade = self._shade_pattern.search(flags)
@@ -311,7 +319,7 @@ class MapCanvas (ScrolledCanvas):
                             int(xcolor.group(1)[2:4], 16) / 255.0,
                             int(xcolor.group(1)[4:6], 16) / 255.0)
 
-        if 'p' in flags:
+        if mask & ROOM_PROTO:
             dash_pattern = DashPattern([4,3], 0)
             
         return (line_color, line_width, fill_color, dash_pattern, door_color, x_color)
@@ -361,12 +369,12 @@ class MapCanvas (ScrolledCanvas):
         p2 = self._pos_map2tk(Point(x+radius, y-radius))
         if self.current_dash_pattern is None:
             self.canvas.create_oval(p1.x, p1.y, p2.x, p2.y, 
-                fill=self.current_color.rgb if 'f' in flags else '',
+                fill=self.current_color.rgb if flag_mask(flags) & PATH_FILLED else '',
                 outline=self.current_color.rgb, width=self._width(self.current_line_width))
         else:
             self.canvas.create_oval(p1.x, p1.y, p2.x, p2.y, 
                 dash=self._dash(self.current_dash_pattern.pattern), dashoffset=self._width(self.current_dash_pattern.offset),
-                fill=self.current_color.rgb if 'f' in flags else '',
+                fill=self.current_color.rgb if flag_mask(flags) & PATH_FILLED else '',
                 outline=self.current_color.rgb, width=self._width(self.current_line_width))
 
     def draw_map_arc(self, flags, vlist):
@@ -389,7 +397,7 @@ class MapCanvas (ScrolledCanvas):
         if self.current_dash_pattern is not None:
             opts['dash'] = self._dash(self.current_dash_pattern.pattern)
             opts['dashoffset'] = self._width(self.current_dash_pattern.offset)
-        if 'f' in flags:
+        if flag_mask(flags) & PATH_FILLED:
             opts['fill'] = self.current_color.rgb
             opts['style'] = tk.PIESLICE
 
@@ -398,8 +406,9 @@ class MapCanvas (ScrolledCanvas):
     def draw_map_polygon(self, flags, coord_list):
         "[Pflags, [x0, y0, x1, y1, ..., xn, yn]] -> draw (maybe fill) polygon through points"
         points = self._normalize_point_list(coord_list)
+        mask = flag_mask(flags)
 
-        if 'b' in flags:
+        if mask & PATH_BEZIER:
             #
             # coord list are set of control points for Bézier curve; convert that to the
             # actual points now
@@ -412,7 +421,7 @@ class MapCanvas (ScrolledCanvas):
             'width': self._width(self.current_line_width),
         }
 
-        if 's' in flags:
+        if mask & PATH_SPLINE:
             opts['smooth'] = 1
             opts['splinesteps'] = self.spline_points
 
@@ -420,10 +429,10 @@ class MapCanvas (ScrolledCanvas):
             opts['dash'] = self._dash(self.current_dash_pattern.pattern)
             opts['dashoffset'] = self._width(self.current_dash_pattern.offset)
 
-        if 'f' in flags:
+        if mask & PATH_FILLED:
             self.canvas.create_polygon(*points, fill=self.current_color.rgb,
                 outline=self.current_color.rgb, **opts)
-        elif 'c' in flags:
+        elif mask & PATH_CLOSED:
             self.canvas.create_polygon(*points, fill='', outline=self.current_color.rgb, **opts)
         else:
             self.canvas.create_line(*points, fill=self.current_color.rgb, **opts)
@@ -449,7 +458,8 @@ class MapCanvas (ScrolledCanvas):
         p1 = self._pos_map2tk(Point(x, y+h))
         p2 = self._pos_map2tk(Point(x+w, y))
 
-        if 'x' not in flags:
+        mask = flag_mask(flags)
+        if not mask & ROOM_PHANTOM:
             self.canvas.create_rectangle(p1.x, p1.y, p2.x, p2.y, **opts)
 
         if x_color is not None:
@@ -457,7 +467,7 @@ class MapCanvas (ScrolledCanvas):
         else:
             self.set_map_color(GreyLevel(0))
 
-        if 'f' not in flags:
+        if not mask & ROOM_TEXTFONT:
             self.set_map_font(FontSelection('t',8))
 
         cx = x + w/2
@@ -488,8 +498,8 @@ class MapCanvas (ScrolledCanvas):
                 'd':    (Point(-RR.x, -RR.y), Point(-R.x,-R.y), Point(-1, -1), True ),
         }
 
-        def extended(start, length, code):
-            if 'x' in code:
+        def extended(start, length, mask):
+            if mask & EXIT_OFFPAGE:
                 max_point = Point(700,580) if self.landscape else Point(580,700)
                 min_point = Point(30,30)
                 return Point(
@@ -504,6 +514,7 @@ class MapCanvas (ScrolledCanvas):
 
             V, V2, U, tilted = vectors[direction_code[0]]
             x_color = self._color_from_flags(direction_code)[5]
+            mask = flag_mask(direction_code[1:])
             
             # U is our unit vector showing the direction from start_point
             start_point = center + V
@@ -526,7 +537,7 @@ class MapCanvas (ScrolledCanvas):
             #SW -1,-1   -  -√8,-√8
             #
             corridor_start_point = start_point.clone()
-            if 'D' in direction_code or 'T' in direction_code:
+            if mask & (EXIT_DOOR | EXIT_TURNSTILE):
                 if not tilted:
                     corridor_start_point += U * Point(4,4) 
                 elif circular:
@@ -536,22 +547,22 @@ class MapCanvas (ScrolledCanvas):
                 # draw line from center+V to the point length*L from there in x and y directions
                 L = U.clone()
                 L.scale(corridor_length)
-                end_point = extended(center + V2, L, direction_code)
+                end_point = extended(center + V2, L, mask)
 
                 opts = {
                     'width': self._width(1),
                     'fill': '#000000' if x_color is None else x_color.rgb,
                 }
-                if 'i' in direction_code:           # although, really, this is kind of silly...
-                    if 'o' in direction_code:       # an in-only and out-only corridor is kind of 
+                if mask & EXIT_IN:                  # although, really, this is kind of silly...
+                    if mask & EXIT_OUT:             # an in-only and out-only corridor is kind of 
                         opts['arrow'] = tk.BOTH     # just a corridor :)
                     else:                           
                         opts['arrow'] = tk.FIRST    
 
-                elif 'o' in direction_code:
+                elif mask & EXIT_OUT:
                     opts['arrow'] = tk.LAST
 
-                if '!' in direction_code:
+                if mask & EXIT_SPECIAL:
                     opts['dash'] = self._dash([4,2])
                     opts['dashoffset'] = 0
 
@@ -585,7 +596,7 @@ class MapCanvas (ScrolledCanvas):
             #                       P4        P6 P2      P3
             #
                 
-            if self._exit_pattern.search(direction_code):
+            if mask & EXIT_DOORWAYS:
                 Ps = self._pos_map2tk(start_point)
                 if tilted:
                     # 45 degree angled doors for diagonal exits
@@ -619,15 +630,15 @@ class MapCanvas (ScrolledCanvas):
                 #
                 # gap doorways and magical portals
                 #
-                if self._gap_pattern.search(direction_code):
+                if mask & EXIT_GAPS:
                     if tilted:
                         # gap
                         self.canvas.create_polygon(P1.x, P1.y, P2.x, P2.y, Ps.x, Ps.y,
                             fill=fill_color.rgb, outline=fill_color.rgb, width=self._width(line_width))
                         # portal
-                        if 'M' in direction_code:
+                        if mask & EXIT_MAGIC:
                             if tilted and not circular:
-                                if 'D' in direction_code:
+                                if mask & EXIT_DOOR:
                                     self.canvas.create_line(P1.x, P1.y, P2.x, P2.y,
                                         fill=portal_color.rgb, width=self._width(4))
                                 else:
@@ -641,20 +652,20 @@ class MapCanvas (ScrolledCanvas):
                         self.canvas.create_line(P1a.x, P1a.y, P2a.x, P2a.y,
                             fill=fill_color.rgb, width=self._width(line_width))
                         # portal
-                        if 'M' in direction_code:
+                        if mask & EXIT_MAGIC:
                             self.canvas.create_line(P1a.x, P1a.y, P2a.x, P2a.y,
                                 fill=portal_color.rgb, width=self._width(4))
                     #
                     # portcullis
                     #
-                    if 'p' in direction_code:
+                    if mask & EXIT_PORTCULLIS:
                         self._draw_tk_dot(P1a, self._width(1.9), exit_color)
                         self._draw_tk_dot(Ps,  self._width(1.9), exit_color)
                         self._draw_tk_dot(P2a, self._width(1.9), exit_color)
                     #
                     # turnstile
                     #
-                    if 'T' in direction_code:
+                    if mask & EXIT_TURNSTILE:
                         r = self._width(3)
                         s3_2 = math.sqrt(3)/2
                         p = P5 if tilted and not circular else Ps
@@ -667,32 +678,32 @@ class MapCanvas (ScrolledCanvas):
                 #
                 # secret doors
                 #
-                elif 'S' in direction_code:
+                elif mask & EXIT_SECRET:
                     self.canvas.create_text(Ps.x, Ps.y, anchor=tk.CENTER, fill=exit_color.rgb,
                         font=self.font_cache[self.load_font(FontSelection('s', 10))], text="S")
                 #
                 # concealed doors
                 #
-                elif 'C' in direction_code:
+                elif mask & EXIT_CONCEALED:
                     self.canvas.create_text(Ps.x, Ps.y, anchor=tk.CENTER, fill=exit_color.rgb,
                         font=self.font_cache[self.load_font(FontSelection('s', 10))], text="C")
                 #
                 # normal doors
                 #
-                elif 'D' in direction_code:
+                elif mask & EXIT_DOOR:
                     if tilted:
                         self.canvas.create_polygon(P1.x, P1.y, P2.x, P2.y, P4.x, P4.y, P3.x, P3.y,
                             fill=door_color.rgb, outline=exit_color.rgb, width=self._width(1))
                     else:
                         self.canvas.create_rectangle(P1.x, P1.y, P2.x, P2.y,
                             fill=door_color.rgb, outline=exit_color.rgb, width=self._width(1))
-                    if '2' in direction_code:
+                    if mask & EXIT_DOUBLE:
                         self.canvas.create_line(P5.x, P5.y, P6.x, P6.y,
                             fill=exit_color.rgb, width=self._width(1))
                 #
                 # locked exits
                 #
-                if 'L' in direction_code:
+                if mask & EXIT_LOCKED:
                     if tilted:
                         self.canvas.create_line(P1.x, P1.y, P4.x, P4.y, width=self._width(1), fill=exit_color.rgb)
                         self.canvas.create_line(P2.x, P2.y, P3.x, P3.y, width=self._width(1), fill=exit_color.rgb)
@@ -716,7 +727,8 @@ class MapCanvas (ScrolledCanvas):
             opts['dash'] = self._dash(dash_pattern.pattern)
             opts['dashoffset'] = self._width(dash_pattern.offset)
 
-        if 'x' not in flags:
+        mask = flag_mask(flags)
+        if not mask & ROOM_PHANTOM:
             self.canvas.create_oval(p1.x, p1.y, p2.x, p2.y, **opts)
 
         #
@@ -727,10 +739,10 @@ class MapCanvas (ScrolledCanvas):
         else:
             self.set_map_color(x_color.rgb)
 
-        if 'f' not in flags:
+        if not mask & ROOM_TEXTFONT:
             self.set_map_font(FontSelection('t',8))
 
-        if 'x' not in flags:
+        if not mask & ROOM_PHANTOM:
             if t2:
                 self._fit_map_text('s', x-radius, y, radius*2, 0, t1)
                 self._fit_map_text('n', x-radius, y, radius*2, 0, t2)
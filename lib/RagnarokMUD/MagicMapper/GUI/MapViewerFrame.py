@@ -15,12 +15,12 @@ import re
 import platform # needed for correct mouse wheel handling
 
 from glob    import glob
-from fnmatch import fnmatch
 
 from RagnarokMUD.MagicMapper.GUI.MapCanvas import MapCanvas
 from RagnarokMUD.MagicMapper.MapSource     import MapSource, MapFileFormatError, DuplicateRoomError
 from RagnarokMUD.MagicMapper.MapManager    import MapManager
 from RagnarokMUD.MagicMapper.BasicUnits    import Point
+from RagnarokMUD.MagicMapper.SourceTreeScanner import SourceTreeScanner
 
 class KeyBindingDef:
     def __init__(self, label, keycode):
@@ -336,16 +336,15 @@ class MapPreviewFrame (MapViewerFrame):
             root_list, map_file_list = map_file_list, []
             if self.verbose > 1:
                 print("starting recursion with root_list={}, map_file_list={}".format(root_list, map_file_list))
-            for root in root_list:
-                if self.verbose > 1: print("reload(): recursing:", root)
-                for dirpath, dirnames, filenames in os.walk(root):
-                    if self.verbose > 1: print("reload(): recursing:", root, "--(", dirpath, dirnames, filenames, ")--")
-                    map_file_list.extend([os.path.join(dirpath, f) for f in filenames if fnmatch(f, self.pattern)])
-            if self.verbose > 1: print("reload(): map_file_list=", map_file_list)
+            # search everywhere os.walk would have, and symlinked directories too
+            scanner = SourceTreeScanner(pattern=self.pattern, follow_links=True, hidden_dirs=True)
+            map_file_list.extend([map_file for map_file, creator in scanner.scan(root_list)])
+            if self.verbose > 1: print("reload(): map_file_list=", map_file_list, "(examined", scanner.entries_visited, "directory entries)")
         #
         # Load and compile them into memory
         #
         self.world_map = MapSource()
+        self.world_map.diagnostics = []     # report every problem in the files, not just the first
 
         for map_file in map_file_list:
             if self.verbose: print("*** Loading {0} ***".format(map_file))
@@ -370,6 +369,18 @@ class MapPreviewFrame (MapViewerFrame):
                     tk.messagebox.showerror(title="Compilation Error", message='Error in {}:\n{}'.format( map_file, problem))
                     return
 
+        if self.world_map.diagnostics:
+            for diagnostic in self.world_map.diagnostics:
+                print("ERROR in {0}".format(diagnostic))
+            if not self.ignore_errors:
+                print("Processing stopped on {0} map error{1} (use --ignore-errors to avoid this).".format(
+                    len(self.world_map.diagnostics), '' if len(self.world_map.diagnostics)==1 else 's'))
+                tk.messagebox.showerror(title="Compilation Error", message='{0} error{1} found:\n{2}'.format(
+                    len(self.world_map.diagnostics), '' if len(self.world_map.diagnostics)==1 else 's',
+                    '\n'.join([str(diagnostic) for diagnostic in self.world_map.diagnostics[:20]])
+                    + ('\n...' if len(self.world_map.diagnostics) > 20 else '')))
+                return
+
         if self.verbose:
             print("\n*** Loaded {0} page{1} ({2} room{3}) from {4} map source file{5}. ***".format(
                 len(self.world_map.pages), '' if len(self.world_map.pages)==1 else 's',
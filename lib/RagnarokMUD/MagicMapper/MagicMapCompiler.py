@@ -21,14 +21,19 @@
 # RAGNAROK MAGIC MAPPER SOURCE CODE: Map Compiler
 #
 
-from RagnarokMUD.MagicMapper.MapSource      import MapSource, PostScriptMapSource, MapFileFormatError
+from RagnarokMUD.MagicMapper.MapSource      import MapSource, PostScriptMapSource, MapFileFormatError, MapDiagnostic
 from RagnarokMUD.MagicMapper.MapPage        import MapPage, LANDSCAPE
 from RagnarokMUD.MagicMapper.MapRoom        import MapRoom
-from RagnarokMUD.MagicMapper.MapDataHandler import MapDataHandler
+from RagnarokMUD.MagicMapper.MapDataHandler import MapDataHandler, footer_fields, BINARY_FORMAT_VERSION, BINARY_FILE_SUFFIX
 from RagnarokMUD.MagicMapper.Local          import gen_public_room_id
-import os, os.path, datetime, re, sys, time
+from RagnarokMUD.MagicMapper.BuildManifest  import BuildManifest
+from RagnarokMUD.MagicMapper.SourceTreeScanner import SourceTreeScanner
+from RagnarokMUD.MagicMapper.MapProfile     import MapProfile
+from RagnarokMUD.MagicMapper.CompileCache   import CompileCache, DEFAULT_CACHE_SIZE
+import os, os.path, datetime, sys, time
+import concurrent.futures, itertools, gzip, array, pickle
 
-def make_world(source_trees, dest_tree, creator_from_path=False, ignore_errors=False, enforce_creator=True, verbosity=0):
+def make_world(source_trees, dest_tree, creator_from_path=False, ignore_errors=False, enforce_creator=True, verbosity=0, jobs=1, incremental=False, bundles=False, compress=False, profile=None, cache=None, cache_size=DEFAULT_CACHE_SIZE, optimize=False, max_steps=None, time_limit=None, binary=False):
     '''Perform the work of compiling MUD-side files to our digested format.
 
     If the optional creator_from_path parameter is True, then the creator
@@ -51,186 +56,723 @@ def make_world(source_trees, dest_tree, creator_from_path=False, ignore_errors=F
     If ignore_errors is set, exceptions raised during operations will be
     reported but not allowed to stop execution of the overall map (although
     the realms where errors occurred may be incomplete).
+
+    If jobs is greater than 1, each creator's realm (and the base world map)
+    is compiled in its own worker process, up to that many at a time, and the
+    resulting shards are merged back together in the same order the files
+    would have been read serially, so the output is identical to a serial
+    run.  If jobs is None, one worker per CPU is used.
+
+    A build manifest (see BuildManifest) is kept in <dest_tree> recording
+    what each source file produced.  Outputs for rooms and pages which no
+    longer exist in the source are deleted.  If incremental is True, only
+    source files which changed since the last run are recompiled, along
+    with any other files contributing to the same pages, and any files
+    which use realm global symbols whose definitions changed; the outputs
+    from everything else are left as they are.
+
+    If bundles is True, a <dest_tree>/bundle/### file is also written for
+    each page, holding the page and all of its rooms in one file (see
+    MapDataHandler.dump_bundle), so a client can fetch an entire page in
+    a single request.
+
+    If compress is True, a gzip-compressed copy of each page, room, and
+    bundle file is kept next to it (as <file>.gz) for web servers which can
+    send those directly with Content-Encoding: gzip.  These are only
+    rewritten when the file they go with is.
+
+    If binary is True, a copy of each page, room, and bundle file in the
+    binary version 7 format (see MapDataHandler) is also written next to
+    it (as <file>.v7, and <file>.v7.gz if compress is True), for clients
+    which ask for that instead.
+
+    If profile is given, statistics about the time and work spent compiling
+    each file and room (see MapProfile) are collected, and written as a
+    report of the slowest ones to <profile>.txt, with the full statistics
+    in <profile>.json.
+
+    If cache is given, it is the name of a directory holding a cache of
+    compiled map blocks (see CompileCache), which may be shared with other
+    builds, so blocks whose source (and the global symbols they use) haven't
+    changed don't need to be compiled again.  Once we're done, the least
+    recently used blocks are removed from it until it's no bigger than
+    cache_size bytes.
+
+    If optimize is True, each compiled map block is passed through
+    MapSource.optimize_element_list, which drops state changes that are
+    never used and joins polylines, so the output files are smaller and
+    the client has fewer things to draw.
+
+    If max_steps or time_limit are given, compiling any one map or bg field
+    is stopped with an error once it has taken that many steps, or run
+    for that many seconds (see MapSource.CompileContext), so runaway map
+    code can't hold up the whole build.
     '''
 
-    magic_map = MapSource()
-    translator = MapDataHandler()
     compile_dtm = datetime.datetime.now()
-    #
-    # This regex is a bit naive, but it will work as long
-    # as your system uses a single path separator string
-    # (sorry VMS)
-    #
     if verbosity:
-        sys.stderr.write("MagicMapCompiler.make_world(source_trees={0}, dest_tree={1}, creator_from_path={2}, ignore_errors={3}, verbosity={4})\n".format(repr(source_trees), repr(dest_tree), repr(creator_from_path), repr(ignore_errors), repr(verbosity)))
+        sys.stderr.write("MagicMapCompiler.make_world(source_trees={0}, dest_tree={1}, creator_from_path={2}, ignore_errors={3}, verbosity={4}, jobs={5}, incremental={6}, bundles={7}, compress={8}, profile={9}, cache={10}, cache_size={11}, optimize={12}, max_steps={13}, time_limit={14}, binary={15})\n".format(repr(source_trees), repr(dest_tree), repr(creator_from_path), repr(ignore_errors), repr(verbosity), repr(jobs), repr(incremental), repr(bundles), repr(compress), repr(profile), repr(cache), repr(cache_size), repr(optimize), repr(max_steps), repr(time_limit), repr(binary)))
         sys.stderr.write("compile_dtm={0}\n".format(compile_dtm))
 
-    creator_re = re.compile(re.escape(os.path.sep)+'players'+re.escape(os.path.sep)+r'(\w+)')
-    rootdir_re = re.compile(re.escape(os.path.sep)+'players'+re.escape(os.path.sep)+'\w+$')
-    map_dir_re = re.compile(re.escape(os.path.sep)+'players'+re.escape(os.path.sep)+'\w+'+re.escape(os.path.sep)+'map('+re.escape(os.path.sep)+'.*)?$')
-    rootmap_re = re.compile(re.escape(os.path.sep)+'map('+re.escape(os.path.sep)+'.*)?$')
-    #core_re    = re.compile(re.escape(os.path.sep)+r'room\b')
-
-    for source_tree in source_trees:
-        for root, dirnames, filenames in os.walk(source_tree):
-            #for each_dir in os.path.split(root):
-            # prune to include only ~/realm.map and ~/map/...*.map
-            # and the base "realm.map" (anywhere outside player files)
-            creator_name = None
-            if creator_from_path:
-                creator_m = creator_re.search(os.path.splitdrive(root)[1])
-                if creator_m:
-                    creator_name = creator_m.group(1)
-                    if rootdir_re.search(root):
-                        if 'realm.map' in filenames:
-                            filenames = ['realm.map']
-                        else:
-                            if verbosity > 2:
-                                sys.stderr.write(root+" is player area w/o realm.map file; Skipping\n")
-                            continue
-                    elif not map_dir_re.search(root):
-                        if verbosity > 2:
-                            sys.stderr.write("Skipping non-map dir "+root+"\n")
-                        continue
-                elif not rootmap_re.search(root):
-                    if verbosity > 2:
-                        sys.stderr.write("Skipping base mudlib non-map dir "+root+"\n")
-                    continue
-                    
-            if verbosity>1:
-                sys.stderr.write("Scanning {0}, creator={1}\n".format(root, creator_name))
-
-            # prune subdirs whose names begin with .
-            for hidden_dir_name in [d for d in dirnames if d.startswith('.')]:
-                dirnames.remove(hidden_dir_name)
-
-            for filename in filenames:
-                if filename.endswith('.map'):
-                    if verbosity:
-                        sys.stderr.write("   "+filename+"\n")
-                    try:
-                        src_filename = os.path.join(root, filename)
-                        magic_map.add_from_file(open(src_filename), 
-                                creator=creator_name, enforce_creator=enforce_creator, 
-                                source_date=datetime.datetime.utcfromtimestamp(os.stat(src_filename).st_mtime),
-                                verbosity=verbosity)
-                    except Exception as e:
-                        if ignore_errors:
-                            sys.stderr.write('%s: parser error: %s\n' % (src_filename, e))
-                        else:
-                            raise MapFileFormatError('Error in %s: %s' % (src_filename, e))
-                elif verbosity > 2:
-                    sys.stderr.write("   (Skipping {0})\n".format(filename))
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+
+    scanner = SourceTreeScanner(creator_from_path=creator_from_path, verbosity=verbosity)
+    source_files = list(scanner.scan(source_trees))
+    if verbosity > 1:
+        sys.stderr.write("Found {0} source file{1} ({2} directory entries examined)\n".format(
+            len(source_files), '' if len(source_files)==1 else 's', scanner.entries_visited))
+
+    manifest = BuildManifest(dest_tree, options=dict(
+        creator_from_path=bool(creator_from_path), enforce_creator=bool(enforce_creator), optimize=bool(optimize)))
+    map_profile = MapProfile(max_steps, time_limit) if profile else None
+    compile_cache = CompileCache(cache, cache_size) if cache else None
+    _update_world(source_files, manifest, dest_tree, compile_dtm, ignore_errors, enforce_creator,
+        verbosity, jobs, incremental, bundles, compress, map_profile, compile_cache, optimize, (max_steps, time_limit), binary)
+    manifest.save()
+    if compile_cache is not None:
+        _trim_cache(compile_cache, verbosity)
+    if map_profile is not None:
+        map_profile.write(profile)
+        if verbosity:
+            sys.stderr.write("Wrote profile report to {0}.txt and {0}.json\n".format(profile))
+
+def check_world(source_trees, creator_from_path=False, enforce_creator=True, verbosity=0, max_steps=None, time_limit=None):
+    '''Compile the MUD-side map files as make_world would, but only to find
+    the problems in them.  Rather than stopping at the first error, this
+    reads every file through to the end, carrying on after each problem with
+    the next statement or record (see MapSource.add_from_file), so they can
+    all be fixed before trying again.  Nothing is written.
+
+    Returns a list of MapDiagnostic objects, one for each problem found, in
+    the order of the files and the lines within them.  max_steps and
+    time_limit are as for make_world.'''
+
+    if verbosity:
+        sys.stderr.write("MagicMapCompiler.check_world(source_trees={0}, creator_from_path={1}, enforce_creator={2})\n".format(
+            repr(source_trees), repr(creator_from_path), repr(enforce_creator)))
+
+    scanner = SourceTreeScanner(creator_from_path=creator_from_path, verbosity=verbosity)
+    magic_map = MapSource()
+    magic_map.diagnostics = []
+    magic_map.max_steps = max_steps
+    magic_map.time_limit = time_limit
+    for src_filename, creator_name in scanner.scan(source_trees):
+        if verbosity > 1:
+            sys.stderr.write("Checking {0}\n".format(src_filename))
+        try:
+            with open(src_filename) as source:
+                magic_map.add_from_file(source, creator=creator_name, enforce_creator=enforce_creator, verbosity=verbosity)
+        except Exception as e:
+            magic_map.diagnostics.append(MapDiagnostic(src_filename, None, None, e))
+    return magic_map.diagnostics
+
+def watch_world(source_trees, dest_tree, interval=2.0, cycles=None, creator_from_path=False, ignore_errors=False, enforce_creator=True, verbosity=0, jobs=1, bundles=False, compress=False, cache=None, cache_size=DEFAULT_CACHE_SIZE, optimize=False, max_steps=None, time_limit=None, binary=False):
+    '''Compile the whole map as make_world does, then keep running, checking
+    the source trees every interval seconds for map files which were added,
+    removed, or modified (by their modification times and sizes).  When
+    something changed, only the affected files (as for an incremental
+    make_world) are recompiled and only their pages and rooms are written.
+    The compiled world is kept in memory the whole time and is returned
+    if we stop.
+
+    If cycles is given, we stop after checking that many times; otherwise
+    we run until interrupted.  Errors found after the initial compile are
+    reported without stopping; the files involved are tried again the next
+    time something changes.  The other options are as for make_world.
+    '''
+
+    if verbosity:
+        sys.stderr.write("MagicMapCompiler.watch_world(source_trees={0}, dest_tree={1}, interval={2}, cycles={3})\n".format(
+            repr(source_trees), repr(dest_tree), repr(interval), repr(cycles)))
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+
+    scanner = SourceTreeScanner(creator_from_path=creator_from_path)
+    manifest = BuildManifest(dest_tree, options=dict(
+        creator_from_path=bool(creator_from_path), enforce_creator=bool(enforce_creator), optimize=bool(optimize)))
+    compile_cache = CompileCache(cache, cache_size) if cache else None
+    source_files = list(scanner.scan(source_trees))
+    snapshot = _source_snapshot(source_files)
+    world = _update_world(source_files, manifest, dest_tree, datetime.datetime.now(), ignore_errors, enforce_creator,
+        verbosity, jobs, False, bundles, compress, cache=compile_cache, optimize=optimize, limits=(max_steps, time_limit),
+        binary=binary)[0]
+    manifest.save()
+    if compile_cache is not None:
+        _trim_cache(compile_cache, verbosity)
+    if verbosity:
+        sys.stderr.write("Watching {0} source file{1} ({2} pages, {3} rooms)\n".format(
+            len(source_files), '' if len(source_files)==1 else 's', len(world.pages), len(world.room_page)))
+
+    polls = 0
+    try:
+        while cycles is None or polls < cycles:
+            polls += 1
+            time.sleep(interval)
+            source_files = list(scanner.scan(source_trees))
+            new_snapshot = _source_snapshot(source_files)
+            if new_snapshot == snapshot:
+                continue
+
+            if verbosity:
+                sys.stderr.write("{0}: source files changed: {1}\n".format(datetime.datetime.now(), ' '.join(sorted(
+                    [f for f in set(new_snapshot) | set(snapshot) if new_snapshot.get(f) != snapshot.get(f)]))))
+            snapshot = new_snapshot
+            manifest.forget_signatures()
+            try:
+                magic_map, old_pages, realms = _update_world(source_files, manifest, dest_tree, datetime.datetime.now(),
+                    ignore_errors, enforce_creator, verbosity, jobs, True, bundles, compress, cache=compile_cache, optimize=optimize,
+                    limits=(max_steps, time_limit), binary=binary)
+            except Exception as e:
+                sys.stderr.write("{0}\n".format(e))
+                continue
+            manifest.save()
+            if compile_cache is not None:
+                _trim_cache(compile_cache, verbosity)
+            #
+            # Replace the recompiled pages and realms in the world we're
+            # keeping.  Every file contributing to those was recompiled,
+            # so magic_map has everything that belongs on them now.
+            #
+            old_pages.update(magic_map.pages)
+            for page_no in old_pages:
+                world.pages.pop(page_no, None)
+            for room_id in [room_id for room_id, page_no in world.room_page.items() if page_no in old_pages]:
+                del world.room_page[room_id]
+            for creator_name in realms:
+                world.realm_globals.pop(creator_name or '.CORE.', None)
+            world.merge(magic_map)
+            if verbosity and magic_map.pages:
+                sys.stderr.write("Updated page{0} {1}\n".format('' if len(magic_map.pages)==1 else 's',
+                    ', '.join([str(page_no) for page_no in sorted(magic_map.pages)])))
+    except KeyboardInterrupt:
+        pass
+
+    return world
+
+def _source_snapshot(source_files):
+    "Return a dictionary mapping each source filename to its (mtime, size), to tell when any have changed."
+    snapshot = {}
+    for src_filename, creator_name in source_files:
+        try:
+            st = os.stat(src_filename)
+            snapshot[src_filename] = (st.st_mtime_ns, st.st_size, creator_name)
+        except OSError:
+            pass
+    return snapshot
+
+def _update_world(source_files, manifest, dest_tree, compile_dtm, ignore_errors, enforce_creator, verbosity, jobs, incremental, bundles, compress, profile=None, cache=None, optimize=False, limits=(None, None), binary=False):
+    '''Compile the list of (src_filename, creator_name) source_files
+    and write the results to dest_tree, updating the manifest (but not
+    saving it).  The options are as for make_world, except that profile
+    is a MapProfile object to collect statistics in, or None, cache is
+    a CompileCache object, or None, optimize and binary are as for
+    make_world, and limits is (max_steps, time_limit) from make_world.
+
+    Returns (magic_map, old_pages, realms), where magic_map is the
+    MapSource holding what was compiled (all of it, unless incremental),
+    old_pages is the set of pages previously contributed to by the files
+    which were recompiled or removed, and realms is the set of creator
+    names (None for the base map) whose files were recompiled or removed.'''
+
+    translator = MapDataHandler()
+    magic_map = MapSource()
+    present_files = set(src_filename for src_filename, creator_name in source_files)
+    removed_files = set(src_filename for src_filename in manifest.files if src_filename not in present_files)
+
+    if incremental:
+        dirty_files = manifest.files_to_compile(source_files)
+        if not dirty_files and not removed_files:
+            return magic_map, set(), set()
+    else:
+        dirty_files = present_files
+
+    while True:
+        #
+        # Compile the dirty files.  Rooms from the files we're not
+        # recompiling are still checked for duplicates, and the realm
+        # global symbols they define are taken from the manifest.  If a
+        # file now contributes to a page it didn't before, the other files
+        # on that page need to be recompiled too, as do files reading
+        # global symbols which are now defined differently, so start over
+        # with them included.
+        #
+        seeds, trailing, missing = ({}, {}, set()) if not incremental else manifest.symbol_seeds(source_files, dirty_files)
+        if not missing.issubset(dirty_files):
+            dirty_files |= missing
+            continue
+
+        if verbosity:
+            sys.stderr.write("Compiling {0} of {1} source file{2}\n".format(
+                len(dirty_files), len(source_files), '' if len(source_files)==1 else 's'))
+        magic_map = MapSource()
+        magic_map.profile = profile
+        magic_map.compile_cache = cache
+        magic_map.optimize_elements = optimize
+        magic_map.max_steps, magic_map.time_limit = limits
+        magic_map.room_page.update(manifest.rooms_defined(exclude=dirty_files | removed_files))
+        compile_list = [f for f in source_files if f[0] in dirty_files]
+        if jobs > 1:
+            results = _compile_parallel(magic_map, compile_list, jobs, ignore_errors, enforce_creator, verbosity, seeds)
+        else:
+            results = _compile_serial(magic_map, compile_list, ignore_errors, enforce_creator, verbosity, seeds)
+        for creator_name in set(creator_name for src_filename, creator_name in compile_list):
+            magic_map.realm_globals.setdefault(creator_name or '.CORE.', {}).update(trailing.get(creator_name, {}))
+
+        if not incremental:
+            break
+        new_symbols = dict((src_filename, manifest.symbol_fields(file_symbols))
+            for src_filename, file_symbols in magic_map.file_symbols.items())
+        symbol_files = manifest.symbol_readers_changed(source_files, new_symbols) - dirty_files
+        more_files = (manifest.files_to_compile(source_files, pages=magic_map.pages) - dirty_files) | symbol_files
+        if not more_files:
+            break
+        if verbosity > 1 and symbol_files:
+            sys.stderr.write("Global symbols used by {0} changed\n".format(' '.join(sorted(symbol_files))))
+        dirty_files |= more_files
 #
-# At this point, we have the whole known world map in magic_map.
-# Export this out in the client-readable format to our output
-# directory structure...
+# At this point, we have the (changed part of the) known world map
+# in magic_map.  Export this out in the client-readable format to our
+# output directory structure, and clean up anything which went away.
 #
+    old_rooms = manifest.rooms_defined(exclude=present_files - dirty_files)
+    old_pages = manifest.pages_defined(exclude=present_files - dirty_files)
+    realms = set(manifest.files[src_filename].get('creator') for src_filename in removed_files)
+    realms.update(creator_name for src_filename, creator_name in source_files if src_filename in dirty_files)
+    for src_filename in removed_files:
+        manifest.forget_file(src_filename)
+    old_room_symbols = manifest.room_symbols(dirty_files)
+    #
+    # Only rooms from source files which changed since the manifest was
+    # written can have anything new to write.  The rest were recompiled
+    # because of what else is on their pages, and their output (which
+    # is left alone when its checksum doesn't change, so its mtime says
+    # nothing about how current it is) is still good.
+    #
+    changed_rooms = set(room_id for src_filename, creator_name, rooms, ok in results
+                        if manifest.file_changed(src_filename) for room_id, page_no in rooms)
+    for src_filename, creator_name, rooms, ok in results:
+        manifest.record_file(src_filename, creator_name, rooms, ok,
+            manifest.symbol_fields(magic_map.file_symbols[src_filename]) if src_filename in magic_map.file_symbols else None)
+    #
+    # Rooms whose maps read global symbols which changed have to be written
+    # even if their own source file didn't change.
+    #
+    new_room_symbols = manifest.room_symbols(dirty_files)
+    symbol_rooms = set(room_id for room_id in set(old_room_symbols) | set(new_room_symbols)
+                        if old_room_symbols.get(room_id) != new_room_symbols.get(room_id))
+
+    for room_id in set(old_rooms) - set(room_id for result in results for room_id, page_no in result[2]):
+        target_name = _room_filename(dest_tree, room_id)
+        for target_name in _output_filenames(target_name):
+            if os.path.exists(target_name):
+                if verbosity:
+                    sys.stderr.write("Removing {0} (room {1} no longer exists)\n".format(target_name, room_id))
+                os.unlink(target_name)
+    for page_no in old_pages - manifest.pages_defined():
+        for target_name in (os.path.join(dest_tree, 'page', str(page_no)), os.path.join(dest_tree, 'bundle', str(page_no))):
+            for target_name in _output_filenames(target_name):
+                if os.path.exists(target_name):
+                    if verbosity:
+                        sys.stderr.write("Removing {0} (page no longer exists)\n".format(target_name))
+                    os.unlink(target_name)
+
     if not os.path.exists(os.path.join(dest_tree, 'page')):
         os.makedirs(os.path.join(dest_tree, 'page'))
+    if bundles and not os.path.exists(os.path.join(dest_tree, 'bundle')):
+        os.makedirs(os.path.join(dest_tree, 'bundle'))
 
     for page in list(magic_map.pages.values()):
-        with open(os.path.join(dest_tree, 'page', str(page.page)), 'w') as p:
-            p.write(translator.dump_page(page, gentime=compile_dtm) + '\n')
-        # XXX suppress if didn't change since last run XXX
+        # leave the page file alone (mtime and all) if it didn't change since last run
+        if not _write_if_changed(os.path.join(dest_tree, 'page', str(page.page)),
+                translator.dump_page(page, gentime=compile_dtm) + '\n', compress) and verbosity > 1:
+            sys.stderr.write("Page {0} unchanged\n".format(page.page))
+        if binary:
+            _write_if_changed(os.path.join(dest_tree, 'page', str(page.page)) + BINARY_FILE_SUFFIX,
+                translator.dump_page(page, gentime=compile_dtm, version=BINARY_FORMAT_VERSION), compress)
+
+        if bundles and not _write_if_changed(os.path.join(dest_tree, 'bundle', str(page.page)),
+                translator.dump_bundle(page, public_id_filter=gen_public_room_id, gentime=compile_dtm) + '\n', compress) and verbosity > 1:
+            sys.stderr.write("Bundle {0} unchanged\n".format(page.page))
+        if bundles and binary:
+            _write_if_changed(os.path.join(dest_tree, 'bundle', str(page.page)) + BINARY_FILE_SUFFIX,
+                translator.dump_bundle(page, public_id_filter=gen_public_room_id, gentime=compile_dtm, version=BINARY_FORMAT_VERSION), compress)
         
         for room in list(page.rooms.values()):
-            public_room_id = gen_public_room_id(room.id)
-            if not public_room_id:
-                raise ValueError('public room ID generated from %s was empty!' % room.id)
-            target_dir = os.path.join(dest_tree, 'room', public_room_id[:1], public_room_id[:2])
+            target_name = _room_filename(dest_tree, room.id)
+            target_dir = os.path.dirname(target_name)
             if not os.path.exists(target_dir):
                 os.makedirs(target_dir)
 
-            target_name = os.path.join(target_dir, public_room_id)
-            if os.path.exists(target_name) and room.source_modified_date:
+            room_data = None
+            if profile is not None:
+                room_data = translator.dump_room(room, public_id_filter=gen_public_room_id, gentime=compile_dtm) + '\n'
+                profile.record_output(room.id, len(room_data.encode('utf-8')))
+
+            if room.id not in changed_rooms and room.id not in symbol_rooms \
+                    and all(map(os.path.exists, _output_filenames(target_name, compress, binary))):
                 # don't overwrite if we have nothing new to do
-                if datetime.datetime.utcfromtimestamp(os.stat(target_name).st_mtime) >= room.source_modified_date:
-                    continue
+                continue
 
-            with open(target_name, 'w') as rm:
-                #print("** writing", target_name,"**")
-                rm.write(translator.dump_room(room, public_id_filter=gen_public_room_id, gentime=compile_dtm) + '\n')
+            written = _write_if_changed(target_name,
+                    room_data or translator.dump_room(room, public_id_filter=gen_public_room_id, gentime=compile_dtm) + '\n', compress)
+            if binary:
+                written = _write_if_changed(target_name + BINARY_FILE_SUFFIX,
+                    translator.dump_room(room, public_id_filter=gen_public_room_id, gentime=compile_dtm, version=BINARY_FORMAT_VERSION),
+                    compress) or written
+            if not written:
+                continue
             if room.source_modified_date:
                 #match the source's timestamp
                 #print("** setting time stamp **")
-                os.utime(target_name, 
-                        (time.time(), time.mktime(room.source_modified_date.utctimetuple())))
+                for stamped_name in _output_filenames(target_name, compress, binary):
+                    os.utime(stamped_name, 
+                            (time.time(), time.mktime(room.source_modified_date.utctimetuple())))
+
+
+    return magic_map, old_pages, realms
+
+def _trim_cache(compile_cache, verbosity):
+    "Report how well the compile cache did, and keep it within its size limit."
+    if verbosity:
+        sys.stderr.write("Compile cache: {0} hit{1}, {2} miss{3}\n".format(
+            compile_cache.hits, '' if compile_cache.hits==1 else 's',
+            compile_cache.misses, '' if compile_cache.misses==1 else 'es'))
+    compile_cache.hits = compile_cache.misses = 0
+    removed = compile_cache.trim()
+    if removed and verbosity > 1:
+        sys.stderr.write("Removed {0} old file{1} from the compile cache\n".format(removed, '' if removed==1 else 's'))
+
+def _room_filename(dest_tree, room_id):
+    "Return the output filename for a room under dest_tree."
+    public_room_id = gen_public_room_id(room_id)
+    if not public_room_id:
+        raise ValueError('public room ID generated from %s was empty!' % room_id)
+    return os.path.join(dest_tree, 'room', public_room_id[:1], public_room_id[:2], public_room_id)
+
+def _output_filenames(target_name, compress=True, binary=True):
+    "Return the names of target_name and the copies of it which are kept next to it."
+    names = [target_name]
+    if binary:
+        names.append(target_name + BINARY_FILE_SUFFIX)
+    if compress:
+        names.extend([name + '.gz' for name in names])
+    return names
+
+def _write_if_changed(target_name, data, compress=False):
+    '''Write data (the contents of a page, room, or bundle file, as text
+    or as bytes in the binary format) to target_name, unless the file
+    already there has the same checksum in its footer, i.e., the same
+    content other than its timestamps.  Returns True if the file was
+    written.
+
+    If compress is True, target_name.gz is written along with it (or
+    from the existing file if that was left alone but has no .gz yet).'''
+
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    new_checksum = footer_fields(data)[:1]
+    try:
+        with open(target_name, 'rb') as old_file:
+            old_data = old_file.read()
+        if footer_fields(old_data)[:1] == new_checksum:
+            if compress and not os.path.exists(target_name+'.gz'):
+                _write_compressed(target_name, old_data)
+            return False
+    except OSError:
+        pass
+
+    with open(target_name, 'wb') as new_file:
+        new_file.write(data)
+    if compress:
+        _write_compressed(target_name, data)
+    return True
+
+def _write_compressed(target_name, data):
+    "Write the gzip sidecar file for target_name, holding data (bytes)."
+    # mtime=0 so the same data always compresses to the same bytes
+    with open(target_name+'.gz', 'wb') as new_file:
+        new_file.write(gzip.compress(data, compresslevel=9, mtime=0))
+
+def _compile_serial(magic_map, source_files, ignore_errors, enforce_creator, verbosity, seeds=None):
+    '''Compile the list of (src_filename, creator_name) source_files into
+    magic_map one at a time.  Returns a list of (src_filename, creator_name,
+    rooms, ok) tuples, where rooms is a list of (room_id, page_number) for
+    each room defined by that file and ok is False if the file had errors.
+
+    If seeds is given, it maps source filenames to realm global symbols
+    to define before compiling them (see BuildManifest.symbol_seeds).'''
+
+    results = []
+    for src_filename, creator_name in source_files:
+        rooms_before = len(magic_map.room_page)
+        if seeds and seeds.get(src_filename):
+            magic_map.realm_globals.setdefault(creator_name or '.CORE.', {}).update(seeds[src_filename])
+        ok = True
+        try:
+            magic_map.add_from_file(open(src_filename), 
+                    creator=creator_name, enforce_creator=enforce_creator, 
+                    source_date=datetime.datetime.utcfromtimestamp(os.stat(src_filename).st_mtime),
+                    verbosity=verbosity)
+        except Exception as e:
+            if ignore_errors:
+                sys.stderr.write('%s: parser error: %s\n' % (src_filename, e))
+                ok = False
+            else:
+                raise MapFileFormatError('Error in %s: %s' % (src_filename, e))
+        results.append((src_filename, creator_name, list(reversed(list(itertools.islice(
+            reversed(magic_map.room_page.items()), len(magic_map.room_page) - rooms_before)))), ok))
+    return results
+
+def _compile_realm_shards(creator_name, source_files, enforce_creator, ignore_errors, verbosity, profile=False, seeds=None, cache=None, optimize=False, limits=(None, None)):
+    '''Compile one realm's map files in a worker process for make_world.
 
-def make_master_map(source_tree_list, dest_filename, creator_from_path=False, ignore_errors=False, enforce_creator=True, verbosity=0):
+    source_files is a list of (seq, src_filename) tuples in the order the
+    files should be read.  Each file is compiled into its own MapSource shard
+    (all of them sharing the realm's global symbol table and room list, just
+    as they would in a single MapSource), which keeps a record_log so the
+    caller can merge them back in the original file order.  Returns a list
+    of (seq, src_filename, shard, error) tuples, where error is None or the
+    exception raised by that file (or a MapFileFormatError with its text if
+    it can't be pickled).
+    Unless ignore_errors is set, compilation of the realm stops at the first
+    error.  If profile is set, each shard collects a MapProfile.  seeds
+    is as for _compile_serial.  If cache is given, it is the (directory,
+    max_size) of a CompileCache for the shards to use.  If optimize is
+    set, the shards optimize their element lists (see MapSource), and limits
+    is the (max_steps, time_limit) for their compiles.'''
+
+    realm_globals = {}
+    room_page = {}
+    shards = []
+    for seq, src_filename in source_files:
+        if seeds and seeds.get(src_filename):
+            realm_globals.update(seeds[src_filename])
+        shard = MapSource()
+        if profile:
+            shard.profile = MapProfile()
+        if cache is not None:
+            shard.compile_cache = CompileCache(*cache)
+        shard.optimize_elements = optimize
+        shard.max_steps, shard.time_limit = limits
+        shard.realm_globals[creator_name or '.CORE.'] = realm_globals
+        shard.room_page = room_page
+        shard.record_log = []
+        error = None
+        try:
+            with open(src_filename) as source:
+                shard.add_from_file(source,
+                        creator=creator_name, enforce_creator=enforce_creator,
+                        source_date=datetime.datetime.utcfromtimestamp(os.stat(src_filename).st_mtime),
+                        verbosity=verbosity)
+        except Exception as e:
+            error = e
+            try:
+                pickle.dumps(error)
+            except Exception:
+                error = MapFileFormatError(str(e))
+        shards.append((seq, src_filename, shard, error))
+        if error is not None and not ignore_errors:
+            break
+    return shards
+
+def _compile_parallel(magic_map, source_files, jobs, ignore_errors, enforce_creator, verbosity, seeds=None):
+    '''Compile the list of (src_filename, creator_name) source_files into
+    magic_map using a pool of up to jobs worker processes, one realm per task.
+    The per-file shards are merged in the original file order, so the result
+    is the same as adding each file to magic_map serially.  Returns the same
+    kind of list as _compile_serial, and seeds is as for that too.'''
+
+    realms = {}
+    for seq, (src_filename, creator_name) in enumerate(source_files):
+        realms.setdefault(creator_name, []).append((seq, src_filename))
+
+    shards = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+        # start the biggest realms first so they don't hold up the end of the run
+        tasks = [pool.submit(_compile_realm_shards, creator_name, realm_files, enforce_creator, ignore_errors, verbosity, magic_map.profile is not None,
+                    dict((src_filename, seeds[src_filename]) for seq, src_filename in realm_files if seeds and seeds.get(src_filename)),
+                    None if magic_map.compile_cache is None else (magic_map.compile_cache.directory, magic_map.compile_cache.max_size),
+                    magic_map.optimize_elements, (magic_map.max_steps, magic_map.time_limit))
+                    for creator_name, realm_files in sorted(realms.items(), key=lambda r: len(r[1]), reverse=True)]
+        for task in concurrent.futures.as_completed(tasks):
+            shards.extend(task.result())
+
+    results = []
+    for seq, src_filename, shard, error in sorted(shards, key=lambda s: s[0]):
+        rooms_before = len(magic_map.room_page)
+        ok = True
+        try:
+            magic_map.merge(shard)
+            if shard.profile is not None:
+                magic_map.profile.merge(shard.profile)
+            if shard.compile_cache is not None:
+                magic_map.compile_cache.hits += shard.compile_cache.hits
+                magic_map.compile_cache.misses += shard.compile_cache.misses
+            if error is not None:
+                raise error
+        except Exception as e:
+            if ignore_errors:
+                sys.stderr.write('%s: parser error: %s\n' % (src_filename, e))
+                ok = False
+            else:
+                raise MapFileFormatError('Error in %s: %s' % (src_filename, e))
+        results.append((src_filename, source_files[seq][1], list(reversed(list(itertools.islice(
+            reversed(magic_map.room_page.items()), len(magic_map.room_page) - rooms_before)))), ok))
+    return results
+
+class _MasterMapIndex (PostScriptMapSource):
+    '''First pass of a streaming make_master_map.  This reads the source files
+    exactly as PostScriptMapSource would (so pages, rooms, creators and errors all
+    come out the same), but instead of keeping the PostScript text of each bg and
+    map field it only remembers where that text came from: page_blocks holds a
+    packed (file, record, field) number for each, and record_lines the line each
+    record starts on.  load_page_text() then reads the text back for one page at
+    a time.'''
+
+    def __init__(self):
+        PostScriptMapSource.__init__(self)
+        self.source_files = []
+        self.record_lines = []
+        self.page_blocks = {}
+        self._page = None
+        self._record = None
+        self._record_no = None
+        self._record_blocks = 0
+        self._lines_read = 0
+
+    def add_source_file(self, src_filename, **kwargs):
+        "Index the records in src_filename (arguments as for add_from_file)."
+        self.source_files.append(src_filename)
+        self.record_lines.append(array.array('q'))
+        self._lines_read = 0
+        with open(src_filename, encoding='utf-8') as input_file:
+            self.add_from_file(self._count_lines(input_file), **kwargs)
+
+    def _count_lines(self, input_file):
+        for line in input_file:
+            self._lines_read += 1
+            yield line
+
+    def get_page(self, page_id):
+        self._page = PostScriptMapSource.get_page(self, page_id)
+        return self._page
+
+    def _each_record(self, input_file, errors=None):
+        record_lines = self.record_lines[-1]
+        start = 0
+        for record_no, record in enumerate(PostScriptMapSource._each_record(self, input_file, errors)):
+            #
+            # each record but the last is yielded upon reading the "room:" line
+            # which starts the next one.
+            #
+            record_lines.append(start)
+            start = self._lines_read - 1
+            self._record = record
+            self._record_no = record_no
+            self._record_blocks = 0
+            yield record
+
+    def compile(self, source, allow_test=False, global_symbols=None, errors=None):
+        "Note where source came from and return an empty placeholder for it."
+        #
+        # _add_records compiles a record's bg (if it has one) before its map,
+        # and always for the page it most recently looked up.
+        #
+        is_map = not (self._record_blocks == 0 and self._record.get('bg', '').strip())
+        self._record_blocks += 1
+        if self._page.page not in self.page_blocks:
+            self.page_blocks[self._page.page] = array.array('q')
+        self.page_blocks[self._page.page].append(
+                ((len(self.source_files) - 1) << 32) | (self._record_no << 1) | is_map)
+        return ()
+
+    def load_page_text(self, page):
+        "Fill in the bg and map text of page, and forget where it came from."
+        blocks = self.page_blocks.pop(page.page, ())
+        wanted = {}
+        for block in blocks:
+            wanted.setdefault(block >> 32, set()).add((block & 0xffffffff) >> 1)
+
+        text = {}
+        for seq in sorted(wanted):
+            record_lines = self.record_lines[seq]
+            position = 0
+            with open(self.source_files[seq], encoding='utf-8') as input_file:
+                for record_no in sorted(wanted[seq]):
+                    start = record_lines[record_no]
+                    end = record_lines[record_no + 1] if record_no + 1 < len(record_lines) else None
+                    next(itertools.islice(input_file, start - position, start - position), None)
+                    lines = list(itertools.islice(input_file, None if end is None else end - start))
+                    position = end
+                    #
+                    # (if reading the file stopped at an error, we don't know where
+                    # its last record ends, but it's the first one in lines anyway)
+                    #
+                    record = next(PostScriptMapSource._each_record(self, lines))
+                    text[(seq << 32) | (record_no << 1)] = record.get('bg')
+                    text[(seq << 32) | (record_no << 1) | 1] = record.get('map')
+
+        #
+        # blocks are in the order they were compiled, which is the order of
+        # page.bg and of the rooms in page.rooms which have maps.
+        #
+        page.bg = [text[block] for block in blocks if not block & 1]
+        maps = iter([text[block] for block in blocks if block & 1])
+        for room in page.rooms.values():
+            if room.map is not None:
+                room.map = [next(maps)]
+
+    def release_page(self, page):
+        "Drop page, and its text, once it has been written out."
+        #
+        # rooms and their page refer to each other, so just dropping the page
+        # would leave the text around until the next full garbage collection.
+        #
+        del self.pages[page.page]
+        page.bg = []
+        for room in page.rooms.values():
+            room.map = None
+        page.rooms.clear()
+
+def make_master_map(source_tree_list, dest_filename, creator_from_path=False, ignore_errors=False, enforce_creator=True, verbosity=0, streaming=False):
     '''Perform the work of compiling MUD-side files to an old-style PostScript file.
     This works like the make_world function other than not actually compiling the code
-    and producing a single output file.'''
+    and producing a single output file.
+
+    If streaming is true, this makes two passes over the source files: the first
+    indexes which records go on which page, and the second reads back, writes and
+    releases one page at a time, so the whole world's map source is never held in
+    memory at once.  The output is the same either way.'''
 
-    magic_map = PostScriptMapSource()
+    magic_map = _MasterMapIndex() if streaming else PostScriptMapSource()
     
 #    translator = MapDataHandler()
 #    compile_dtm = datetime.datetime.now()
-    #
-    # This regex is a bit naive, but it will work as long
-    # as your system uses a single path separator string
-    # (sorry VMS)
-    #
     if verbosity:
         sys.stderr.write("MagicMapCompiler.make_master_map(source_tree={0}, dest_file={1}, creator_from_path={2}, ignore_errors={3}, verbosity={4})\n".format(repr(source_tree_list), repr(dest_filename), repr(creator_from_path), repr(ignore_errors), repr(verbosity)))
 
-    creator_re = re.compile(re.escape(os.path.sep)+'players'+re.escape(os.path.sep)+r'(\w+)')
-    rootdir_re = re.compile(re.escape(os.path.sep)+'players'+re.escape(os.path.sep)+'\w+$')
-    map_dir_re = re.compile(re.escape(os.path.sep)+'players'+re.escape(os.path.sep)+'\w+'+re.escape(os.path.sep)+'map('+re.escape(os.path.sep)+'.*)?$')
-    rootmap_re = re.compile(re.escape(os.path.sep)+'map('+re.escape(os.path.sep)+'.*)?$')
-
-    for source_tree in source_tree_list:
-        for root, dirnames, filenames in os.walk(source_tree):
-            #for each_dir in os.path.split(root):
-            # prune to include only ~/realm.map and ~/map/...*.map
-            # and the base "realm.map" (anywhere outside player files)
-            creator_name = None
-            if creator_from_path:
-                creator_m = creator_re.search(root)
-                if creator_m:
-                    creator_name = creator_m.group(1)
-                    if rootdir_re.search(root):
-                        if 'realm.map' in filenames:
-                            filenames = ['realm.map']
-                        else:
-                            if verbosity > 2:
-                                sys.stderr.write(root+" is player area w/o realm.map file; Skipping\n")
-                            continue
-                    elif not map_dir_re.search(root):
-                        if verbosity > 2:
-                            sys.stderr.write("Skipping non-map dir "+root+"\n")
-                        continue
-                elif not rootmap_re.search(root):
-                    if verbosity > 2:
-                        sys.stderr.write("Skipping base mudlib non-map dir "+root+"\n")
-                    continue
-                    
-            if verbosity>1:
-                sys.stderr.write("Scanning {0}, creator={1}\n".format(root, creator_name))
-
-            # prune subdirs whose names begin with .
-            for hidden_dir_name in [d for d in dirnames if d.startswith('.')]:
-                dirnames.remove(hidden_dir_name)
-
-            for filename in filenames:
-                if filename.endswith('.map'):
-                    if verbosity:
-                        sys.stderr.write("   "+filename+"\n")
-                    try:
-                        src_filename = os.path.join(root, filename)
-                        magic_map.add_from_file(open(src_filename, encoding='utf-8'), 
-                                creator=creator_name, enforce_creator=enforce_creator, 
-                                source_date=datetime.datetime.utcfromtimestamp(os.stat(src_filename).st_mtime),
-                                verbosity=verbosity)
-                    except Exception as e:
-                        if ignore_errors:
-                            sys.stderr.write('%s: parser error: %s\n' % (src_filename, e))
-                        else:
-                            raise MapFileFormatError('Error in %s: %s' % (src_filename, e))
-                elif verbosity > 2:
-                    sys.stderr.write("   (Skipping {0})\n".format(filename))
+    scanner = SourceTreeScanner(creator_from_path=creator_from_path, verbosity=verbosity)
+    for src_filename, creator_name in scanner.scan(source_tree_list):
+        try:
+            if streaming:
+                magic_map.add_source_file(src_filename,
+                        creator=creator_name, enforce_creator=enforce_creator, 
+                        source_date=datetime.datetime.utcfromtimestamp(os.stat(src_filename).st_mtime),
+                        verbosity=verbosity)
+            else:
+                magic_map.add_from_file(open(src_filename, encoding='utf-8'), 
+                        creator=creator_name, enforce_creator=enforce_creator, 
+                        source_date=datetime.datetime.utcfromtimestamp(os.stat(src_filename).st_mtime),
+                        verbosity=verbosity)
+        except Exception as e:
+            if ignore_errors:
+                sys.stderr.write('%s: parser error: %s\n' % (src_filename, e))
+            else:
+                raise MapFileFormatError('Error in %s: %s' % (src_filename, e))
 #
-# At this point, we have the whole known world map in magic_map.
+# At this point, we have the whole known world map in magic_map (or, if streaming,
+# an index of where to find it).
 # We need to output this with a compatability-adjusting PostScript preamble.
 #
     with open(dest_filename, 'w') as dest_file:
@@ -503,6 +1045,8 @@ grestore } def
         now_str = time.ctime()
         for seq, page_no in enumerate(sorted(magic_map.pages)):
             page = magic_map.pages[page_no]
+            if streaming:
+                magic_map.load_page_text(page)
 
             dest_file.write("%%Page: {0} {1}\n".format(page_no, seq))
             dest_file.write("%---------------------[ Page {0} ]---------------------\n".format(page_no))
@@ -520,6 +1064,8 @@ grestore } def
             for room in list(page.rooms.values()):
                 dest_file.write('%---[ {0} ]---\n{1}\n'.format(room.id, '\n'.join(room.map) if isinstance(room.map, list) else (room.map or '')))
             dest_file.write('EndPage\n')
+            if streaming:
+                magic_map.release_page(page)
 #    
 #    for page in magic_map.pages.values():
 #        with open(os.path.join(dest_tree, 'page', str(page.page)), 'w') as p:
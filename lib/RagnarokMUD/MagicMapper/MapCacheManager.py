@@ -345,12 +345,12 @@ class MapCacheManager:
         pass
 
     def retrieve(self, key):
-        "Find the given key in the cache -> None (not found) or (fileobj, age in seconds)"
+        "Find the given key in the cache -> None (not found) or (binary fileobj, age in seconds)"
         d1, d2, cache_name = self._encode_filename(key)
         cache_entry_path = os.path.join(self.cache_dir, d1, d2, cache_name)
 
         if os.path.exists(cache_entry_path):
-            return open(cache_entry_path, 'r'), (time.time() - os.path.getmtime(cache_entry_path))
+            return open(cache_entry_path, 'rb'), (time.time() - os.path.getmtime(cache_entry_path))
 
         return None
 
@@ -359,7 +359,7 @@ class MapCacheManager:
         self.store_str(key, fileobj.read())
 
     def store_str(self, key, data):
-        "Store string data into the cache under the given key"
+        "Store string (or bytes) data into the cache under the given key"
         d1, d2, cache_name = self._encode_filename(key)
         entry_dir = os.path.join(self.cache_dir, d1, d2)
 
@@ -371,7 +371,9 @@ class MapCacheManager:
             except Exception as err:
                 raise CacheManagerError('System error creating {0}: {1}'.format(entry_dir, err))
 
-        with open(os.path.join(entry_dir, cache_name), 'w') as cached_copy:
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        with open(os.path.join(entry_dir, cache_name), 'wb') as cached_copy:
             cached_copy.write(data)
 
     def remove(self, key):
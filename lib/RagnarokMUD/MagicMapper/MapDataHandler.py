@@ -24,9 +24,87 @@
 from RagnarokMUD.MagicMapper.MapPage import MapPage, LANDSCAPE, PORTRAIT
 from RagnarokMUD.MagicMapper.MapRoom import MapRoom
 from RagnarokMUD.MagicMapper.Local   import gen_public_room_id
-import urllib.request, urllib.parse, urllib.error, hashlib, base64, textwrap, datetime
+import urllib.request, urllib.parse, urllib.error, hashlib, base64, textwrap, datetime, struct
 
 DATA_FORMAT_VERSION = 6
+BINARY_FORMAT_VERSION = 7
+BINARY_FILE_SUFFIX = '.v7'      # binary copies are kept next to the text files with this added
+
+#
+# Version 7 (binary) format
+# -------------------------
+# Each page, room, or bundle record is:
+#   header      2-byte format code (b'P7', b'R7', or b'B7') followed by
+#               the length of the body as a 4-byte unsigned integer
+#   body        (see below)
+#   footer      20-byte SHA-1 checksum of the header and body, then the
+#               compiled and modified times as 26-byte ASCII strings
+#               (%Y-%m-%dT%H:%M:%S.%f, as in the text format)
+#
+# Numbers are big-endian.  The body of a page or room is a string table
+# followed by a single value:
+#   string table  4-byte count of strings, then each one as a 4-byte
+#                 length and that many bytes of UTF-8
+#   value         1-byte type code followed by:
+#                   [   1-byte count, then that many values (a list)
+#                   L   4-byte count, then that many values (a list)
+#                   n   1-byte count, then 1-byte type code (b, h, i, q, f,
+#                       or d), then that many numbers of that type with no
+#                       type codes of their own (a list of only integers or
+#                       only floats, such as a path's coordinates)
+#                   N   as for n, but with a 4-byte count
+#                   b   1-byte signed integer
+#                   h   2-byte signed integer
+#                   i   4-byte signed integer
+#                   q   8-byte signed integer
+#                   f   4-byte IEEE float (only used for values it holds exactly)
+#                   d   8-byte IEEE double
+#                   s   2-byte index into the string table
+#                   S   4-byte index into the string table
+# The shortest form which holds a value is used (for n and N, the
+# shortest type which holds every number in the list).
+#
+# For a page, that value is the list
+#   [page number, "L" or "P", realm, [creator, ...], [background elements...]]
+# and for a room,
+#   [public room ID, page number, name, [also, ...], reference x, reference y, [map elements...]]
+#
+# The body of a bundle is the page number and number of rooms (4-byte
+# unsigned integers each), followed by the complete page record and then
+# each room record.  Its checksum covers its header, those two numbers,
+# and the checksums of the records inside it, so (as with the text
+# format) it only changes when the content of one of them does.
+#
+_BINARY_HEADER = struct.Struct('>2sI')
+_BINARY_FOOTER = struct.Struct('>20s26s26s')
+_BINARY_BUNDLE = struct.Struct('>II')
+_BINARY_FORMAT_CODES = (b'P7', b'R7', b'B7')
+_BINARY_COUNT  = struct.Struct('>I')
+_BINARY_VALUES = {
+    ord('['): struct.Struct('>B'),
+    ord('L'): struct.Struct('>I'),
+    ord('n'): struct.Struct('>B'),
+    ord('N'): struct.Struct('>I'),
+    ord('b'): struct.Struct('>b'),
+    ord('h'): struct.Struct('>h'),
+    ord('i'): struct.Struct('>i'),
+    ord('q'): struct.Struct('>q'),
+    ord('f'): struct.Struct('>f'),
+    ord('d'): struct.Struct('>d'),
+    ord('s'): struct.Struct('>H'),
+    ord('S'): struct.Struct('>I'),
+}
+_BINARY_NUMBERS = frozenset(b'bhiqfd')
+#
+# What the decoder does with each kind of value: type code -> (unpacker, kind)
+#
+_BINARY_NUMBER, _BINARY_STRING, _BINARY_LIST, _BINARY_PACKED = range(4)
+_BINARY_DECODERS = {type_code: (unpacker,
+        _BINARY_STRING if type_code in b'sS' else
+        _BINARY_LIST   if type_code in b'[L' else
+        _BINARY_PACKED if type_code in b'nN' else _BINARY_NUMBER)
+    for type_code, unpacker in _BINARY_VALUES.items()}
+_TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
 
 class MagicMapDataFormatError (Exception):              
     '''We can't understand the data sent to us in a map or page file.
@@ -38,6 +116,8 @@ class InvalidPageHeader (MagicMapDataFormatError):      "Data format error: page
 class InvalidRoomHeader (MagicMapDataFormatError):      "Data format error: room header can't be understood or malformed."
 class UnsupportedPageVersion (MagicMapDataFormatError): "Page file format number not supported."
 class UnsupportedRoomVersion (MagicMapDataFormatError): "Room file format number not supported."
+class InvalidBundleHeader (MagicMapDataFormatError):    "Data format error: bundle header can't be understood or malformed."
+class UnsupportedBundleVersion (MagicMapDataFormatError): "Bundle file format number not supported."
 class ElementListLengthError (MagicMapDataFormatError): "A map element list lengh is wrong vs. the file's actual contents."
 class ElementListFormatError (MagicMapDataFormatError): "Malformed element list encoding."
 class DataAfterElementList (MagicMapDataFormatError):   "Map drawing elements exist past end of encoded list"
@@ -46,6 +126,24 @@ class MapDataLengthError   (MagicMapDataFormatError):   "Map data does not match
 class InvalidMapDataFooter (MagicMapDataFormatError):   "Room or Page file footer was malformed"
 class MissingRoomReferencePoint (MagicMapDataFormatError): "No ref: field and no reference point could be inferred."
 
+def footer_fields(data):
+    '''Return the fields of the footer of page, room, or bundle data in either
+    format (str or bytes) without checking the rest of it, as a list of strings:
+    the checksum (as "%" followed by its base64 encoding), compiled time, and
+    modified time.  For text data, these are just the fields of the last line,
+    so there may be more or fewer of them if that's malformed.'''
+
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        if bytes(data[:2]) in _BINARY_FORMAT_CODES:
+            if len(data) < _BINARY_HEADER.size + _BINARY_FOOTER.size:
+                return []
+            checksum, compiled, modified = _BINARY_FOOTER.unpack_from(data, len(data) - _BINARY_FOOTER.size)
+            return ['%'+base64.b64encode(checksum).decode('ascii'),
+                    compiled.rstrip(b'\0').decode('ascii', 'replace'), modified.rstrip(b'\0').decode('ascii', 'replace')]
+        data = str(data, 'utf-8', 'replace')
+
+    return data.rstrip('\n').rsplit('\n', 1)[-1].split()
+
 
 
 class MapDataHandler (object):
@@ -54,12 +152,22 @@ class MapDataHandler (object):
     the network.'''
 
     def dump_page(self, page, mtime=None, gentime=None, version=DATA_FORMAT_VERSION):
-        '''given a MapPage object, emit multi-line ASCII string representing that page's data.
+        '''given a MapPage object, emit multi-line ASCII string representing that page's data
+        (or, if version is 7, bytes holding it in the binary format).
         If mtime and/or gentime are not given, the dates in the page object are used,
         or the current date and time if there's nothing in the page object either.'''
 
+        if version == BINARY_FORMAT_VERSION:
+            return self._dump_binary_record(b'P7', [
+                page.page,
+                'L' if page.orient==LANDSCAPE else 'P',
+                page.realm or '',
+                [_f for _f in page.creators if _f],
+                page.bg or [],
+            ], gentime or page.source_compiled_date, mtime or page.source_modified_date)
+
         if version != 6:
-            raise NotImplementedError('Only version 6 magic map format is understood.')
+            raise NotImplementedError('Only versions 6 and 7 of the magic map format are understood.')
 
         bgdata = self.encode_map_elements(page.bg)
         preamble = 'P6 %d %s %s %s %d' % (
@@ -83,14 +191,27 @@ class MapDataHandler (object):
         
         public_id_filter is a callable which takes the internal name of a room and returns
         the public ID we should use for these data files.  If not specified, no translation
-        will be done.'''
+        will be done.
 
-        if version != 6:
-            raise NotImplementedError('Only version 6 magic map format is understood.')
+        If version is 7, bytes holding the room in the binary format are returned instead.'''
+
+        if version not in (6, BINARY_FORMAT_VERSION):
+            raise NotImplementedError('Only versions 6 and 7 of the magic map format are understood.')
 
         if public_id_filter is None:
             public_id_filter = lambda i: i
 
+        if version == BINARY_FORMAT_VERSION:
+            return self._dump_binary_record(b'R7', [
+                public_id_filter(room.id),
+                room.page.page,
+                room.name or '',
+                [public_id_filter(i) for i in room.also if i] if room.also is not None else [],
+                room.reference_point[0] if room.reference_point is not None else 0,
+                room.reference_point[1] if room.reference_point is not None else 0,
+                room.map or [],
+            ], gentime or room.source_compiled_date, mtime or room.source_modified_date)
+
         mapdata = self.encode_map_elements(room.map)
         print("Room {0} ({1}):".format(room.id, public_id_filter(room.id)))
         if room.also is not None:
@@ -113,6 +234,49 @@ class MapDataHandler (object):
             (mtime   or room.source_modified_date or datetime.datetime.now()).strftime('%Y-%m-%dT%H:%M:%S.%f')
         ])
 
+    def dump_bundle(self, page, public_id_filter=None, mtime=None, gentime=None, version=DATA_FORMAT_VERSION):
+        '''given a MapPage object, emit multi-line ASCII string representing that page's
+        data followed by the data for every room on the page, so a client can get the
+        whole page at once.  The format is:
+            B6 <page> <number of rooms>
+            <page data as from dump_page>
+            <room data as from dump_room>...
+            %<checksum> <gentime> <mtime>
+        where the checksum is the SHA-1 of the header line followed by the checksum
+        field of each page or room footer (one per line).  This way it only changes
+        when the content of the page or one of its rooms does.
+
+        If version is 7, bytes holding the bundle in the binary format are
+        returned instead (see the description of that format above).
+
+        The other parameters are as for dump_page and dump_room.'''
+
+        if version == BINARY_FORMAT_VERSION:
+            records = [self.dump_page(page, mtime=mtime, gentime=gentime, version=version)]
+            for room in page.rooms.values():
+                records.append(self.dump_room(room, public_id_filter=public_id_filter, mtime=mtime, gentime=gentime, version=version))
+            numbers = _BINARY_BUNDLE.pack(page.page, len(page.rooms))
+            header = _BINARY_HEADER.pack(b'B7', len(numbers) + sum(map(len, records)))
+            checksums = [record[-_BINARY_FOOTER.size:][:20] for record in records]
+            return b''.join([header, numbers] + records + [self._binary_footer(
+                hashlib.sha1(b''.join([header, numbers] + checksums)).digest(),
+                gentime or page.source_compiled_date, mtime or page.source_modified_date)])
+
+        if version != 6:
+            raise NotImplementedError('Only versions 6 and 7 of the magic map format are understood.')
+
+        preamble = 'B6 %d %d' % (page.page, len(page.rooms))
+        records = [self.dump_page(page, mtime=mtime, gentime=gentime, version=version)]
+        for room in page.rooms.values():
+            records.append(self.dump_room(room, public_id_filter=public_id_filter, mtime=mtime, gentime=gentime, version=version))
+        checksums = [record.rsplit('\n', 1)[-1].split(' ', 1)[0] for record in records]
+
+        return '\n'.join([preamble]+records+[
+            '%'+base64.b64encode(hashlib.sha1(('\n'.join([preamble]+checksums)+'\n').encode('utf-8')).digest()).decode('utf-8')+' '+
+            (gentime or page.source_compiled_date or datetime.datetime.now()).strftime('%Y-%m-%dT%H:%M:%S.%f')+' '+
+            (mtime   or page.source_modified_date or datetime.datetime.now()).strftime('%Y-%m-%dT%H:%M:%S.%f')
+        ])
+
     def encode_map_elements(self, element_list, width=78):
         "Take internal-format display element list and return multi-line ASCII representation of it as a list of lines."
         #
@@ -170,6 +334,84 @@ class MapDataHandler (object):
 
         return '@' + ','.join(map(self.encode_text, list))
 
+    def _dump_binary_record(self, format_code, value, gentime, mtime):
+        "Return a complete version 7 page or room record holding value."
+        strings = {}
+        output = []
+        self._encode_binary_value(value, output, strings)
+
+        table = [_BINARY_COUNT.pack(len(strings))]
+        for text in strings:
+            encoded = text.encode('utf-8')
+            table.append(_BINARY_COUNT.pack(len(encoded)))
+            table.append(encoded)
+        body = b''.join(table + output)
+        header = _BINARY_HEADER.pack(format_code, len(body))
+        return header + body + self._binary_footer(hashlib.sha1(header + body).digest(), gentime, mtime)
+
+    def _binary_footer(self, checksum, gentime, mtime):
+        return _BINARY_FOOTER.pack(checksum,
+            (gentime or datetime.datetime.now()).strftime(_TIMESTAMP_FORMAT).encode('ascii'),
+            (mtime   or datetime.datetime.now()).strftime(_TIMESTAMP_FORMAT).encode('ascii'))
+
+    def _encode_binary_value(self, value, output, strings):
+        "Append the version 7 encoding of value to the output list, adding its strings to the strings table."
+        if isinstance(value, (list, tuple)):
+            if value and (all(isinstance(element, int) for element in value)
+                    or all(isinstance(element, float) for element in value)):
+                output.append(self._pack_binary_numbers(value))
+                return
+            output.append(self._pack_binary_value('[L', len(value)))
+            for element in value:
+                self._encode_binary_value(element, output, strings)
+        elif isinstance(value, int):
+            output.append(self._pack_binary_value('bhiq', value))
+        elif isinstance(value, float):
+            # rounded as in the text format, so both decode to the same value
+            value = round(value, 5)
+            type_code = 'f' if self._fits_binary_float(value) else 'd'
+            output.append(type_code.encode('ascii') + _BINARY_VALUES[ord(type_code)].pack(value))
+        elif not isinstance(value, str):
+            raise TypeError("Can't encode "+repr(value)+" (unsupported data type)")
+        else:
+            output.append(self._pack_binary_value('sS', strings.setdefault(value, len(strings))))
+
+    def _fits_binary_float(self, value):
+        "Does the (rounded) float value survive being stored as a 4-byte float?"
+        try:
+            return value != value or _BINARY_VALUES[ord('f')].unpack(_BINARY_VALUES[ord('f')].pack(value))[0] == value
+        except OverflowError:
+            return False
+
+    def _pack_binary_numbers(self, values):
+        "Pack a non-empty list of only integers or only floats as an n or N value."
+        if isinstance(values[0], float):
+            values = [round(value, 5) for value in values]
+            type_code = 'f' if all(map(self._fits_binary_float, values)) else 'd'
+        else:
+            low = min(values)
+            high = max(values)
+            for type_code in 'bhiq':
+                try:
+                    _BINARY_VALUES[ord(type_code)].pack(low)
+                    _BINARY_VALUES[ord(type_code)].pack(high)
+                    break
+                except struct.error:
+                    pass
+            else:
+                raise TypeError("Can't encode "+repr(low if low < 0 else high)+" (integer out of range)")
+        return self._pack_binary_value('nN', len(values)) + type_code.encode('ascii') \
+            + struct.pack('>%d%s' % (len(values), type_code), *values)
+
+    def _pack_binary_value(self, type_codes, value):
+        "Pack the integer value using the first of the type codes whose size holds it."
+        for type_code in type_codes:
+            try:
+                return type_code.encode('ascii') + _BINARY_VALUES[ord(type_code)].pack(value)
+            except struct.error:
+                pass
+        raise TypeError("Can't encode "+repr(value)+" (integer out of range)")
+
     def _parse_header(self, header):
         "Parse out the encoded fields of a header line and return them as a list of values."
         return list(map(self.decode_value, header.split()))
@@ -225,47 +467,264 @@ class MapDataHandler (object):
     def decode_object_list(self, encoded_data):
         "Read encoded object list from encoded string and return it as a list object."
 
-        self._encoded_list = encoded_data.split()
-        if not self._encoded_list:
+        tokens = encoded_data.split()
+        if not tokens:
             return None
+        #
+        # Walk the tokens in order, keeping each enclosing list (and how many
+        # more elements it expects) on a stack while a nested list is being
+        # read.  The whole object list is read as the one element of an
+        # outer holder list.
+        #
+        decode_value = self.decode_value
+        end = len(tokens)
+        position = 0
+        stack = []
+        current = []
+        count = 1
+        while True:
+            while count > 0:
+                if position >= end:
+                    raise ElementListLengthError('Ran out of data early (%d more elements expected at current level)' % count)
+
+                token = tokens[position]
+                if token[:1] == ':':
+                    try:
+                        new_count = int(token[1:])
+                    except ValueError:
+                        raise ElementListFormatError('Unrecognizable start-of-list marker "'+token+'".') from None
+                    stack.append((current, count))
+                    current = []
+                    count = new_count
+                elif not stack:
+                    raise ElementListFormatError('Start-of-list marker expected at "'+' '.join(tokens[position:])+'".')
+                else:
+                    try:
+                        current.append(decode_value(token))
+                    except ValueError:
+                        raise ElementListFormatError('Error decoding value "'+token+'".') from None
+                    count -= 1
+                position += 1
+
+            if not stack:
+                break
+            finished = current
+            current, count = stack.pop()
+            current.append(finished)
+            count -= 1
 
-        obj_list = self._decode_object_list_next_layer()
-        
-        if self._encoded_list:
-            raise DataAfterElementList('Extra data after last list element at "'+' '.join(self._encoded_list)+'".')
+        if position < end:
+            raise DataAfterElementList('Extra data after last list element at "'+' '.join(tokens[position:])+'".')
+
+        return current[0]
+
+    def _check_binary_record(self, view, position, format_code, version_error, kind):
+        '''Check the header, length, and checksum of the version 7 record starting at
+        position in view (a memoryview), which should have the given format code.
+        Returns (body start, body end, footer dictionary as from parse_footer).'''
+
+        if len(view) - position < _BINARY_HEADER.size + _BINARY_FOOTER.size:
+            raise MapDataLengthError('Truncated or corrupt %s data (only %d bytes)' % (kind.lower(), len(view) - position))
 
-        return obj_list
+        code, length = _BINARY_HEADER.unpack_from(view, position)
+        if code != format_code:
+            raise version_error('%s data claims to be in "%s" format which is not supported.' % (kind, code.decode('ascii', 'replace')))
 
-    def _decode_object_list_next_layer(self):
-        "Internal function called recursively to decode each level of nested list elements."
+        body = position + _BINARY_HEADER.size
+        end = body + length
+        if end + _BINARY_FOOTER.size > len(view):
+            raise MapDataLengthError('Truncated or corrupt %s data (only %d of %d bytes)' % (
+                kind.lower(), len(view) - position, end + _BINARY_FOOTER.size - position))
 
-        v = []
-        if not self._encoded_list:
-            raise ElementListLengthError('Unexpected end of object list reached')
-        if self._encoded_list[0][:1] != ':':
-            raise ElementListFormatError('Start-of-list marker expected at "'+' '.join(self._encoded_list)+'".')
+        checksum, compiled, modified = _BINARY_FOOTER.unpack_from(view, end)
         try:
-            marker = self._encoded_list.pop(0)
-            count = int(marker[1:])
-        except:
-            raise ElementListFormatError('Unrecognizable start-of-list marker "'+marker+'".')
+            footer = dict(
+                    checksum = checksum,
+                    compiled = datetime.datetime.strptime(compiled.rstrip(b'\0').decode('ascii'), _TIMESTAMP_FORMAT),
+                    modified = datetime.datetime.strptime(modified.rstrip(b'\0').decode('ascii'), _TIMESTAMP_FORMAT),
+            )
+        except Exception as e:
+            raise InvalidMapDataFooter('Unable to understand %s footer (%s)' % (kind.lower(), e))
 
-        while count > 0:
-            if not self._encoded_list:
-                raise ElementListLengthError('Ran out of data early (%d more elements expected at current level)' % count)
+        if format_code != b'B7':
+            s1 = hashlib.sha1(view[position:end]).digest()
+            if s1 != checksum:
+                raise MapDataChecksumError('%s data checksum error (was %s, expected %s).' % (
+                    kind, base64.b64encode(s1), base64.b64encode(checksum)))
 
-            if self._encoded_list[0][:1] == ':':
-                v.append(self._decode_object_list_next_layer())
-            else:
-                try:
-                    v.append(self.decode_value(self._encoded_list.pop(0)))
-                except ValueError:
-                    raise ElementListFormatError('Error decoding value "'+v+'".')
+        return body, end, footer
+
+    def _decode_binary_body(self, view, position, end):
+        '''Decode the string table and value making up the body of a version 7 page
+        or room record (view[position:end]) and return the value.'''
+
+        view = view[:end]
+        strings = []
+        try:
+            count, = _BINARY_COUNT.unpack_from(view, position)
+            position += _BINARY_COUNT.size
+            for i in range(count):
+                length, = _BINARY_COUNT.unpack_from(view, position)
+                position += _BINARY_COUNT.size
+                if position + length > end:
+                    raise ElementListLengthError('String table runs past the end of the data')
+                strings.append(str(view[position:position+length], 'utf-8'))
+                position += length
+        except struct.error:
+            raise ElementListLengthError('String table runs past the end of the data') from None
+        except UnicodeDecodeError as e:
+            raise ElementListFormatError('Invalid string in string table (%s)' % e) from None
+        #
+        # As for decode_object_list, the enclosing lists are kept on a stack
+        # while a nested one is read, and the value is read as the one
+        # element of an outer holder list.
+        #
+        stack = []
+        current = []
+        count = 1
+        while True:
+            while count > 0:
+                if position >= end:
+                    raise ElementListLengthError('Ran out of data early (%d more elements expected at current level)' % count)
 
+                try:
+                    unpacker, kind = _BINARY_DECODERS[view[position]]
+                except KeyError:
+                    raise ElementListFormatError('Unrecognizable value type code %d at byte %d.' % (view[position], position)) from None
+                try:
+                    value, = unpacker.unpack_from(view, position + 1)
+                except struct.error:
+                    raise ElementListLengthError('Ran out of data early (%d more elements expected at current level)' % count) from None
+                position += 1 + unpacker.size
+
+                if kind == _BINARY_NUMBER:
+                    current.append(value)
+                    count -= 1
+                    continue
+                if kind == _BINARY_PACKED:
+                    if position >= end or view[position] not in _BINARY_NUMBERS:
+                        raise ElementListFormatError('Unrecognizable number type code at byte %d.' % position)
+                    try:
+                        current.append(list(struct.unpack_from('>%d%c' % (value, view[position]), view, position + 1)))
+                    except struct.error:
+                        raise ElementListLengthError('Ran out of data early (%d numbers expected in list)' % value) from None
+                    position += 1 + value * _BINARY_VALUES[view[position]].size
+                    count -= 1
+                    continue
+                if kind == _BINARY_LIST:
+                    stack.append((current, count))
+                    current = []
+                    count = value
+                    continue
+                if value >= len(strings):
+                    raise ElementListFormatError('String index %d out of range (only %d strings)' % (value, len(strings)))
+                current.append(strings[value])
+                count -= 1
+
+            if not stack:
+                break
+            finished = current
+            current, count = stack.pop()
+            current.append(finished)
             count -= 1
 
-        return v
-    
+        if position < end:
+            raise DataAfterElementList('Extra data (%d bytes) after last list element.' % (end - position))
+
+        return current[0]
+
+    def _decode_binary_fields(self, view, position, end, types, header_error, kind):
+        "Decode a version 7 page or room body, checking its fields are of the given types."
+        fields = self._decode_binary_body(view, position, end)
+        if not isinstance(fields, list) or len(fields) != len(types):
+            raise header_error('%s data should hold %d fields' % (kind, len(types)))
+
+        for idx,tp in enumerate(types):
+            if not isinstance(fields[idx], tp):
+                raise header_error('%s field #%d (%s) type mismatch' % (kind, idx, repr(fields[idx])))
+
+        return fields
+
+    def _load_binary_page(self, view, position=0):
+        "Read the version 7 page record at position in view -> (MapPage, checksum, position after it)"
+
+        body, end, footer = self._check_binary_record(view, position, b'P7', UnsupportedPageVersion, 'Page')
+        fields = self._decode_binary_fields(view, body, end, (int, str, str, list, list), InvalidPageHeader, 'Page')
+        if fields[1] not in ('L','P'):
+            raise InvalidPageHeader('Page orientation "'+fields[1]+'" not recognized.')
+
+        return MapPage(fields[0], realm=fields[2], orient=(LANDSCAPE if fields[1]=='L' else PORTRAIT), creators=fields[3],
+                bg=fields[4], source_compiled_date=footer['compiled'], source_modified_date=footer['modified']
+        ), footer['checksum'], end + _BINARY_FOOTER.size
+
+    def _load_binary_room(self, view, position=0):
+        "Read the version 7 room record at position in view -> (page number, MapRoom, checksum, position after it)"
+
+        body, end, footer = self._check_binary_record(view, position, b'R7', UnsupportedRoomVersion, 'Room')
+        fields = self._decode_binary_fields(view, body, end, (str, int, str, list, (int,float), (int,float), list), InvalidRoomHeader, 'Room')
+        if fields[4] == 0 and fields[5] == 0:
+            ref = None
+        else:
+            ref = (fields[4], fields[5])
+
+        return fields[1], MapRoom(fields[0], None, name=fields[2], also=fields[3], map=fields[6],
+                source_modified_date=footer['modified'], source_compiled_date=footer['compiled'],
+                reference_point=ref
+        ), footer['checksum'], end + _BINARY_FOOTER.size
+
+    def _load_binary_bundle(self, view):
+        "Read a version 7 bundle -> MapPage holding all its rooms"
+
+        body, end, footer = self._check_binary_record(view, 0, b'B7', UnsupportedBundleVersion, 'Bundle')
+        if end - body < _BINARY_BUNDLE.size:
+            raise InvalidBundleHeader('Truncated bundle header')
+        page_number, rooms = _BINARY_BUNDLE.unpack_from(view, body)
+        checksums = [view[:body + _BINARY_BUNDLE.size]]
+        #
+        # The records inside can't run past the end of the bundle's body.
+        #
+        records = view[:end]
+        page, checksum, position = self._load_binary_page(records, body + _BINARY_BUNDLE.size)
+        checksums.append(checksum)
+        if page.page != page_number:
+            raise InvalidBundleHeader('Bundle for page %d holds page %d' % (page_number, page.page))
+        for record in range(rooms):
+            if position >= end:
+                raise MapDataLengthError('Truncated or corrupt bundle data (only %d of %d records)' % (
+                    record + 1, rooms + 1))
+            room_page_number, room, checksum, position = self._load_binary_room(records, position)
+            if room_page_number != page.page:
+                raise MapDataLengthError('Room %s in bundle for page %d claims to be on page %d' % (
+                    room.id, page.page, room_page_number))
+            room.page = page
+            page.add_room(room)
+            checksums.append(checksum)
+
+        if position != end:
+            raise MapDataLengthError('Extra data (%d bytes) after the last record in the bundle' % (end - position))
+
+        s1 = hashlib.sha1(b''.join(checksums)).digest()
+        if s1 != footer['checksum']:
+            raise MapDataChecksumError('Bundle data checksum error (was %s, expected %s).' % (
+                base64.b64encode(s1), base64.b64encode(footer['checksum'])))
+
+        return page
+
+    def _binary_view(self, data, kind):
+        '''If data (str or bytes) is in the version 7 format, return a memoryview
+        of it (after checking there's nothing after the record).  Otherwise
+        return None.'''
+
+        if isinstance(data, str) or bytes(data[:2]) not in _BINARY_FORMAT_CODES:
+            return None
+
+        view = memoryview(data).cast('B')
+        if len(view) >= _BINARY_HEADER.size:
+            end = _BINARY_HEADER.size + _BINARY_HEADER.unpack_from(view)[1] + _BINARY_FOOTER.size
+            if len(view) > end:
+                raise MapDataLengthError('Extra data (%d bytes) after end of %s data' % (len(view) - end, kind))
+        return view
+
     def parse_page_header(self, header):
         "Read page header line, return dictionary of page attributes"
 
@@ -335,6 +794,33 @@ class MapDataHandler (object):
                 objlines=fields[7],
         )
 
+    def parse_bundle_header(self, header):
+        "Read bundle header line, return dictionary of bundle attributes"
+
+        try:
+            fields = [self.decode_value(v) for v in header.split()]
+        except:
+            raise InvalidBundleHeader('Unable to parse bundle header line: "'+header+'"')
+
+        if not fields:
+            raise InvalidBundleHeader('Truncated bundle header line: "'+header+'"')
+
+        if fields[0] != 'B6':
+            raise UnsupportedBundleVersion('Bundle data claims to be in "'+str(fields[0])+'" format which is not supported.')
+
+        if len(fields) != 3:
+            raise InvalidBundleHeader('Bundle header contains %d fields (3 expected)' % len(fields))
+
+        for idx,tp in enumerate((str, int, int)):
+            if not isinstance(fields[idx], tp):
+                raise InvalidBundleHeader('Bundle header field #%d (%s) type mismatch' % (idx, repr(fields[idx])))
+
+        return dict(
+                format=fields[0],
+                page=fields[1],
+                rooms=fields[2],
+        )
+
     def parse_footer(self, footer):
         "decode room or page footer line and return dictionary of its fields."
 
@@ -356,9 +842,15 @@ class MapDataHandler (object):
 
     def load_page_file(self, fileobj):
         "Load a page (returning a new MapPage object) from an encoded file, given a file object to read."
-        return self.load_page_list(fileobj.readlines())
+        return self.load_page(fileobj.read())
 
     def load_page(self, filedata):
+        "Load a page from its data (text or binary format, as str or bytes)."
+        view = self._binary_view(filedata, 'page')
+        if view is not None:
+            return self._load_binary_page(view)[0]
+        if not isinstance(filedata, str):
+            filedata = str(filedata, 'utf-8')
         return self.load_page_list(filedata.splitlines(True))
 
     def load_page_list(self, lines):
@@ -389,9 +881,15 @@ class MapDataHandler (object):
 
     def load_room_file(self, fileobj):
         "Load a room (returning a new MapRoom object) from an encoded file, given a file object to read."
-        return self.load_room_list(fileobj.readlines())
+        return self.load_room(fileobj.read())
 
     def load_room(self, roomdata):
+        "Load a room from its data (text or binary format, as str or bytes) -> (page number, MapRoom)"
+        view = self._binary_view(roomdata, 'room')
+        if view is not None:
+            return self._load_binary_room(view)[:2]
+        if not isinstance(roomdata, str):
+            roomdata = str(roomdata, 'utf-8')
         return self.load_room_list(roomdata.splitlines(True))
 
     def load_room_list(self, lines):
@@ -421,6 +919,67 @@ class MapDataHandler (object):
                 source_modified_date=footer['modified'], source_compiled_date=footer['compiled'],
                 reference_point=header['ref']
         )
+
+    def load_bundle_file(self, fileobj):
+        "Load a page bundle (returning a new MapPage object holding all its rooms) from an encoded file, given a file object to read."
+        return self.load_bundle(fileobj.read())
+
+    def load_bundle(self, bundledata):
+        "Load a page bundle from its data (text or binary format, as str or bytes)."
+        view = self._binary_view(bundledata, 'bundle')
+        if view is not None:
+            return self._load_binary_bundle(view)
+        if not isinstance(bundledata, str):
+            bundledata = str(bundledata, 'utf-8')
+        return self.load_bundle_list(bundledata.splitlines(True))
+
+    def load_bundle_list(self, lines):
+        lines = [s.replace('\r\n', '\n') for s in lines]
+
+        if len(lines) < 2:
+            raise MapDataLengthError('Truncated or corrupt bundle data (only %d line%s)' % (
+                len(lines), 's' if len(lines) != 1 else ''))
+
+        header = self.parse_bundle_header(lines[0])
+        checksums = [lines[0].rstrip('\n')]
+        #
+        # The page record, then each room record, each of which
+        # tells us how many lines of data it has.
+        #
+        start = 1
+        for record in range(header['rooms'] + 1):
+            if start >= len(lines):
+                raise MapDataLengthError('Truncated or corrupt bundle data (only %d of %d records)' % (
+                    record, header['rooms'] + 1))
+            if record == 0:
+                end = start + self.parse_page_header(lines[start])['bglines'] + 2
+                page = self.load_page_list(lines[start:end])
+            else:
+                end = start + self.parse_room_header(lines[start])['objlines'] + 2
+                page_number, room = self.load_room_list(lines[start:end])
+                if page_number != page.page:
+                    raise MapDataLengthError('Room %s in bundle for page %d claims to be on page %d' % (
+                        room.id, page.page, page_number))
+                room.page = page
+                page.add_room(room)
+            checksums.append(lines[end-1].split(' ', 1)[0])
+            start = end
+
+        if start >= len(lines):
+            raise MapDataLengthError('Truncated or corrupt bundle data (missing footer)')
+        footer = self.parse_footer(lines[start])
+
+        for extra_line in lines[start+1:]:
+            if extra_line.strip():
+                raise MapDataLengthError('Extra line(s) after end of data: ' + extra_line)
+
+        s1 = hashlib.sha1(('\n'.join(checksums)+'\n').encode('utf-8')).digest()
+        if s1 != footer['checksum']:
+            raise MapDataChecksumError('Bundle data checksum error (was %s, expected %s).' % (
+                base64.b64encode(s1), base64.b64encode(footer['checksum'])))
+
+        return page
+
 #@[00]@| Ragnarok MagicMapper 6.1.0-alpha.0
 #@[01]@|
 #@[10]@| Copyright © 2010, 2018, 2020, 2021, 2022 by Steven L. Willoughby, Aloha, Oregon, USA.
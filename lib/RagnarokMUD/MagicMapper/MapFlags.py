@@ -0,0 +1,153 @@
+########################################################################################
+#  _______  _______  _______ _________ _______  _______  _______  _______              #
+# (       )(  ___  )(  ____ \\__   __/(  ____ \(       )(  ___  )(  ____ ) Ragnarok    #
+# | () () || (   ) || (    \/   ) (   | (    \/| () () || (   ) || (    )| MUD         #
+# | || || || (___) || |         | |   | |      | || || || (___) || (____)| Magic       #
+# | |(_)| ||  ___  || | ____    | |   | |      | |(_)| ||  ___  ||  _____) Mapper      #
+# | |   | || (   ) || | \_  )   | |   | |      | |   | || (   ) || (       Client      #
+# | )   ( || )   ( || (___) |___) (___| (____/\| )   ( || )   ( || )       (rag.com)   #
+# |/     \||/     \|(_______)\_______/(_______/|/     \||/     \||/                    #
+#   ______    __       _______         _______  _        _______           _______     #
+#  / ____ \  /  \     (  __   )       (  ___  )( \      (  ____ )|\     /|(  ___  )    #
+# ( (    \/  \/) )    | (  )  |       | (   ) || (      | (    )|| )   ( || (   ) |    #
+# | (____      | |    | | /   | _____ | (___) || |      | (____)|| (___) || (___) |    #
+# |  ___ \     | |    | (/ /) |(_____)|  ___  || |      |  _____)|  ___  ||  ___  |    #
+# | (   ) )    | |    |   / | |       | (   ) || |      | (      | (   ) || (   ) |    #
+# ( (___) )_ __) (_ _ |  (__) |       | )   ( || (____/\| )      | )   ( || )   ( | _  #
+#  \_____/(_)\____/(_)(_______)       |/     \|(_______/|/       |/     \||/     \|(_) #
+#                                                                                      #
+########################################################################################
+#
+# RAGNAROK MAGIC MAPPER SOURCE CODE: Room, exit and drawing flag bits
+#
+
+#
+# Drawing elements carry their flags as letters after the element type
+# code (e.g., "Rdo" for a dark outdoor room or "Pcf" for a filled shape).
+# While compiling and rendering, a set of flags is held as a bitmask
+# instead.  Each flag letter has its own bit, assigned in sorted order,
+# so a mask turns back into the same sorted string of letters the
+# compiler has always emitted.  The string for each mask (and the mask
+# for each string) is worked out once and then shared.
+#
+# The same letter means different things to different element types
+# (an "o" room is outdoors, an "o" exit is out-only), so the names below
+# are just aliases for the bits by meaning.
+#
+FLAG_LETTERS = '!2@CDLMSTbcdfgiopstx'
+FLAG_BITS = dict((letter, 1 << bit) for bit, letter in enumerate(FLAG_LETTERS))
+
+ROOM_CURVED      = FLAG_BITS['c']
+ROOM_DARK        = FLAG_BITS['d']
+ROOM_TEXTFONT    = FLAG_BITS['f']
+ROOM_OUTDOOR     = FLAG_BITS['o']
+ROOM_PROTO       = FLAG_BITS['p']
+ROOM_PHANTOM     = FLAG_BITS['x']
+CURRENT_LOCATION = FLAG_BITS['@']       # added by the renderer, never compiled
+
+EXIT_SPECIAL     = FLAG_BITS['!']
+EXIT_DOUBLE      = FLAG_BITS['2']
+EXIT_CONCEALED   = FLAG_BITS['C']
+EXIT_DOOR        = FLAG_BITS['D']
+EXIT_LOCKED      = FLAG_BITS['L']
+EXIT_MAGIC       = FLAG_BITS['M']
+EXIT_SECRET      = FLAG_BITS['S']
+EXIT_TURNSTILE   = FLAG_BITS['T']
+EXIT_GAP         = FLAG_BITS['g']
+EXIT_IN          = FLAG_BITS['i']
+EXIT_OUT         = FLAG_BITS['o']
+EXIT_PORTCULLIS  = FLAG_BITS['p']
+EXIT_TAPESTRY    = FLAG_BITS['t']
+EXIT_OFFPAGE     = FLAG_BITS['x']
+EXIT_DOORWAYS    = EXIT_MAGIC | EXIT_DOOR | EXIT_GAP | EXIT_PORTCULLIS | EXIT_TURNSTILE \
+                 | EXIT_CONCEALED | EXIT_SECRET | EXIT_TAPESTRY
+EXIT_GAPS        = EXIT_MAGIC | EXIT_GAP | EXIT_PORTCULLIS | EXIT_TURNSTILE
+
+PATH_BEZIER      = FLAG_BITS['b']
+PATH_CLOSED      = FLAG_BITS['c']
+PATH_FILLED      = FLAG_BITS['f']
+PATH_SPLINE      = FLAG_BITS['s']
+
+#
+# Flags may be followed by colors, which are skipped when reading them:
+# $nn (grey level), #rrggbb (fill) and *rrggbb (text or exit color).
+#
+_COLOR_LENGTHS = {'$': 2, '#': 6, '*': 6}
+_CACHE_MAX = 10000
+
+_codes = {0: ''}
+_masks = {'': 0}
+
+def flag_bit(letter):
+    "Return the bit for the flag letter given."
+    try:
+        return FLAG_BITS[letter]
+    except KeyError:
+        raise ValueError('"{0}" is not a valid flag letter'.format(letter)) from None
+
+def flag_code(mask):
+    "Return the string of flag letters, in sorted order, for a bitmask."
+    code = _codes.get(mask)
+    if code is None:
+        code = ''.join([letter for letter in FLAG_LETTERS if mask & FLAG_BITS[letter]])
+        _codes[mask] = code
+    return code
+
+def flag_mask(code):
+    '''Return the bitmask of the flags in a string of flag letters.
+
+    Letters which aren't flags are ignored, as are the colors which may
+    follow them.'''
+    mask = _masks.get(code)
+    if mask is None:
+        mask = 0
+        position = 0
+        while position < len(code):
+            letter = code[position]
+            position += 1 + _COLOR_LENGTHS.get(letter, 0)
+            mask |= FLAG_BITS.get(letter, 0)
+        if len(_masks) >= _CACHE_MAX:
+            _masks.clear()
+        _masks[code] = mask
+    return mask
+
+#@[00]@| Ragnarok MagicMapper 6.1.0-alpha.0
+#@[01]@|
+#@[10]@| Copyright © 2010, 2018, 2020, 2021, 2022 by Steven L. Willoughby, Aloha, Oregon, USA.
+#@[11]@| All Rights Reserved. Licensed under the terms and conditions of the BSD-3-Clause
+#@[12]@| License as described in the accompanying LICENSE file distributed with MagicMapper.
+#@[13]@|
+#@[20]@| Based on earlier code from the Ragnarok MudShell (MSH) client,
+#@[21]@| Copyright © 1993, 2000-2003 by Steven L. Willoughby, Aloha, Oregon, USA.
+#@[22]@| MSH is licensed under the terms and conditions of the BSD-3-Clause
+#@[23]@|
+#@[30]@| Redistribution and use in source and binary forms, with or without
+#@[31]@| modification, are permitted provided that the following conditions
+#@[32]@| are met:
+#@[33]@| 1. Redistributions of source code must retain the above copyright
+#@[34]@|    notice, this list of conditions and the following disclaimer.
+#@[35]@| 2. Redistributions in binary form must reproduce the above copy-
+#@[36]@|    right notice, this list of conditions and the following dis-
+#@[37]@|    claimer in the documentation and/or other materials provided
+#@[38]@|    with the distribution.
+#@[39]@| 3. Neither the name of the copyright holder nor the names of its
+#@[40]@|    contributors may be used to endorse or promote products derived
+#@[41]@|    from this software without specific prior written permission.
+#@[42]@|
+#@[43]@| THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND
+#@[44]@| CONTRIBUTORS “AS IS” AND ANY EXPRESS OR IMPLIED WARRANTIES,
+#@[45]@| INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+#@[46]@| MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+#@[47]@| DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS
+#@[48]@| BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY,
+#@[49]@| OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+#@[50]@| PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+#@[51]@| PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+#@[52]@| THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+#@[53]@| TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF
+#@[54]@| THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+#@[55]@| SUCH DAMAGE.
+#@[56]@|
+#@[60]@| This software is not intended for any use or application in which
+#@[61]@| the safety of lives or property would be at risk due to failure or
+#@[62]@| defect of the software.
@@ -48,11 +48,14 @@ class MapManager (object):
         self.parser = MapDataHandler()
         self.config = config
         self.rooms = {}
+        self.bundled_rooms = {}     # rooms we got in page bundles but haven't visited yet
+        self.use_bundles = True     # until we find the server doesn't have them
         self.io = NetworkIO(base_url=config.get('server', 'base_url'), 
                 cache_dir=config.get('cache', 'location'), 
                 cache_age=config.getint('cache', 'recheck_age'), 
                 diag_callback=self.diag_logger,
-                config=config)
+                config=config,
+                data_format=config.getint('server', 'data_format'))
     
     def diag_logger(self, level, prog, total, msg):
         print("XXX [{}] {}/{} {}".format(level, prog, total, msg))
@@ -82,6 +85,7 @@ class MapManager (object):
         c = self.db.cursor()
         self.pages = {}
         self.rooms = {}
+        self.bundled_rooms = {}
 
         for room_id in c.execute('select room_id from rooms'):
             try:
@@ -119,12 +123,16 @@ class MapManager (object):
             return self.rooms[room_id]
 
         try:
-            page_number, room = self.parser.load_room(self.io.get_room(room_id))
+            if room_id in self.bundled_rooms:
+                page_number, room = self.bundled_rooms.pop(room_id)
+            else:
+                page_number, room = self.parser.load_room(self.io.get_room(room_id))
             if page_number in self.pages:
                 page = self.pages[page_number]
             else:
-                page = self.parser.load_page(self.io.get_page(page_number))
+                page = self._load_page(page_number)
                 self.pages[page_number] = page
+                self.bundled_rooms.pop(room_id, None)
 
             page.add_room(room)
             room.page = page
@@ -134,6 +142,27 @@ class MapManager (object):
 
         return room
 
+    def _load_page(self, page_number):
+        """Get a page we haven't seen yet from the server or cache.  We ask for
+        its bundle first, so the rest of its rooms come along in the same request
+        (they're kept in bundled_rooms until we actually go there, so they don't
+        appear on the map before then).  If the server doesn't have bundles, we
+        just get the page (and don't ask for bundles again)."""
+
+        if not self.use_bundles:
+            return self.parser.load_page(self.io.get_page(page_number))
+        try:
+            page = self.parser.load_bundle(self.io.get_bundle(page_number))
+        except DataNotFound:
+            self.use_bundles = False
+            return self.parser.load_page(self.io.get_page(page_number))
+
+        for room_id, room in page.rooms.items():
+            if room_id not in self.rooms:
+                self.bundled_rooms[room_id] = (page_number, room)
+        page.rooms = {}
+        return page
+
     def close(self):
         if self.db is not None:
             self.db.close()
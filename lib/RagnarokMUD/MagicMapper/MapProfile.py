@@ -0,0 +1,196 @@
+########################################################################################
+#  _______  _______  _______ _________ _______  _______  _______  _______              #
+# (       )(  ___  )(  ____ \\__   __/(  ____ \(       )(  ___  )(  ____ ) Ragnarok    #
+# | () () || (   ) || (    \/   ) (   | (    \/| () () || (   ) || (    )| MUD         #
+# | || || || (___) || |         | |   | |      | || || || (___) || (____)| Magic       #
+# | |(_)| ||  ___  || | ____    | |   | |      | |(_)| ||  ___  ||  _____) Mapper      #
+# | |   | || (   ) || | \_  )   | |   | |      | |   | || (   ) || (       Client      #
+# | )   ( || )   ( || (___) |___) (___| (____/\| )   ( || )   ( || )       (rag.com)   #
+# |/     \||/     \|(_______)\_______/(_______/|/     \||/     \||/                    #
+#   ______    __       _______         _______  _        _______           _______     #
+#  / ____ \  /  \     (  __   )       (  ___  )( \      (  ____ )|\     /|(  ___  )    #
+# ( (    \/  \/) )    | (  )  |       | (   ) || (      | (    )|| )   ( || (   ) |    #
+# | (____      | |    | | /   | _____ | (___) || |      | (____)|| (___) || (___) |    #
+# |  ___ \     | |    | (/ /) |(_____)|  ___  || |      |  _____)|  ___  ||  ___  |    #
+# | (   ) )    | |    |   / | |       | (   ) || |      | (      | (   ) || (   ) |    #
+# ( (___) )_ __) (_ _ |  (__) |       | )   ( || (____/\| )      | )   ( || )   ( | _  #
+#  \_____/(_)\____/(_)(_______)       |/     \|(_______/|/       |/     \||/     \|(_) #
+#                                                                                      #
+########################################################################################
+#
+# RAGNAROK MAGIC MAPPER SOURCE CODE: Compiler profiling statistics
+#
+
+import json
+
+class MapProfile (object):
+    '''Statistics about where the map compiler spends its time.
+
+    If a MapSource object's profile attribute is set to one of these,
+    add_from_file records, for each source file and each room in it:
+        seconds           wall-clock time spent (for a file, everything
+                          from reading to compiling it; for a room, the
+                          time compiling its map and bg fields)
+        tokens            number of source tokens the compiler executed
+                          (including those executed again by loops and
+                          procedures, but not those folded away)
+        loop_iterations   number of times the bodies of repeat, for, and
+                          loop commands were run
+        elements          number of drawing elements produced
+        folded            number of operations removed from procedure
+                          blocks by working them out ahead of time
+        steps             number of steps counted against the compiler's
+                          max_steps limit (see MapSource.CompileContext)
+    and make_world adds the number of bytes of compiled output written
+    for each room (and so for each file).  The limits on each compile,
+    if any, are noted in max_steps and time_limit, so the report can
+    show how close the busiest rooms came to them.
+
+    The results can be written out as a report sorted by time, either
+    as text (report) or JSON (as_dict).
+    '''
+
+    def __init__(self, max_steps=None, time_limit=None):
+        self.files = {}
+        self.rooms = {}
+        self.max_steps = max_steps
+        self.time_limit = time_limit
+
+    def record_file(self, src_filename, seconds, rooms, tokens, loop_iterations, elements, folded=0, steps=0):
+        "Note the statistics for compiling one source file."
+        self.files[src_filename] = {
+            'file':            src_filename,
+            'seconds':         seconds,
+            'rooms':           rooms,
+            'tokens':          tokens,
+            'loop_iterations': loop_iterations,
+            'elements':        elements,
+            'folded':          folded,
+            'steps':           steps,
+            'bytes':           0,
+        }
+
+    def record_room(self, room_id, src_filename, seconds, tokens, loop_iterations, elements, folded=0, steps=0):
+        "Note the statistics for compiling one room."
+        self.rooms[room_id] = {
+            'room':            room_id,
+            'file':            src_filename,
+            'seconds':         seconds,
+            'tokens':          tokens,
+            'loop_iterations': loop_iterations,
+            'elements':        elements,
+            'folded':          folded,
+            'steps':           steps,
+            'bytes':           0,
+        }
+
+    def record_output(self, room_id, nbytes):
+        "Note the size of the compiled output for a room."
+        if room_id in self.rooms:
+            self.rooms[room_id]['bytes'] = nbytes
+            src_filename = self.rooms[room_id]['file']
+            if src_filename in self.files:
+                self.files[src_filename]['bytes'] += nbytes
+
+    def merge(self, other):
+        "Add the statistics collected in another MapProfile to this one."
+        self.files.update(other.files)
+        self.rooms.update(other.rooms)
+
+    def totals(self):
+        "Return a dictionary of the statistics summed over all files."
+        result = {'files': len(self.files), 'rooms': len(self.rooms)}
+        for field in 'seconds', 'tokens', 'loop_iterations', 'elements', 'folded', 'steps', 'bytes':
+            result[field] = sum([f[field] for f in self.files.values()])
+        result['max_room_steps'] = max([r['steps'] for r in self.rooms.values()] or [0])
+        result['max_room_seconds'] = max([r['seconds'] for r in self.rooms.values()] or [0])
+        return result
+
+    def as_dict(self, limit=None):
+        '''Return the report as a dictionary (suitable for writing as JSON),
+        with the files and rooms each sorted slowest first.  If limit is
+        given, only that many of each are included.'''
+        return {
+            'limits': {'max_steps': self.max_steps, 'time_limit': self.time_limit},
+            'totals': self.totals(),
+            'files':  sorted(self.files.values(), key=lambda f: f['seconds'], reverse=True)[:limit],
+            'rooms':  sorted(self.rooms.values(), key=lambda r: r['seconds'], reverse=True)[:limit],
+        }
+
+    def report(self, limit=25):
+        "Return a text report of the slowest (up to limit) files and rooms."
+        data = self.as_dict(limit)
+        totals = data['totals']
+        lines = [
+            'Compiled {0} file{1} ({2} room{3}) in {4:.3f} seconds: {5} tokens, {6} loop iterations, {7} elements, {8} operations folded, {9} steps, {10} bytes'.format(
+                totals['files'], '' if totals['files']==1 else 's',
+                totals['rooms'], '' if totals['rooms']==1 else 's',
+                totals['seconds'], totals['tokens'], totals['loop_iterations'], totals['elements'], totals['folded'], totals['steps'], totals['bytes']),
+            'Limits per compile: {0} steps, {1} seconds; the busiest room took {2} steps, the slowest {3:.4f} seconds'.format(
+                'no limit on' if self.max_steps is None else self.max_steps,
+                'no limit on' if self.time_limit is None else self.time_limit,
+                totals['max_room_steps'], totals['max_room_seconds']),
+            '',
+            'Slowest files:',
+            '{0:>10} {1:>6} {2:>9} {3:>9} {4:>8} {5:>7} {6:>9} {7:>9}  {8}'.format('seconds', 'rooms', 'tokens', 'loops', 'elements', 'folded', 'steps', 'bytes', 'file'),
+        ]
+        for f in data['files']:
+            lines.append('{0:>10.4f} {1:>6} {2:>9} {3:>9} {4:>8} {5:>7} {6:>9} {7:>9}  {8}'.format(
+                f['seconds'], f['rooms'], f['tokens'], f['loop_iterations'], f['elements'], f['folded'], f['steps'], f['bytes'], f['file']))
+        lines.extend([
+            '',
+            'Slowest rooms:',
+            '{0:>10} {1:>9} {2:>9} {3:>8} {4:>7} {5:>9} {6:>9}  {7}'.format('seconds', 'tokens', 'loops', 'elements', 'folded', 'steps', 'bytes', 'room (file)'),
+        ])
+        for r in data['rooms']:
+            lines.append('{0:>10.4f} {1:>9} {2:>9} {3:>8} {4:>7} {5:>9} {6:>9}  {7} ({8})'.format(
+                r['seconds'], r['tokens'], r['loop_iterations'], r['elements'], r['folded'], r['steps'], r['bytes'], r['room'], r['file']))
+        return '\n'.join(lines) + '\n'
+
+    def write(self, basename, limit=25):
+        "Write the report to <basename>.txt and the full statistics to <basename>.json."
+        with open(basename + '.txt', 'w', encoding='utf-8') as report_file:
+            report_file.write(self.report(limit))
+        with open(basename + '.json', 'w', encoding='utf-8') as report_file:
+            json.dump(self.as_dict(), report_file, indent=1)
+
+#@[00]@| Ragnarok MagicMapper 6.1.0-alpha.0
+#@[01]@|
+#@[10]@| Copyright © 2010, 2018, 2020, 2021, 2022 by Steven L. Willoughby, Aloha, Oregon, USA.
+#@[11]@| All Rights Reserved. Licensed under the terms and conditions of the BSD-3-Clause
+#@[12]@| License as described in the accompanying LICENSE file distributed with MagicMapper.
+#@[13]@|
+#@[20]@| Based on earlier code from the Ragnarok MudShell (MSH) client,
+#@[21]@| Copyright © 1993, 2000-2003 by Steven L. Willoughby, Aloha, Oregon, USA.
+#@[22]@| MSH is licensed under the terms and conditions of the BSD-3-Clause
+#@[23]@|
+#@[30]@| Redistribution and use in source and binary forms, with or without
+#@[31]@| modification, are permitted provided that the following conditions
+#@[32]@| are met:
+#@[33]@| 1. Redistributions of source code must retain the above copyright
+#@[34]@|    notice, this list of conditions and the following disclaimer.
+#@[35]@| 2. Redistributions in binary form must reproduce the above copy-
+#@[36]@|    right notice, this list of conditions and the following dis-
+#@[37]@|    claimer in the documentation and/or other materials provided
+#@[38]@|    with the distribution.
+#@[39]@| 3. Neither the name of the copyright holder nor the names of its
+#@[40]@|    contributors may be used to endorse or promote products derived
+#@[41]@|    from this software without specific prior written permission.
+#@[42]@|
+#@[43]@| THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND
+#@[44]@| CONTRIBUTORS “AS IS” AND ANY EXPRESS OR IMPLIED WARRANTIES,
+#@[45]@| INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+#@[46]@| MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+#@[47]@| DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS
+#@[48]@| BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY,
+#@[49]@| OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+#@[50]@| PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+#@[51]@| PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+#@[52]@| THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+#@[53]@| TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF
+#@[54]@| THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+#@[55]@| SUCH DAMAGE.
+#@[56]@|
+#@[60]@| This software is not intended for any use or application in which
+#@[61]@| the safety of lives or property would be at risk due to failure or
+#@[62]@| defect of the software.
@@ -134,11 +134,12 @@
 #	\253 Open << quotes
 #	\273 Close >> quotes
 
-import re, math, sys
+import re, math, sys, time, mmap, functools
 import os.path
 from RagnarokMUD.MagicMapper.BasicUnits import GraphicsState, Point, Color, GreyLevel, FontSelection
 from RagnarokMUD.MagicMapper.MapRoom    import MapRoom
 from RagnarokMUD.MagicMapper.MapPage    import MapPage, LANDSCAPE, PORTRAIT, PageOrientationViolationError
+from RagnarokMUD.MagicMapper.MapFlags   import flag_bit, flag_code, PATH_BEZIER, PATH_CLOSED, PATH_FILLED, PATH_SPLINE
 
 DEFAULT_EXIT_LENGTH = 20    # units for exit passages (unless overridden)
 
@@ -160,6 +161,57 @@ class NoProcedureRunning (Exception):
 class InfiniteLoopError (Exception):
     "The road goes on and on and on and on and on and on and..."
 
+class CompileLimitError (InfiniteLoopError):
+    "Map code ran for more operations or longer than a compile is allowed."
+
+class MapRecord (dict):
+    '''One record read from a map source file: a dictionary of its fields
+    (tag -> value), with the numbers of the lines (from 1) each field's
+    value was read from in lines (tag -> [line, ...]).'''
+
+    def __init__(self):
+        dict.__init__(self)
+        self.lines = {}
+
+class MapDiagnostic (object):
+    '''A problem found in a map source file while collecting them all (see
+    MapSource.diagnostics): the source filename, line number (None if not
+    known), room (the record's room field as written, or None), and the
+    exception describing the problem.'''
+
+    def __init__(self, filename, line, room, problem):
+        self.filename = filename
+        self.line = line
+        self.room = room
+        self.problem = problem
+
+    def __str__(self):
+        return '{0}{1}: {2}{3}'.format(self.filename,
+            '' if self.line is None else ':{0}'.format(self.line),
+            '' if self.room is None else 'room {0}: '.format(self.room),
+            self.problem)
+
+class MapRecordChanges (object):
+    '''What adding one record of a map source file did to the map (see
+    MapSource.record_log), in the order add_from_file does it: the page
+    number, the compiled bg elements added to it, the realm and orientation
+    it set (each None if the record didn't get that far or didn't have one),
+    the normalized room ID it checked for duplicates, the creator it added
+    to the page (after which the room was listed in room_page), and the
+    MapRoom it added.  bg_reads and map_reads are the realm global symbols
+    its bg and map fields read (see add_from_file).'''
+
+    def __init__(self, page):
+        self.page = page
+        self.bg = None
+        self.realm = None
+        self.orient = None
+        self.room = None
+        self.creator = None
+        self.map_room = None
+        self.bg_reads = {}
+        self.map_reads = {}
+
 class MapDefSymbol (object):
     "The name of a defined symbol"
 
@@ -198,9 +250,9 @@ class RoomAttributes (object):
                 max(min(int(f_self.room_textcolor[1] * 255), 255), 0),
                 max(min(int(f_self.room_textcolor[2] * 255), 255), 0))
 
-        returnval = self.f(f_self, ''.join(sorted(f_self.room_flags)) + shade + tcolor, *args)
-        f_self.room_flags.clear()
-        f_self.exit_flags.clear()
+        returnval = self.f(f_self, flag_code(f_self.room_flags) + shade + tcolor, *args)
+        f_self.room_flags = 0
+        f_self.exit_flags = 0
         f_self.exit_direction = None
         f_self.exit_length = DEFAULT_EXIT_LENGTH
         f_self.room_shade = None
@@ -223,8 +275,8 @@ class ExitAttributes (object):
                 max(min(int(f_self.exit_color[1] * 255), 255), 0),
                 max(min(int(f_self.exit_color[2] * 255), 255), 0))
 
-        returnval = self.f(f_self, f_self.exit_direction, ''.join(sorted(f_self.exit_flags))+ecolor, *args)
-        f_self.exit_flags.clear()
+        returnval = self.f(f_self, f_self.exit_direction, flag_code(f_self.exit_flags)+ecolor, *args)
+        f_self.exit_flags = 0
         f_self.exit_direction = None
         f_self.exit_color = None
         f_self.exit_length= DEFAULT_EXIT_LENGTH
@@ -263,356 +315,431 @@ class RequireArgs (object):
       '/' the name of a symbol
       '''
 
+    # prototype letter -> method which checks one argument
+    _CHECKS = {
+        '/': '_check_symbol',
+        'c': '_check_coordinate',
+        'd': '_check_dimension',
+        'o': '_check_offset',
+        'k': '_check_color',
+        'p': '_check_pairs',
+        'x': '_check_block',
+        's': '_check_string',
+        'f': '_check_float',
+        'i': '_check_int',
+        'b': '_check_boolean',
+    }
+    # prototype letter -> types which can't fail its check (so we needn't call it)
+    _ALWAYS_OK = {
+        '/': (MapDefSymbol,),
+        'c': (float, int),
+        'd': (float, int),
+        'o': (float, int),
+        'x': (list, tuple),
+        's': (str,),
+        'f': (float,),
+        'i': (int,),
+        'b': (int,),
+    }
+
     def __init__(self, f_name, prototype):
         self.f_name = f_name
         self.prototype = prototype
+        if not isinstance(prototype, int):
+            # look these up now rather than on every call
+            self.checks = [(idx, self._ALWAYS_OK.get(check, ()), getattr(self, self._CHECKS.get(check, '_check_invalid')))
+                for idx, check in enumerate(prototype, 1)]
 
     def __call__(self, f):
         # Create wrapper function for future calls to f
-        def wrapper(f_self, *args):
-            if isinstance(self.prototype, int):
-                # Just care about quantity of args, not types
+        if isinstance(self.prototype, int):
+            # Just care about quantity of args, not types
+            def wrapper(f_self, *args):
                 if len(f_self.stack) < self.prototype:
                     raise MapFileFormatError('map definition command "{0}" needs {1} parameter{2}, but found {3}'.format(
                         self.f_name, self.prototype, ('' if self.prototype==1 else 's'), len(f_self.stack)))
-            else:
-                # check quantity AND type of args
-                if len(f_self.stack) < len(self.prototype):
-                    raise MapFileFormatError('map definition command "'+self.f_name+'" given insufficient parameters.')
-
-                for idx, check in enumerate(zip(self.prototype, f_self.stack[-len(self.prototype):])):
-                    if check[0] == '/': #symbol name
-                        if not isinstance(check[1], MapDefSymbol):
-                            raise MapFileFormatError('map definition command "%s", parameter #%d, symbol name expected (got "%s")' %
-                                    (self.f_name, idx+1, check[1]))
-
-                    elif check[0] == 'c': #coordinate value
-                        if not isinstance(check[1], (float, int)):
-                            raise MapFileFormatError('map definition command "%s", parameter #%d, coordinate value expected (got "%s")' %
-                                    (self.f_name, idx+1, check[1]))
-                        # Since we now allow scale and translate, this range check no longer makes sense.
-                        #if not 0 <= check[1] <= 700:
-                        #    raise ValueError('map definition command "%s", parameter #%d, coordinate value %f out of valid range [0,700]' %
-                        #            (self.f_name, idx+1, check[1]))
-
-                    elif check[0] == 'd': #dimension value
-                        if not isinstance(check[1], (float, int)):
-                            raise MapFileFormatError('map definition command "%s", parameter #%d, dimension value expected (got "%s")' %
-                                    (self.f_name, idx+1, check[1]))
-                        # Since we now allow scale and translate, this range check no longer makes sense.
-                        #if not 0 <= check[1] <= 700:
-                        #    raise ValueError('map definition command "%s", parameter #%d, dimension value %f out of valid range [0,700]' %
-                        #            (self.f_name, idx+1, check[1]))
-
-                    elif check[0] == 'o': #offset value
-                        if not isinstance(check[1], (float, int)):
-                            raise MapFileFormatError('map definition command "%s", parameter #%d, offset value expected (got "%s")' %
-                                    (self.f_name, idx+1, check[1]))
-                        # Since we now allow scale and translate, this range check no longer makes sense.
-                        #if not -700 <= check[1] <= 700:
-                        #    raise ValueError('map definition command "%s", parameter #%d, offset value %f out of valid range [-700,700]' %
-                        #            (self.f_name, idx+1, check[1]))
-
-                    elif check[0] == 'k': #color value (0-1)
-                        if not isinstance(check[1], (float, int)):
-                            raise MapFileFormatError('map definition command "%s", parameter #%d, color value expected (got "%s")' %
-                                    (self.f_name, idx+1, check[1]))
-                        if not 0 <= check[1] <= 1:
-                            raise ValueError('map definition command "%s", parameter #%d, color value %f out of valid range [0,1]' %
-                                    (self.f_name, idx+1, check[1]))
-
-                    elif check[0] == 'p': #array of coordinate pairs
-                        if not isinstance(check[1], (list,tuple)):
-                            raise MapFileFormatError('map definition command "%s", parameter #%d, coordinate-pair-list value expected (got "%s")' %
-                                    (self.f_name, idx+1, check[1]))
-                        if len(check[1]) % 2 != 0:
-                            raise MapFileFormatError('map definition command "%s", parameter #%d, coordinate-pair-list value "%s" has odd number of elements)' %
-                                    (self.f_name, idx+1, check[1]))
-                        # Since we now allow scale and translate, this range check no longer makes sense.
-                        #if not all([0 <= i <= 700 for i in check[1]]):
-                        #   raise ValueError('map definition command "%s", parameter #%d, coordinate(s) in list out of range [0,700]: %s' %
-                        #           (self.f_name, idx+1, check[1]))
-
-                    elif check[0] == 'x': #executable block
-                        if not isinstance(check[1], (list,tuple)):
-                            raise MapFileFormatError('map definition command "%s", parameter #%d, procedure block expected (got "%s")' %
-                                    (self.f_name, idx+1, check[1]))
-
-                    elif check[0] == 's': #string value
-                        if not isinstance(check[1], str):
-                            raise MapFileFormatError('map definition command "%s", parameter #%d, string value expected (got "%s")' %
-                                    (self.f_name, idx+1, check[1]))
-
-                    elif check[0] == 'f': #float value
-                        try:
-                            v = float(check[1])
-                        except:
-                            raise MapFileFormatError('map definition command "{0}", parameter #{1:d}, should be numeric, was "{2}"'.format(
-                                self.f_name, idx+1, check[1]))
-
-                    elif check[0] == 'i': #int value
-                        try:
-                            v = int(check[1])
-                        except:
-                            raise MapFileFormatError('map definition command "{0}", parameter #{1:d}, should be integral, was "{2}"'.format(
-                                self.f_name, idx+1, check[1]))
-
-                    elif check[0] == 'b': # boolean
-                        try:
-                            v = int(check[1])
-                        except:
-                            raise MapFileFormatError('map definition command "{0}", parameter #{1:d}, should be boolean, was "{2}"'.format(
-                                self.f_name, idx+1, check[1]))
-
-                    else:
-                        raise InternalError('BUG: PS function "%s" prototype "%s" invalid (what is "%s" supposed to mean?)' %
-                                (self.f_name, self.prototype, check[0]))
+                return f(f_self, *args)
+            return wrapper
+
+        checks = self.checks
+        nargs = len(checks)
+        def wrapper(f_self, *args):
+            # check quantity AND type of args
+            if len(f_self.stack) < nargs:
+                raise MapFileFormatError('map definition command "'+self.f_name+'" given insufficient parameters.')
+
+            if nargs:
+                for value, (idx, ok_types, check) in zip(f_self.stack[-nargs:], checks):
+                    if not isinstance(value, ok_types):
+                        check(idx, value)
             return f(f_self, *args)
         return wrapper
 
+    def _check_symbol(self, idx, value):
+        if not isinstance(value, MapDefSymbol):
+            raise MapFileFormatError('map definition command "%s", parameter #%d, symbol name expected (got "%s")' %
+                    (self.f_name, idx, value))
+
+    def _check_coordinate(self, idx, value):
+        if not isinstance(value, (float, int)):
+            raise MapFileFormatError('map definition command "%s", parameter #%d, coordinate value expected (got "%s")' %
+                    (self.f_name, idx, value))
+        # Since we now allow scale and translate, this range check no longer makes sense.
+        #if not 0 <= value <= 700:
+        #    raise ValueError('map definition command "%s", parameter #%d, coordinate value %f out of valid range [0,700]' %
+        #            (self.f_name, idx, value))
+
+    def _check_dimension(self, idx, value):
+        if not isinstance(value, (float, int)):
+            raise MapFileFormatError('map definition command "%s", parameter #%d, dimension value expected (got "%s")' %
+                    (self.f_name, idx, value))
+        # Since we now allow scale and translate, this range check no longer makes sense.
+        #if not 0 <= value <= 700:
+        #    raise ValueError('map definition command "%s", parameter #%d, dimension value %f out of valid range [0,700]' %
+        #            (self.f_name, idx, value))
+
+    def _check_offset(self, idx, value):
+        if not isinstance(value, (float, int)):
+            raise MapFileFormatError('map definition command "%s", parameter #%d, offset value expected (got "%s")' %
+                    (self.f_name, idx, value))
+        # Since we now allow scale and translate, this range check no longer makes sense.
+        #if not -700 <= value <= 700:
+        #    raise ValueError('map definition command "%s", parameter #%d, offset value %f out of valid range [-700,700]' %
+        #            (self.f_name, idx, value))
+
+    def _check_color(self, idx, value):
+        if not isinstance(value, (float, int)):
+            raise MapFileFormatError('map definition command "%s", parameter #%d, color value expected (got "%s")' %
+                    (self.f_name, idx, value))
+        if not 0 <= value <= 1:
+            raise ValueError('map definition command "%s", parameter #%d, color value %f out of valid range [0,1]' %
+                    (self.f_name, idx, value))
+
+    def _check_pairs(self, idx, value):
+        if not isinstance(value, (list,tuple)):
+            raise MapFileFormatError('map definition command "%s", parameter #%d, coordinate-pair-list value expected (got "%s")' %
+                    (self.f_name, idx, value))
+        if len(value) % 2 != 0:
+            raise MapFileFormatError('map definition command "%s", parameter #%d, coordinate-pair-list value "%s" has odd number of elements)' %
+                    (self.f_name, idx, value))
+        # Since we now allow scale and translate, this range check no longer makes sense.
+        #if not all([0 <= i <= 700 for i in value]):
+        #   raise ValueError('map definition command "%s", parameter #%d, coordinate(s) in list out of range [0,700]: %s' %
+        #           (self.f_name, idx, value))
+
+    def _check_block(self, idx, value):
+        if not isinstance(value, (list,tuple)):
+            raise MapFileFormatError('map definition command "%s", parameter #%d, procedure block expected (got "%s")' %
+                    (self.f_name, idx, value))
+
+    def _check_string(self, idx, value):
+        if not isinstance(value, str):
+            raise MapFileFormatError('map definition command "%s", parameter #%d, string value expected (got "%s")' %
+                    (self.f_name, idx, value))
+
+    def _check_float(self, idx, value):
+        try:
+            float(value)
+        except:
+            raise MapFileFormatError('map definition command "{0}", parameter #{1:d}, should be numeric, was "{2}"'.format(
+                self.f_name, idx, value))
 
-class MapSource (object):
-    '''The Ragnarok Magic Map as described in RRFC42 and RRFC46.
-    This object class understands the map file format and can
-    render images of the map.'''
-
-    _IGNORE_LINE= re.compile(r'^#|^\s*$|^%')
-    _FIELD_CONT = re.compile(r'^\s+(?P<moretext>\S.*?)\s*$')
-    _FIELD_DECL = re.compile(r'^(?P<tag>\w+)\s*:\s*(?P<value>.*?)\s*$')
-    _INT_BASE   = re.compile(r'^\s*(?P<base>\d+)#(?P<value>[0-9A-Za-z]+)\s*$')
-    _UNICODE_ESC= re.compile(r'\[#(?P<codepoint>[a-fA-F0-9]{1,6})\]')
-    
-    _LOOP_MAX = 10000   # too many iterations (emergency stop)
-
-    def __init__(self, file=None):
-        "Create map source file manager, optionally reading map in from file."
-
-        self.pages = {}
-        self.room_page = {}
-        self.realm_globals = {}
-        if file is not None:
-            self.add_from_file(file)
-
-    def _clean_dict(self, d):
-        if 'map' in d and d['map'].strip() == '':
-            del d['map']
-
-    def _each_record(self, input_file):
-        "Scan file for record blocks, generating record dictionaries for each found."
-
-        current_record = {}
-        current_tag = None
-
-        for line in input_file:
-            #
-            # Strip comments and blank lines
-            #
-            if MapSource._IGNORE_LINE.match(line):
-                continue
-            #
-            # Recognize beginning of a field (possibly
-            # a new record block)
-            #
-            decl = MapSource._FIELD_DECL.match(line)
-            if decl:
-                current_tag = decl.group('tag')
-                if current_tag == 'room':
-                    if current_record:
-                        self._clean_dict(current_record)
-                        yield current_record
-                        current_record = {}
-                    
-                if current_tag in current_record:
-                    raise MapFileFormatError('Map record for '
-                            +current_record.get('room', decl.group('value') 
-                                    if current_tag=='room' else 'unknown room')
-                            +' contains multiple '+current_tag+' fields.')
-
-                if current_tag == 'ref':
-                    try:
-                        current_record[current_tag] = tuple([float(i) for i in decl.group('value').split()])
-                    except:
-                        raise MapFileFormatError('"ref" field could not be understood: {0}'.format(line))
-                    if len(current_record[current_tag]) != 2:
-                        raise MapFileFormatError('"ref" field must have two values: {0}'.format(line))
-                else:
-                    current_record[current_tag] = decl.group('value')
-            else:
-                #
-                # recognize the continuation of the previous field
-                #
-                cont = MapSource._FIELD_CONT.match(line)
-                if cont:
-                    if current_tag is None:
-                        raise MapFileFormatError("Continuation line in map file outside containing record block: "+cont.group('moretext'))
-                    if current_tag not in ('map', 'also', 'bg'):
-                        raise MapFileFormatError('"'+current_tag+'" fields cannot have multiple lines; only "map", "also" and "bg" can do that.')
-
-                    current_record[current_tag] += '\n' + cont.group('moretext')
-                else:
-                    #
-                    # We're not sure WHAT we just read...
-                    #
-                    raise MapFileFormatError("Unrecognizable line in map file at "
-                            + current_record.get('room', 'unknown room')
-                            + ': ' + line.strip())
-        #
-        # yield last read block, if any
-        #
-        if current_record:
-            self._clean_dict(current_record)
-            yield current_record
-
-    def _normalize_room_path(self, path, creator=None):
-        """Normalize the pathanme to the room, dealing with ~ syntax, etc.
-        creator is the expected creator name (to expand for ~/)
-        The normalized name should be the same as what the mudlib would
-        represnt it as (which is very important!)
-        NOTE THAT OUR DRIVER RUNS IN COMPAT MODE so these paths are
-        relative to the root dir ("players/<name>", "room/<name>", etc.)
-
-        Returns a tuple (normalized_name, creator_name)"""
-
-        # Sanitize room pathname to /players/<name>/... with no /../
-        # Allowed input forms (all referring to ~<name>/dir/room.c):
-        #   /players/<name>/dir/room    -> players/<name>/dir/room
-        #   ~<name>/dir/room            -> players/<name>/dir/room
-        #   ~/dir/room                  -> players/<name>/dir/room
-        #   dir/room                    -> players/<name>/dir/room
-        # Base map forms (everything else):
-        #   /room/foo                   -> room/foo
-        #    
-        if os.path.sep != '/':
-            # convert from Unix path style to local OS, normalize, then convert back
-            local_path = os.path.join(*(os.path.splitdrive(path.strip())[1].split('/')))
-            room_name = '/'.join(os.path.normpath(local_path).split(os.path.sep))
-            if not room_name.startswith('/'):
-                room_name = '/' + room_name
-        else:
-            # our platform understands the / separators we already have
-            room_name = os.path.normpath(path.strip())
-
-        room_creator = None
-        #
-        # expand ~ syntax and convert to relative path from mudlib root
-        #
-        m_tilde = re.match(r'~(\w*)/(.*)', room_name)
-        if m_tilde:
-            # ~/...
-            # ~<name>/...
-            if not m_tilde.group(1):
-                if creator is None:
-                    raise InvalidRoomPath('Cannot determine creator name to expand path {0}. Please explicitly specify the creator name with --creator option or the "Manage Creator Options" dialog.'.format(room_name))
-                room_creator = creator
-            else:
-                room_creator = m_tilde.group(1)
-                
-            room_name = 'players/'+room_creator+'/'+m_tilde.group(2)
-        else:
-            m_player= re.match(r'/players/(\w+)/', room_name)
-            if m_player:
-                # /players/<name>/...
-                room_creator = m_player.group(1)
-                room_name = room_name[1:]
-            elif room_name.startswith('/'):
-                # /something-other-than-players/...
-                room_creator = None
-                room_name = room_name[1:]
-            else:
-                # relative path in creator's realm
-                if creator is None:
-                    raise InvalidRoomPath('Cannot determine creator name to expand path {0}. Please explicitly specify the creator name with --creator option or the "Manage Creator Options" dialog.'.format(room_name))
-                room_creator = creator
-                room_name = 'players/'+room_creator+'/'+room_name
-
-        return (room_name, room_creator)
-
-    def add_from_file(self, input_file, creator=None, enforce_creator=False, source_date=None, verbosity=0):
-        "Add rooms and places to this file from a map source file."
-        if verbosity > 2:
-            sys.stdout.write("MapSource.add_from_file(creator={0}, enforce_creator={1}, source_date={2}, verbosity={3}\n".format(repr(creator), enforce_creator, repr(source_date), verbosity))
+    def _check_int(self, idx, value):
+        try:
+            int(value)
+        except:
+            raise MapFileFormatError('map definition command "{0}", parameter #{1:d}, should be integral, was "{2}"'.format(
+                self.f_name, idx, value))
 
-        global_key = creator or '.CORE.'
-        if global_key not in self.realm_globals:
-            self.realm_globals[global_key] = {}
+    def _check_boolean(self, idx, value):
+        try:
+            int(value)
+        except:
+            raise MapFileFormatError('map definition command "{0}", parameter #{1:d}, should be boolean, was "{2}"'.format(
+                self.f_name, idx, value))
+
+    def _check_invalid(self, idx, value):
+        raise InternalError('BUG: PS function "%s" prototype "%s" invalid (what is "%s" supposed to mean?)' %
+                (self.f_name, self.prototype, self.prototype[idx-1]))
+
+
+class CompileContext (object):
+    '''The state of one compile of map source code into a list of encoded
+    map elements (see MapSource.compile).  The operand stack, graphics
+    state, pending room and exit flags, running procedures, and local
+    symbols all live here, so separate contexts can compile at the same
+    time in different threads, or one inside another.
+
+    A context may be used for any number of compiles, one at a time:
+        context = CompileContext(global_symbols=realm_globals)
+        elements = context.compile(source)
+    after which token_count, loop_iterations, and symbols_read describe
+    that compile.
+
+    Besides the _LOOP_MAX limit on the iterations of any one loop, a
+    compile may be limited to max_steps steps, and to running for
+    time_limit seconds.  Each operation executed is a step, as is each
+    pass through a procedure block (so loops over empty or folded-away
+    blocks count too); the number taken by the last compile is left in
+    steps.  The interpreter checks the limits each time it starts or
+    repeats a procedure block, and raises CompileLimitError once either
+    is exceeded.'''
 
-        for record in self._each_record(input_file):
-            for required_field in 'room', 'page':
-                if required_field not in record:
-                    raise MapFileFormatError('Map source file record does not contain a "'
-                            +required_field+'" field: ' + repr(record))
-            #
-            # set up containing page first
-            #
-            if verbosity > 2:
-                sys.stdout.write(" room {0}\n".format(record['room']))
-
-            page = self.get_page(record['page'])
-
-            if 'bg' in record and record['bg'].strip():
-                if page.bg:
-                    # XXX warn that multiple rooms contribute to this page bg
-                    pass
-                page.bg.extend(self.compile(record['bg'], global_symbols=self.realm_globals[global_key]))
-
-
-            if 'realm' in record:
-                if page.realm and record['realm'] != page.realm:
-                    # XXX warn that room overrides page realm name
-                    pass
-                page.realm = record['realm']
-
-            if 'orient' in record:
-                page.orient = LANDSCAPE if 'land' in record['orient'] else PORTRAIT
-
-            room_name, room_creator = self._normalize_room_path(record['room'], creator)
-            if verbosity > 3:
-                sys.stderr.write("room normalization {0} -> {1} (creator {2} -> {3})\n".format(
-                    record['room'], room_name, creator, room_creator))
-            if room_name in self.room_page:
-                raise DuplicateRoomError('Room '+room_name+' was already defined (on page '+repr(self.room_page[room_name])+')')
-
-            if enforce_creator:
-                # Ensure that we don't have user A defining room maps in user B's
-                # realm.
-                # (if path does not match that pattern then it's a base map with
-                # NO creator, which means the creator param must be undefined here)
-                if room_creator != creator:
-                    if creator is None:
-                        raise IllegalCreatorReference('Base maps cannot define rooms inside wizard realms: {0}'.format(room_name))
-                    else:
-                        raise IllegalCreatorReference("Map in {0}'s realm cannot define rooms for {1}'s realm: {2}".format(creator, room_creator, room_name))
-
-            if room_creator is None:
-                room_creator = "Base World Map"
-
-            if room_creator is not None and room_creator not in page.creators:
-                page.creators.append(room_creator)
-
-            self.room_page[room_name] = page.page
-            page.add_room(MapRoom(room_name, page, record.get('name'), 
-                self.compile(record['map'], global_symbols=self.realm_globals[global_key])
-                    if ('map' in record and record['map'].strip()) else None,
-                [self._normalize_room_path(p, creator)[0] 
-                    for p in [_f for _f in record.get('also','').split('\n') if _f]],
-                reference_point=record.get('ref'),
-                source_modified_date=source_date))
+    #
+    # Scanner for map source code (see _lex_ps).  Numbers are only numbers if
+    # they make up the whole word, so they have to be followed by something
+    # which ends one.  Python's int() and float() allow whitespace around them,
+    # so we do too (although spaces, tabs and newlines would have ended the
+    # word).  A "(" with no ")" after it on the same line is just part of a name.
+    #
+    _PS_TOKEN   = re.compile(r'''
+          (?P<space>[ \t\n]+)
+        | (?P<string>\([^\n]*?\))
+        | (?P<open>\{)
+        | (?P<close>\})
+        | (?P<bracket>[][])
+        | (?P<comment>%[^\n]*)
+        | (?P<radix>[^\S \t\n]*(?P<base>\d+)\#(?P<digits>[0-9A-Za-z]+)[^\S \t\n]*)
+              (?=[ \t\n\[\]{}]|\([^\n]*\)|\Z)
+        | (?P<int>[^\S \t\n]*[+-]?\d+(?:_\d+)*[^\S \t\n]*)
+              (?=[ \t\n\[\]{}]|\([^\n]*\)|\Z)
+        | (?P<float>[^\S \t\n]*[+-]?
+              (?:(?:(?:\d+(?:_\d+)*)?\.\d+(?:_\d+)*|\d+(?:_\d+)*\.?)(?:[eE][+-]?\d+(?:_\d+)*)?
+                |(?i:inf(?:inity)?|nan))
+              [^\S \t\n]*)
+              (?=[ \t\n\[\]{}]|\([^\n]*\)|\Z)
+        | (?P<name>(?:[^ \t\n\[\]{}(]|\((?![^\n]*\)))+)
+    ''', re.VERBOSE)
+    
+    _STRING_ESCAPE = re.compile(r'\\([0-7]{1,3}|\[.*?\]|-)')
 
-    def get_page(self, page_id):
-        "Get page by id (coerced to integer) and return it (creating one if needed)"
+    _LOOP_MAX = 10000   # too many iterations (emergency stop)
+    _TIME_CHECK_INTERVAL = 10000    # steps between checks of the clock for time_limit
 
-        i = int(page_id)
-        if i not in self.pages:
-            self.pages[i] = MapPage(i)
-        return self.pages[i]
+    #
+    # Keywords of the map language.  Commands emit an element into the
+    # compiled map; internal commands just work on the compiler's state.
+    # These are turned into operations by _ps_operation_tables.
+    #
+    _PS_COMMANDS = {
+        'arrow':    '_ps_arrow',
+        'bf':       '_ps_bf',
+        'bk':       '_ps_bk',
+        'box':      '_ps_box',
+        'boxnum':   '_ps_boxnum',
+        'Clump1':   '_ps_clump1',
+        'Clump2':   '_ps_clump2',
+        'color':    '_ps_color',
+        'colorbox': '_ps_colorbox',
+        'dotmark':  '_ps_dotmark',
+        'fittext':  '_ps_fittext',
+        'fittext-c': '_ps_fittext_c',
+        'fittext-n': '_ps_fittext_n',
+        'fittext-s': '_ps_fittext_s',
+        'fittext-e': '_ps_fittext_e',
+        'fittext-w': '_ps_fittext_w',
+        'fittext-ne': '_ps_fittext_ne',
+        'fittext-nw': '_ps_fittext_nw',
+        'fittext-se': '_ps_fittext_se',
+        'fittext-sw': '_ps_fittext_sw',
+        'graphic':  '_ps_image',
+        'gr':       '_ps_gr',
+        'it':       '_ps_it',
+        'lw':       '_ps_linewidth',
+        'mazearea': '_ps_mazearea',
+        'mazeroom': '_ps_mazeroom',
+        'mazewall': '_ps_mazewall',
+        'rmnf':     '_ps_rmnf',
+        'room':     '_ps_room',
+        'round-room': '_ps_round_room',
+        'sd':       '_ps_setdash',
+        'sg':       '_ps_sg',
+        'sl':       '_ps_sl',
+        'sf':       '_ps_sf',
+        'ss':       '_ps_ss',
+        'shadebox': '_ps_shadebox',
+        'show':     '_ps_show_text',
+        'Tree1':    '_ps_tree1',
+        'Tree2':    '_ps_tree2',
+        'tt':       '_ps_tt',
+        'txtf':     '_ps_txtf',
+        'wh':       '_ps_wh',
+    }
+    _PS_INTERNAL_COMMANDS = {
+        'add':      '_do_add',
+        'sub':      '_do_sub',
+        'mul':      '_do_mul',
+        'div':      '_do_div',
+        'idiv':     '_do_idiv',
+        'neg':      '_do_neg',
+        'mod':      '_do_mod',
+        'exch':     '_do_exch',
+        'true':     '_do_true',
+        'false':    '_do_false',
+        'exp':      '_do_exp',
+        'atan':     '_do_atan',
+        'cos':      '_do_cos',
+        'sin':      '_do_sin',
+        'ceiling':  '_do_ceiling',
+        'floor':    '_do_floor',
+        'truncate': '_do_truncate',
+        'logn':     '_do_logn',
+        'log':      '_do_log',
+        'sqrt':     '_do_sqrt',
+        'abs':      '_do_abs',
+        'eq':       '_do_eq',
+        'ne':       '_do_ne',
+        'lt':       '_do_lt',
+        'gt':       '_do_gt',
+        'ge':       '_do_ge',
+        'le':       '_do_le',
+        'bitshift': '_do_bitshift',
+        'dup':      '_do_dup',
+        'count':    '_do_count',
+        'clear':    '_do_clear',
+        'copy':     '_do_copy',
+        'index':    '_do_index',
+        'roll':     '_do_roll',
+        'if':       '_do_if',
+        'ifelse':   '_do_ifelse',
+        'repeat':   '_do_repeat',
+        'def':      '_do_def',
+        'sdef':     '_do_sdef',
+        'ndef':     '_do_ndef',
+        'loop':     '_do_loop',
+        'exit':     '_do_exit',
+        'for':      '_do_for',
+        'or':       '_do_or',
+        'and':      '_do_and',
+        'xor':      '_do_xor',
+        'not':      '_do_not',
+        'currentpoint': '_do_currentpoint',
+        'curveto':  '_do_curveto',
+        'acurveto': '_do_acurveto',
+        'scurveto': '_do_scurveto',
+        'arc':      '_do_arc',
+        'arcn':     '_do_arcn',
+    }
+    _ROOM_FLAGS = {
+        'curved':   'c',
+        'dark':     'd',
+        'textfont': 'f',
+        'proto':    'p',
+        'outdoor':  'o',
+        'phantom':  'x',
+    }
+    _EXIT_DIRECTIONS = {
+        'north':    'n',
+        'south':    's',
+        'east':     'e',
+        'west':     'w',
+        'northeast':'a',
+        'southeast':'b',
+        'northwest':'c',
+        'southwest':'d',
+    }
+    _EXIT_FLAGS = {   # door is also 'D'
+        'concealed':  'C',
+        'gap':        'g',
+        'in':         'i',
+        'locked':     'L',
+        'magic':      'M',
+        'out':        'o',
+        'portcullis': 'p',
+        'secret':     'S',
+        #'tapestry':   't',
+        'turnstile':  'T',
+        'offpage':    'x',
+        'special':    '!',
+        'double':     '2',
+    }
+    _DRAWING_FLAGS = {  # fill is also 'f'
+        'cp':       'c',
+        'closepath':'c',
+    }
+    #
+    # Internal commands which do nothing but replace their arguments on the
+    # operand stack with their results (keyword -> number of arguments), so
+    # they can be worked out ahead of time when their arguments are constants
+    # (see _append_operation).
+    #
+    _PURE_COMMANDS = {
+        'abs':      1,
+        'add':      2,
+        'and':      2,
+        'atan':     2,
+        'ceiling':  1,
+        'cos':      1,
+        'div':      2,
+        'dup':      1,
+        'eq':       2,
+        'exch':     2,
+        'exp':      2,
+        'false':    0,
+        'floor':    1,
+        'ge':       2,
+        'gt':       2,
+        'idiv':     2,
+        'le':       2,
+        'log':      1,
+        'logn':     1,
+        'lt':       2,
+        'mod':      2,
+        'mul':      2,
+        'ne':       2,
+        'neg':      1,
+        'not':      1,
+        'or':       2,
+        'sin':      1,
+        'sqrt':     1,
+        'sub':      2,
+        'true':     0,
+        'truncate': 1,
+        'xor':      2,
+    }
+    #
+    # Internal commands which run one of the procedure blocks given to them
+    # depending on a condition (keyword -> number of blocks).
+    #
+    _BRANCH_COMMANDS = {
+        'if':       1,
+        'ifelse':   2,
+    }
 
-    def compile(self, source, allow_test=False, global_symbols=None):
-        "Compile source string -> list of encoded element definitions  **NOT REENTRANT**"
-        object = []
+    def __init__(self, allow_test=False, global_symbols=None, optimize=True, max_steps=None, time_limit=None):
+        '''allow_test enables the __test__ command.  global_symbols is the
+        dictionary of realm global ($name) symbols to use, which is updated
+        when the source defines them.  If optimize is true, constant
+        expressions and branches in procedure blocks are worked out ahead
+        of time (see _append_operation).  max_steps and time_limit, if not
+        None, limit each compile as described above.'''
+
+        self.allow_test = allow_test
+        self.optimize = optimize
+        self.max_steps = max_steps
+        self.time_limit = time_limit
+        self._global_symbols = global_symbols if global_symbols is not None else {}
+        self.token_count = 0    # tokens executed by the last compile
+        self.loop_iterations = 0
+        self.steps = 0          # counted against max_steps by the last compile
+        self.operations_removed = 0     # by optimizing the last compile
+        self.symbols_read = {}  # realm global symbols read by the last compile (name -> value)
+
+    def compile(self, source, errors=None):
+        '''Compile source string -> list of encoded element definitions
+
+        If errors is given, it is a list to collect the problems found in
+        the source in, rather than stopping at the first one.  The source
+        is run a statement at a time (see _each_statement); when one fails,
+        (line, exception) is added to errors, where line is the number of
+        the line (from 0) in source where that statement started, and we
+        go on with the next statement (unless the compile's limits were
+        exceeded).  Whatever the statements which worked drew is returned.'''
+        self._output = []
         self.stack = []
-        self.room_flags = set()
-        self.exit_flags = set()
-        self.drawing_flags = set()
+        self.room_flags = 0
+        self.exit_flags = 0
+        self.drawing_flags = 0
         self.exit_direction = None
         self.exit_length= DEFAULT_EXIT_LENGTH
         self.room_shade = None
@@ -622,10 +749,14 @@ class MapSource (object):
         self.current_point = None
         self.drawing_mode_list = None
         self.last_drawing_mode_list = None
-        self.last_drawing_flags = set()
+        self.last_drawing_flags = 0
         self._start_tokenizer()
-        self._global_symbols = global_symbols if global_symbols is not None else {}
+        self.token_count = 0
+        self.steps = 0
+        self._passes = 0    # through procedure blocks
+        self.operations_removed = 0
         self._local_symbols = {}
+        self.symbols_read = {}
 
         #
         # The source used to be PostScript commands.  We keep the same
@@ -682,7 +813,7 @@ class MapSource (object):
 
 
         #
-        # drawing_flags = c|f
+        # drawing_flags = c|f (as MapFlags bits)
         #
         #  newpath -> [[(x,y)]]
         #  lineto -> append (x,y)
@@ -696,349 +827,472 @@ class MapSource (object):
         # 
 
         self.graphics_state = [GraphicsState()]
+        self._ps_operations, self._ps_fallback_operations, self._pure_operations, self._branch_operations = \
+            self._ps_operation_tables(self.allow_test)
+        self._deadline = None if self.time_limit is None else time.perf_counter() + self.time_limit
+        self._check_limits(0)
+
+        if errors is None:
+            self._execute(source)
+            self._finish()
+            return self._output
+
+        line = 0
+        for line, statement in self._each_statement(source):
+            try:
+                self._execute(statement)
+            except CompileLimitError as problem:
+                errors.append((line, problem))
+                return self._output
+            except Exception as problem:
+                errors.append((line, problem))
+                self._recover()
+        try:
+            self._finish()
+        except Exception as problem:
+            errors.append((line, problem))
+        return self._output
+
+    def _execute(self, source):
+        "Run the code in source string, adding the number of operations executed to token_count."
+        token_count = self.token_count
+        try:
+            for ps_token in self._each_ps_token(source):
+                operation, operand = self._resolve_ps_token(ps_token)
+                operation(self, operand)
+                token_count += 1
+                if self._token_input_stack:
+                    token_count += self._run_procedures(token_count + self._passes)
+                if token_count + self._passes >= self._check_at:
+                    self._check_limits(token_count + self._passes)
+        finally:
+            self.token_count = token_count
+            self.steps = token_count + self._passes
+
+    def _check_limits(self, steps):
+        '''Raise CompileLimitError if this compile has taken more than max_steps
+        steps, or is past its deadline.  Otherwise, set _check_at to the
+        number of steps at which to check again.'''
+        if self.max_steps is not None and steps > self.max_steps:
+            raise CompileLimitError('Map code stopped after {0} steps (the limit is {1})'.format(
+                steps, self.max_steps))
+        check_at = sys.maxsize if self.max_steps is None else self.max_steps + 1
+        if self._deadline is not None:
+            if time.perf_counter() > self._deadline:
+                raise CompileLimitError('Map code stopped after running for more than {0} second{1} ({2} steps)'.format(
+                    self.time_limit, '' if self.time_limit == 1 else 's', steps))
+            check_at = min(check_at, steps + self._TIME_CHECK_INTERVAL)
+        self._check_at = check_at
+        return check_at
+
+    def _finish(self):
+        "Complain about anything the source left unfinished."
+        self._stop_tokenizer()
+        if self.stack:
+            raise MapFileFormatError('Extra values in map definition with nowhere to go: ' + repr(self.stack))
+        if self.drawing_mode_list is not None:
+            raise MapFileFormatError('Drawing path not completed (missing "stroke" or "fill"?)')
 
-        ps_command_dispatch = {
-            'arrow':    self._ps_arrow,
-            'bf':       self._ps_bf,
-            'bk':       self._ps_bk,
-            'box':      self._ps_box,
-            'boxnum':   self._ps_boxnum,
-            'Clump1':   self._ps_clump1,
-            'Clump2':   self._ps_clump2,
-            'color':    self._ps_color,
-            'colorbox': self._ps_colorbox,
-            'dotmark':  self._ps_dotmark,
-            'fittext':  self._ps_fittext,
-            'fittext-c': self._ps_fittext_c,
-            'fittext-n': self._ps_fittext_n,
-            'fittext-s': self._ps_fittext_s,
-            'fittext-e': self._ps_fittext_e,
-            'fittext-w': self._ps_fittext_w,
-            'fittext-ne': self._ps_fittext_ne,
-            'fittext-nw': self._ps_fittext_nw,
-            'fittext-se': self._ps_fittext_se,
-            'fittext-sw': self._ps_fittext_sw,
-            'graphic':  self._ps_image,
-            'gr':       self._ps_gr,
-            'it':       self._ps_it,
-            'lw':       self._ps_linewidth,
-            'mazearea': self._ps_mazearea,
-            'mazeroom': self._ps_mazeroom,
-            'mazewall': self._ps_mazewall,
-            'rmnf':     self._ps_rmnf,
-            'room':     self._ps_room,
-            'round-room': self._ps_round_room,
-            'sd':       self._ps_setdash,
-            'sg':       self._ps_sg,
-            'sl':       self._ps_sl,
-            'sf':       self._ps_sf,
-            'ss':       self._ps_ss,
-            'shadebox': self._ps_shadebox,
-            'show':     self._ps_show_text,
-            'Tree1':    self._ps_tree1,
-            'Tree2':    self._ps_tree2,
-            'tt':       self._ps_tt,
-            'txtf':     self._ps_txtf,
-            'wh':       self._ps_wh,
-        }
-        if allow_test:
-            ps_command_dispatch['__test__'] = self._ps__test__
-        ps_internal_commands = {
-            'add':      self._do_add,
-            'sub':      self._do_sub,
-            'mul':      self._do_mul,
-            'div':      self._do_div,
-            'idiv':     self._do_idiv,
-            'neg':      self._do_neg,
-            'mod':      self._do_mod,
-            'exch':     self._do_exch,
-            'true':     self._do_true,
-            'false':    self._do_false,
-            'exp':      self._do_exp,
-            'atan':     self._do_atan,
-            'cos':      self._do_cos,
-            'sin':      self._do_sin,
-            'ceiling':  self._do_ceiling,
-            'floor':    self._do_floor,
-            'truncate': self._do_truncate,
-            'logn':     self._do_logn,
-            'log':      self._do_log,
-            'sqrt':     self._do_sqrt,
-            'abs':      self._do_abs,
-            'eq':       self._do_eq,
-            'ne':       self._do_ne,
-            'lt':       self._do_lt,
-            'gt':       self._do_gt,
-            'ge':       self._do_ge,
-            'le':       self._do_le,
-            'bitshift': self._do_bitshift,
-            'dup':      self._do_dup,
-            'count':    self._do_count,
-            'clear':    self._do_clear,
-            'copy':     self._do_copy,
-            'index':    self._do_index,
-            'roll':     self._do_roll,
-            'if':       self._do_if,
-            'ifelse':   self._do_ifelse,
-            'repeat':   self._do_repeat,
-            'def':      self._do_def,
-            'sdef':     self._do_sdef,
-            'ndef':     self._do_ndef,
-            'loop':     self._do_loop,
-            'exit':     self._do_exit,
-            'for':      self._do_for,
-            'or':       self._do_or,
-            'and':      self._do_and,
-            'xor':      self._do_xor,
-            'not':      self._do_not,
-            'currentpoint': self._do_currentpoint,
-            'curveto':  self._do_curveto,
-            'acurveto': self._do_acurveto,
-            'scurveto': self._do_scurveto,
-            'arc':      self._do_arc,
-            'arcn':     self._do_arcn,
-        }
-        ps_room_flags = {
-            'curved':   'c',
-            'dark':     'd',
-            'textfont': 'f',
-            'proto':    'p',
-            'outdoor':  'o',
-            'phantom':  'x',
-        }
-        ps_exit_directions = {
-            'north':    'n',
-            'south':    's',
-            'east':     'e',
-            'west':     'w',
-            'northeast':'a',
-            'southeast':'b',
-            'northwest':'c',
-            'southwest':'d',
-        }
-        ps_exit_flags = {   # door is also 'D'
-            'concealed':  'C',
-            'gap':        'g',
-            'in':         'i',
-            'locked':     'L',
-            'magic':      'M',
-            'out':        'o',
-            'portcullis': 'p',
-            'secret':     'S',
-            #'tapestry':   't',
-            'turnstile':  'T',
-            'offpage':    'x',
-            'special':    '!',
-            'double':     '2',
-        }
-        ps_drawing_flags = {  # fill is also 'f'
-            'cp':       'c',
-            'closepath':'c',
-        }
-        for ps_token in self._each_ps_token(source):
-            if isinstance(ps_token, (int, float, list, tuple)):
-                self.stack.append(ps_token)
-            elif ps_token in ps_command_dispatch:
-                object.append(ps_command_dispatch[ps_token]())
-            elif ps_token in ps_internal_commands:
-                ps_internal_commands[ps_token]()
-            elif ps_token in ps_drawing_flags:
-                if self.drawing_mode_list is None:
-                    raise MapFileFormatError(ps_token + ' command encountered outside drawing mode.')
-                self.drawing_flags.add(ps_drawing_flags[ps_token])
-            elif ps_token in ps_room_flags:
-                self.room_flags.add(ps_room_flags[ps_token])
-            elif ps_token in ps_exit_flags:
-                self.exit_flags.add(ps_exit_flags[ps_token])
-            elif ps_token in ps_exit_directions:
-                if self.exit_direction is not None:
-                    if ps_exit_directions[ps_token] != self.exit_direction:
-                        raise MapFileFormatError('Exit declared to be going multiple directions!')
-                else:
-                    self.exit_direction = ps_exit_directions[ps_token]
-            elif ps_token == 'rgbshaded':
-                self._ps_rgbshaded()
-            elif ps_token == 'textcolor':
-                self._ps_textcolor()
-            elif ps_token == 'exitcolor':
-                self._ps_exitcolor()
-            elif ps_token == 'shaded':
-                self._ps_shaded()
-            elif ps_token == 'passageLength' or ps_token == 'passagelength':
-                self._ps_passage_length()
-            elif ps_token == 'door':
-                self._ps_door()
-            elif ps_token == 'passage':
-                self._ps_passage()
-            elif ps_token == 'std':
-                self.stack.append(50)
-                self.stack.append(20)
-            elif ps_token == 'stdr':
-                self.stack.append(30)
-            elif ps_token == 'mv' or ps_token == 'moveto':
-                self._ps_moveto()
-            elif ps_token == 'rmv' or ps_token == 'rmoveto':
-                self._ps_rmoveto()
-            elif ps_token == 'pop':
+    def _recover(self):
+        '''Forget the work in progress when a statement fails, so the next one
+        starts clean (the graphics state and symbols it had defined are kept).'''
+        self.stack = []
+        self.room_flags = 0
+        self.exit_flags = 0
+        self.drawing_flags = 0
+        self.exit_direction = None
+        self.drawing_mode_list = None
+        self._diversion = []
+        self._token_input_stack = []
+
+    def _each_statement(self, source):
+        '''Split source string into statements, generating (line, statement)
+        for each, where line is the number of the line (from 0) in source
+        where the statement starts.  A statement is a line of source, along
+        with the lines after it up to the one where any procedure blocks
+        started on it are closed.'''
+        start = 0
+        depth = 0
+        lines = source.split('\n')
+        for line, text in enumerate(lines):
+            text = text.replace(r'\\', r'\134').replace(r'\(', r'\050').replace(r'\)', r'\051')
+            for m in self._PS_TOKEN.finditer(text):
+                if m.lastgroup == 'open':
+                    depth += 1
+                elif m.lastgroup == 'close':
+                    depth -= 1
+            if depth <= 0:
+                yield start, '\n'.join(lines[start:line+1])
+                start = line + 1
+                depth = 0
+        if start < len(lines):
+            yield start, '\n'.join(lines[start:])
+
+    @classmethod
+    def _ps_operation_tables(cls, allow_test=False):
+        '''Return the tables of operations for this class's keywords:
+            (keyword -> (operation, operand),
+             keyword -> fallback operation,
+             pure command method -> number of arguments,
+             branch command method -> number of blocks)
+        Operations are unbound methods, called as operation(self, operand);
+        fallback operations are called as operation(self) only for names which
+        aren't defined as symbols.  The tables are built the first time they're
+        needed and then shared by every compile.'''
+
+        tables = cls.__dict__.get('_ps_operation_table_cache')
+        if tables is None:
+            #
+            # Every keyword is translated once into an (operation, operand) pair,
+            # where operation is the method which carries it out and operand is
+            # passed to it.  Procedure blocks are translated into lists of these
+            # the first time they run (see _block_code), so loops and procedures
+            # don't need to look their tokens up again on every pass.
+            #
+            operations = {}
+            for ps_token, method in cls._PS_COMMANDS.items():
+                operations[ps_token] = (cls._op_command, getattr(cls, method))
+            for ps_token, method in cls._PS_INTERNAL_COMMANDS.items():
+                operations[ps_token] = (cls._op_call, getattr(cls, method))
+            for ps_token, flag in cls._DRAWING_FLAGS.items():
+                operations[ps_token] = (cls._op_drawing_flag, (ps_token, flag_bit(flag)))
+            for ps_token, flag in cls._ROOM_FLAGS.items():
+                operations[ps_token] = (cls._op_room_flag, flag_bit(flag))
+            for ps_token, flag in cls._EXIT_FLAGS.items():
+                operations[ps_token] = (cls._op_exit_flag, flag_bit(flag))
+            for ps_token, direction in cls._EXIT_DIRECTIONS.items():
+                operations[ps_token] = (cls._op_exit_direction, direction)
+            for ps_token, operation in (
+                ('rgbshaded',     (cls._op_call, cls._ps_rgbshaded)),
+                ('textcolor',     (cls._op_call, cls._ps_textcolor)),
+                ('exitcolor',     (cls._op_call, cls._ps_exitcolor)),
+                ('shaded',        (cls._op_call, cls._ps_shaded)),
+                ('passageLength', (cls._op_call, cls._ps_passage_length)),
+                ('passagelength', (cls._op_call, cls._ps_passage_length)),
+                ('door',          (cls._op_call, cls._ps_door)),
+                ('passage',       (cls._op_call, cls._ps_passage)),
+                ('std',           (cls._op_push_all, (50, 20))),
+                ('stdr',          (cls._op_push, 30)),
+                ('mv',            (cls._op_call, cls._ps_moveto)),
+                ('moveto',        (cls._op_call, cls._ps_moveto)),
+                ('rmv',           (cls._op_call, cls._ps_rmoveto)),
+                ('rmoveto',       (cls._op_call, cls._ps_rmoveto)),
+                ('pop',           (cls._op_pop, None)),
+                ('[',             (cls._op_push, None)),
+                (']',             (cls._op_end_array, None)),
+                ('np',            (cls._op_newpath, None)),
+                ('newpath',       (cls._op_newpath, None)),
+                ('ln',            (cls._op_call, cls._ps_lineto)),
+                ('lineto',        (cls._op_call, cls._ps_lineto)),
+                ('rln',           (cls._op_call, cls._ps_rlineto)),
+                ('rlineto',       (cls._op_call, cls._ps_rlineto)),
+                ('lastpath',      (cls._op_lastpath, None)),
+                ('stroke',        (cls._op_stroke, False)),
+                ('fill',          (cls._op_stroke, True)),
+            ):
+                operations.setdefault(ps_token, operation)
+
+            test_operations = dict(operations)
+            test_operations['__test__'] = (cls._op_command, cls._ps__test__)
+            #
+            # These are only recognized if they weren't defined as symbols.
+            #
+            fallback_operations = {
+                'gsave':    cls._op_gsave,
+                'grestore': cls._op_grestore,
+                'scale':    cls._op_scale,
+                'translate':cls._op_translate,
+            }
+            pure_operations = dict((getattr(cls, cls._PS_INTERNAL_COMMANDS[ps_token]), nargs)
+                for ps_token, nargs in cls._PURE_COMMANDS.items())
+            branch_operations = dict((getattr(cls, cls._PS_INTERNAL_COMMANDS[ps_token]), nblocks)
+                for ps_token, nblocks in cls._BRANCH_COMMANDS.items())
+            tables = cls._ps_operation_table_cache = (
+                (operations, fallback_operations, pure_operations, branch_operations),
+                (test_operations, fallback_operations, pure_operations, branch_operations),
+            )
+        return tables[1 if allow_test else 0]
+
+    def _resolve_ps_token(self, ps_token):
+        "Translate a source token into the (operation, operand) pair which carries it out."
+        if isinstance(ps_token, (int, float, list, tuple)):
+            return (CompileContext._op_push, ps_token)
+        if ps_token in self._ps_operations:
+            return self._ps_operations[ps_token]
+        if ps_token.startswith('(') and ps_token.endswith(')'):
+            try:
+                return (CompileContext._op_push, decode_string_literal(ps_token))
+            except MapFileFormatError:
+                # leave the error until (unless) the string is actually used
+                return (CompileContext._op_string, ps_token)
+        if ps_token.startswith('/'):
+            return (CompileContext._op_push, MapDefSymbol(ps_token[1:]))
+        return (CompileContext._op_symbol, ps_token)
+
+    def _block_code(self, block):
+        '''Return the list of operations for a procedure block, translating it
+        the first time the block is run during this compile.'''
+        try:
+            return self._compiled_blocks[id(block)][1]
+        except KeyError:
+            code = []
+            for ps_token in block:
+                self._append_operation(code, self._resolve_ps_token(ps_token))
+            # keep the block itself too, so its id can't be reused while we're here
+            self._compiled_blocks[id(block)] = (block, code)
+            return code
+
+    def _append_operation(self, code, operation):
+        '''Append an operation to a procedure block's code.  If optimizing, work
+        out whatever we can ahead of time, since blocks usually run many times:
+            constant arguments to a pure command -> the command's results
+            constant followed by pop -> nothing
+            constant if/ifelse condition -> the code of the block it would run
+        Anything which would fail is left alone to fail when it's run.  The
+        number of operations this saves is added to operations_removed.'''
+
+        code.append(operation)
+        if not self.optimize:
+            return
+
+        function, operand = operation
+        if function is CompileContext._op_pop:
+            if len(code) > 1 and code[-2][0] is CompileContext._op_push:
+                del code[-2:]
+                self.operations_removed += 2
+
+        elif function is CompileContext._op_call and operand in self._pure_operations:
+            nargs = self._pure_operations[operand]
+            if len(code) > nargs and all(self._is_constant(op) for op in code[len(code)-nargs-1:-1]):
+                results = self._evaluate(operand, [op[1] for op in code[len(code)-nargs-1:-1]])
+                if results is not None:
+                    del code[len(code)-nargs-1:]
+                    code.extend([(CompileContext._op_push, value) for value in results])
+                    self.operations_removed += nargs + 1 - len(results)
+
+        elif function is CompileContext._op_call and operand in self._branch_operations:
+            nblocks = self._branch_operations[operand]
+            if len(code) > nblocks+1 and self._is_constant(code[-nblocks-2]) and all(
+                    op[0] is CompileContext._op_push and isinstance(op[1], (list,tuple)) for op in code[-nblocks-1:-1]):
+                condition = code[-nblocks-2][1]
                 try:
-                    self.stack.pop()
-                except IndexError:
-                    raise MapFileFormatError('pop command encountered with no corresponding value to pop')
-            elif ps_token == '[':
-                self.stack.append(None)
-            elif ps_token == ']':
-                list_obj = []
-                while self.stack:
-                    i = self.stack.pop()
-                    if i is None:
-                        break
-                    list_obj.insert(0,i)
-                else:
-                    raiseMapFileFormatError('"]" without corresponding "[" in map definition.')
-                self.stack.append(list_obj)
-                
-            elif ps_token.startswith('(') and ps_token.endswith(')'):
-                self.stack.append(re.sub(r'\\([0-7]{1,3}|\[.*?\]|-)', (lambda m: string_escape_translator(m.group(1))), ps_token)[1:-1])
-
-
-            elif ps_token == 'np' or ps_token == 'newpath':
-                if self.drawing_mode_list is not None:
-                    raise MapFileFormatError('newpath command encountered before previous path completed.')
-                self.drawing_flags.clear()
-                self.drawing_mode_list = [
-                    {
-                        'type':   None, 
-                        'points': None if self.current_point is None else [self.current_point]
-                    }
-                ]
-            elif ps_token == 'ln' or ps_token == 'lineto':
-                self._ps_lineto()
-            elif ps_token== 'rln' or ps_token == 'rlineto':
-                self._ps_rlineto()
-            elif ps_token == 'lastpath':
-                if self.drawing_mode_list is not None:
-                    raise MapFileFormatError('lastpath command cannot be given inside another path')
-                if self.last_drawing_mode_list is None:
-                    raise MapFileFormatError("can't use lastpath command if there WAS no last path to re-use!")
-
-                self.drawing_flags = self.last_drawing_flags
-                self.drawing_mode_list = self.last_drawing_mode_list
-                self.last_drawing_mode = None
-                self.last_drawing_flags = None
-
-            elif ps_token == 'stroke' or ps_token == 'fill':
-                if self.drawing_mode_list is None:
-                    raise MapFileFormatError('stroke command encountered outside drawing mode (need "newpath" first)')
-
-                self.last_drawing_flags = self.drawing_flags.copy()
-                self.last_drawing_mode_list = self.drawing_mode_list
-                starting_point = None
-                end_point = None
-
-                if ps_token == 'fill':
-                    self.drawing_flags.add('f')
-                for line_path in self.drawing_mode_list:
-                    if line_path['type'] is None or line_path['points'] is None or len(line_path['points']) < 2:
-                        continue
-
-                    coords = []
-                    for x, y in line_path['points']:
-                        coords.append(x)
-                        coords.append(y)
-                    if   line_path['type'] == 'p': type_flags = []
-                    elif line_path['type'] == 'b': type_flags = ['b']
-                    elif line_path['type'] == 's': type_flags = ['s']
-                    elif line_path['type'] == 'a': 
-                        #
-                        # the arguments we receive for arcs are not just a list of points.
-                        # they are:
-                        # (x0, y0), (xc, yc), (radius, None), (start, end), (x1, y1), (x2, y2)
-                        #   0   1     2   3       4      5       6     7     8   9     10  11
-                        # current pt, center,  radius,  ---,  angles of arc, start pt, end pt
-                        #
-                        type_flags = []
-                        if len(coords) != 12:
-                            raise InternalError('arc in drawing_mode_list has {0} value{1} (should be 12) at {2}'.format(
-                                len(coords), ('' if len(coords) == 1 else 's'), line_path))
-                        if coords[7]-coords[6] >= 360:
-                            # full circle, use 'O' object type
-                            object.append(['Of' if 'f' in self.drawing_flags else 'O', coords[2], coords[3], coords[4]])
-                        else:
-                            object.append(['Q'+''.join(sorted(list(self.drawing_flags))), 
-                                [coords[2], coords[3], coords[4], coords[6], coords[7]]
-                            ])
-
-                        if starting_point is None:
-                            starting_point = (coords[8], coords[9])
-                        end_point = (coords[10], coords[11])
-                        continue
-                    else:
-                        raise InternalError('drawing_mode_list object with invalid type "{0}" encountered in {1}'.format(line_path['type'], line_path))
-
-                    object.append(['P'+''.join(sorted(list(self.drawing_flags) + type_flags)), coords])
-                    if starting_point is None:
-                        starting_point = (coords[0], coords[1])
-                    end_point = (coords[-2], coords[-1])
-
-                self.drawing_mode_list = None
-                if 'c' in self.drawing_flags and starting_point is not None and end_point is not None and starting_point != end_point:
-                    object.append(['P'+''.join(sorted(list(self.drawing_flags) + type_flags)), list(end_point + starting_point)])
-                    self.current_point = starting_point
-
-            elif ps_token.startswith('/'):
-                self.stack.append(MapDefSymbol(ps_token[1:]))
-            elif ps_token.startswith('$') and ps_token in self._global_symbols:
-                if isinstance(self._global_symbols[ps_token], (str,int,float)):
-                    self.stack.append(self._global_symbols[ps_token])
+                    int(condition)
+                except (ValueError, OverflowError):
+                    return
+                blocks = [op[1] for op in code[-nblocks-1:-1]]
+                del code[-nblocks-2:]
+                self.operations_removed += nblocks + 2
+                if condition:
+                    body = blocks[0]
+                elif nblocks > 1:
+                    body = blocks[1]
                 else:
-                    self._tokenizer_push(self._global_symbols[ps_token])
-            elif ps_token in self._local_symbols:
-                if isinstance(self._local_symbols[ps_token], (str,int,float)):
-                    self.stack.append(self._local_symbols[ps_token])
-                else:
-                    self._tokenizer_push(self._local_symbols[ps_token])
-            elif ps_token == 'gsave':
-                self.graphics_state.append(GraphicsState(clone_from=self.graphics_state[-1]))
-
-            elif ps_token == 'grestore':
-                if len(self.graphics_state) <= 1:
-                    raise MapFileFormatError('grestore without matching gsave')
-                previous = self.graphics_state.pop()
-                current = self.graphics_state[-1]
-                if (current.color != previous.color):
-                    object.append(['C', current.color.red, current.color.green, current.color.blue])
-                if (current.font != previous.font):
-                    object.append([current.font.name, current.font.size])
-                if (current.line_width != previous.line_width):
-                    object.append(['L', current.line_width])
-                if (current.scale != previous.scale):
-                    object.append(['Z', current.scale.x, current.scale.y])
-                if (current.translate != previous.translate):
-                    object.append(['X', current.translate.x, current.translate.y])
-
-            elif ps_token == 'scale':
-                Sy = self.stack.pop() * self.graphics_state[-1].scale.y
-                Sx = self.stack.pop() * self.graphics_state[-1].scale.x
-                self.graphics_state[-1].scale = Point(Sx, Sy)
-                object.append(['Z', Sx, Sy])
-
-            elif ps_token == 'translate':
-                Dy = self.stack.pop() * self.graphics_state[-1].scale.y \
-                                      + self.graphics_state[-1].translate.y
-                Dx = self.stack.pop() * self.graphics_state[-1].scale.x \
-                                      + self.graphics_state[-1].translate.x
-                self.graphics_state[-1].translate = Point(Dx, Dy)
-                object.append(['X', Dx, Dy])
+                    return
+                for body_operation in self._block_code(body):
+                    self._append_operation(code, body_operation)
+
+    def _is_constant(self, operation):
+        "Is this operation just pushing a numeric constant?"
+        return operation[0] is CompileContext._op_push and type(operation[1]) in (int, float)
+
+    def _evaluate(self, method, arguments):
+        '''Run an internal command on a stack holding only the given arguments,
+        returning the stack it leaves (or None if it failed).'''
+        stack = self.stack
+        self.stack = arguments
+        try:
+            method(self)
+            return self.stack
+        except Exception:
+            return None
+        finally:
+            self.stack = stack
+
+    #
+    # Operations (see _ps_operation_tables).  Each is called as operation(self, operand).
+    #
+    def _op_push(self, value):
+        self.stack.append(value)
+
+    def _op_push_all(self, values):
+        self.stack.extend(values)
+
+    def _op_string(self, ps_token):
+        self.stack.append(decode_string_literal(ps_token))
 
+    def _op_command(self, method):
+        self._output.append(method(self))
+
+    def _op_call(self, method):
+        method(self)
+
+    def _op_drawing_flag(self, operand):
+        ps_token, bit = operand
+        if self.drawing_mode_list is None:
+            raise MapFileFormatError(ps_token + ' command encountered outside drawing mode.')
+        self.drawing_flags |= bit
+
+    def _op_room_flag(self, bit):
+        self.room_flags |= bit
+
+    def _op_exit_flag(self, bit):
+        self.exit_flags |= bit
+
+    def _op_exit_direction(self, direction):
+        if self.exit_direction is not None:
+            if direction != self.exit_direction:
+                raise MapFileFormatError('Exit declared to be going multiple directions!')
+        else:
+            self.exit_direction = direction
+
+    def _op_pop(self, operand):
+        try:
+            self.stack.pop()
+        except IndexError:
+            raise MapFileFormatError('pop command encountered with no corresponding value to pop')
+
+    def _op_end_array(self, operand):
+        list_obj = []
+        while self.stack:
+            i = self.stack.pop()
+            if i is None:
+                break
+            list_obj.insert(0,i)
+        else:
+            raise MapFileFormatError('"]" without corresponding "[" in map definition.')
+        self.stack.append(list_obj)
+
+    def _op_symbol(self, ps_token):
+        if ps_token.startswith('$') and ps_token in self._global_symbols:
+            if ps_token not in self.symbols_read:
+                self.symbols_read[ps_token] = self._global_symbols[ps_token]
+            if isinstance(self._global_symbols[ps_token], (str,int,float)):
+                self.stack.append(self._global_symbols[ps_token])
+            else:
+                self._tokenizer_push(self._global_symbols[ps_token])
+        elif ps_token in self._local_symbols:
+            if isinstance(self._local_symbols[ps_token], (str,int,float)):
+                self.stack.append(self._local_symbols[ps_token])
             else:
-                raise MapFileFormatError('Unrecognized map drawing command "'+ ps_token + '".')
+                self._tokenizer_push(self._local_symbols[ps_token])
+        elif ps_token in self._ps_fallback_operations:
+            self._ps_fallback_operations[ps_token](self)
+        else:
+            raise MapFileFormatError('Unrecognized map drawing command "'+ ps_token + '".')
 
-        self._stop_tokenizer()
-        if self.stack:
-            raise MapFileFormatError('Extra values in map definition with nowhere to go: ' + repr(self.stack))
+    def _op_newpath(self, operand):
         if self.drawing_mode_list is not None:
-            raise MapFileFormatError('Drawing path not completed (missing "stroke" or "fill"?)')
-        return object
+            raise MapFileFormatError('newpath command encountered before previous path completed.')
+        self.drawing_flags = 0
+        self.drawing_mode_list = [
+            {
+                'type':   None, 
+                'points': None if self.current_point is None else [self.current_point]
+            }
+        ]
+
+    def _op_lastpath(self, operand):
+        if self.drawing_mode_list is not None:
+            raise MapFileFormatError('lastpath command cannot be given inside another path')
+        if self.last_drawing_mode_list is None:
+            raise MapFileFormatError("can't use lastpath command if there WAS no last path to re-use!")
+
+        self.drawing_flags = self.last_drawing_flags
+        self.drawing_mode_list = self.last_drawing_mode_list
+        self.last_drawing_mode = None
+        self.last_drawing_flags = None
+
+    def _op_stroke(self, fill):
+        if self.drawing_mode_list is None:
+            raise MapFileFormatError('stroke command encountered outside drawing mode (need "newpath" first)')
+
+        self.last_drawing_flags = self.drawing_flags
+        self.last_drawing_mode_list = self.drawing_mode_list
+        starting_point = None
+        end_point = None
+
+        if fill:
+            self.drawing_flags |= PATH_FILLED
+        for line_path in self.drawing_mode_list:
+            if line_path['type'] is None or line_path['points'] is None or len(line_path['points']) < 2:
+                continue
+
+            coords = []
+            for x, y in line_path['points']:
+                coords.append(x)
+                coords.append(y)
+            if   line_path['type'] == 'p': type_flags = 0
+            elif line_path['type'] == 'b': type_flags = PATH_BEZIER
+            elif line_path['type'] == 's': type_flags = PATH_SPLINE
+            elif line_path['type'] == 'a': 
+                #
+                # the arguments we receive for arcs are not just a list of points.
+                # they are:
+                # (x0, y0), (xc, yc), (radius, None), (start, end), (x1, y1), (x2, y2)
+                #   0   1     2   3       4      5       6     7     8   9     10  11
+                # current pt, center,  radius,  ---,  angles of arc, start pt, end pt
+                #
+                type_flags = 0
+                if len(coords) != 12:
+                    raise InternalError('arc in drawing_mode_list has {0} value{1} (should be 12) at {2}'.format(
+                        len(coords), ('' if len(coords) == 1 else 's'), line_path))
+                if coords[7]-coords[6] >= 360:
+                    # full circle, use 'O' object type
+                    self._output.append(['Of' if self.drawing_flags & PATH_FILLED else 'O', coords[2], coords[3], coords[4]])
+                else:
+                    self._output.append(['Q'+flag_code(self.drawing_flags), 
+                        [coords[2], coords[3], coords[4], coords[6], coords[7]]
+                    ])
+
+                if starting_point is None:
+                    starting_point = (coords[8], coords[9])
+                end_point = (coords[10], coords[11])
+                continue
+            else:
+                raise InternalError('drawing_mode_list object with invalid type "{0}" encountered in {1}'.format(line_path['type'], line_path))
+
+            self._output.append(['P'+flag_code(self.drawing_flags | type_flags), coords])
+            if starting_point is None:
+                starting_point = (coords[0], coords[1])
+            end_point = (coords[-2], coords[-1])
+
+        self.drawing_mode_list = None
+        if self.drawing_flags & PATH_CLOSED and starting_point is not None and end_point is not None and starting_point != end_point:
+            self._output.append(['P'+flag_code(self.drawing_flags | type_flags), list(end_point + starting_point)])
+            self.current_point = starting_point
+
+    def _op_gsave(self):
+        self.graphics_state.append(GraphicsState(clone_from=self.graphics_state[-1]))
+
+    def _op_grestore(self):
+        if len(self.graphics_state) <= 1:
+            raise MapFileFormatError('grestore without matching gsave')
+        previous = self.graphics_state.pop()
+        current = self.graphics_state[-1]
+        if (current.color != previous.color):
+            self._output.append(['C', current.color.red, current.color.green, current.color.blue])
+        if (current.font != previous.font):
+            self._output.append([current.font.name, current.font.size])
+        if (current.line_width != previous.line_width):
+            self._output.append(['L', current.line_width])
+        if (current.scale != previous.scale):
+            self._output.append(['Z', current.scale.x, current.scale.y])
+        if (current.translate != previous.translate):
+            self._output.append(['X', current.translate.x, current.translate.y])
+
+    def _op_scale(self):
+        Sy = self.stack.pop() * self.graphics_state[-1].scale.y
+        Sx = self.stack.pop() * self.graphics_state[-1].scale.x
+        self.graphics_state[-1].scale = Point(Sx, Sy)
+        self._output.append(['Z', Sx, Sy])
+
+    def _op_translate(self):
+        Dy = self.stack.pop() * self.graphics_state[-1].scale.y \
+                              + self.graphics_state[-1].translate.y
+        Dx = self.stack.pop() * self.graphics_state[-1].scale.x \
+                              + self.graphics_state[-1].translate.x
+        self.graphics_state[-1].translate = Point(Dx, Dy)
+        self._output.append(['X', Dx, Dy])
 
     @RequireArgs('arrow', 'cccc')
     def _ps_arrow(self):
@@ -1697,6 +1951,8 @@ class MapSource (object):
         "Initialize the tokenizer and get ready to read source lines."
         self._diversion = []
         self._token_input_stack = []
+        self._compiled_blocks = {}  # id(block) -> (block, operations)
+        self.loop_iterations = 0    # times through repeat/for/loop bodies
 
     def _stop_tokenizer(self):
         "Shut down tokenizer, raise exceptions if left in an odd state."
@@ -1708,32 +1964,97 @@ class MapSource (object):
     def _tokenizer_push(self, block, count=None):
         '''Push a code block onto the tokenizer's input stream.  Further tokens will
         come from this block until it's been popped or run all the way through.'''
+        code = self._block_code(block)
         if count is None:
             # This just means "not a looping construct"
-            self._token_input_stack.append([0, None, 0, block])
+            self._token_input_stack.append([0, None, 0, code])
         elif isinstance(count, list):
             # range loop: list is [min, step, max]
             # we add current counter to that control and insert into queue
             control = count[0:3] + [count[0]]  # initialized for first pass
             if (control[1] < 0 and control[0] >= control[2]) or (
                 control[1] > 0 and control[0] <= control[2]):
-                self._token_input_stack.append([0, control, 0, block])
+                self._token_input_stack.append([0, control, 0, code])
                 self.stack.append(control[3])  # start of 1st iter: push current value
         elif count > 0:
-            self._token_input_stack.append([0, count-1, 0, block])
+            self._token_input_stack.append([0, count-1, 0, code])
 
     def _tokenizer_pop(self, out_of_loop=False):
         if len(self._token_input_stack) == 0:
             raise NoProcedureRunning('Tokenizer popped empty stack!')
 
         while self._token_input_stack:
-            context = self._token_input_stack[-1][1]
-            self._token_input_stack.pop()
+            pc, context, so_far, block = self._token_input_stack.pop()
+            if context is not None:
+                self.loop_iterations += so_far + 1
             if not out_of_loop or context is not None:
                 break
         else:
             raise MapFileFormatError('Loop termination (i.e. exit) encountered outside any active loop context.')
 
+    def _run_procedures(self, steps=0):
+        '''Run the procedure blocks on the tokenizer's input stack (see _tokenizer_push)
+        until they've all finished.  Returns the number of operations executed.
+        steps is the number of steps taken before (for _check_limits).'''
+
+        executed = 0
+        passes = 0
+        limit = self._check_at - steps
+        procedures = self._token_input_stack
+        while procedures:
+            passes += 1
+            if executed + passes >= limit:
+                limit = self._check_limits(steps + executed + passes) - steps
+            # _token_input_stack is a list of running procedure levels, and
+            # each element of that is a list of four elements: [pc, count, iter, code]
+            # where code is the operation list for a block previously digested here, 
+            # iter is the number of iterations taken so far,
+            # count is the number of future iterations remaining for the block, and 
+            # pc is the index of the next operation to execute from that block.
+            frame = procedures[-1]
+            pc, remaining, so_far, code = frame
+            if pc >= len(code):
+                # the procedure has run off the end.  stop it now.
+                if so_far >= self._LOOP_MAX:
+                    raise InfiniteLoopError('Loop execution terminated after {0} iterations'.format(so_far))
+
+                if isinstance(remaining, list):             # ranged loop: check parameters
+                    remaining[3] += remaining[1]            #   increment loop counter
+                    if remaining[1] < 0:                    # if we're counting DOWN, we need to check
+                        if remaining[3] < remaining[2]:     #   if we're below the max value.
+                            self._tokenizer_pop()
+                            continue
+                    else:                                   # otherwise, we check to see if we
+                        if remaining[3] > remaining[2]:     #   exceeded max value? stop
+                            self._tokenizer_pop()
+                            continue
+
+                    self.stack.append(remaining[3])         #   push current value
+                    pc = 0                                  #   rewind PC to start of block again
+                    frame[2] += 1                           #   increment iteration count for this block
+
+                elif remaining is not None and remaining > 0:   # IF we can continue again...
+                    pc = 0                                      #   rewind PC to start of block again
+                    frame[2] += 1                               #   increment iteration count for this block
+                    frame[1] -= 1                               #   decrement number of iterations remaining
+                else:                                           # ELSE...
+                    self._tokenizer_pop()                       #   dequeue block and uplevel
+                    continue
+
+            # run through the block until it ends or another one is started or stopped
+            depth = len(procedures)
+            end = len(code)
+            while pc < end:
+                operation, operand = code[pc]
+                pc += 1
+                operation(self, operand)
+                executed += 1
+                if len(procedures) != depth or procedures[-1] is not frame:
+                    break
+            frame[0] = pc
+        self._passes += passes
+        return executed
+
     def _each_ps_token(self, source):
         r'''Generate a list of PostScript-style code tokens from input source string.
 
@@ -1750,101 +2071,637 @@ class MapSource (object):
            '1 {2 3 {4 5}6}7'    is fed to the compiler as [1, [2, 3, [4, 5], 6], 7]
         '''
         
-        source = source.replace(r'\\', r'\134').replace(r'\(', r'\050').replace(r'\)', r'\051')
-        ignoring_comment = False
-        token_list = re.split(r'(\n|[ \t]+|[][{}]|\(.*?\))', source)
-
-        while self._token_input_stack or token_list:
-            if self._token_input_stack:
-                # executable content pushed back to us to re-submit to compiler
-                # _token_input_stack is a list of running procedure levels, and
-                # each element of that is a list of four elements: [pc, count, iter, block]
-                # where block is a token list previously digested here, 
-                # iter is the number of iterations taken so far,
-                # count is the number of future iterations remaining for the block, and 
-                # pc is the index of the next token to yield from that block.
-                pc, remaining, so_far, block = self._token_input_stack[-1]
-                if pc >= len(block):
-                    # the procedure has run off the end.  stop it now.
-                    if so_far >= self._LOOP_MAX:
-                        raise InfiniteLoopError('Loop execution terminated after {0} iterations'.format(so_far))
-
-                    if isinstance(remaining, list):             # ranged loop: check parameters
-                        remaining[3] += remaining[1]            #   increment loop counter
-                        if remaining[1] < 0:                    # if we're counting DOWN, we need to check
-                            if remaining[3] < remaining[2]:     #   if we're below the max value.
-                                self._tokenizer_pop()
-                                continue
-                        else:                                   # otherwise, we check to see if we
-                            if remaining[3] > remaining[2]:     #   exceeded max value? stop
-                                self._tokenizer_pop()
-                                continue
-
-                        self.stack.append(remaining[3])         #   push current value
-                        pc = self._token_input_stack[-1][0] = 0     #   rewind PC to start of block again
-                        self._token_input_stack[-1][2] += 1         #   increment iteration count for this block
-
-                    elif remaining is not None and remaining > 0:   # IF we can continue again...
-                        pc = self._token_input_stack[-1][0] = 0     #   rewind PC to start of block again
-                        self._token_input_stack[-1][2] += 1         #   increment iteration count for this block
-                        self._token_input_stack[-1][1] -= 1         #   decrement number of iterations remaining
-                    else:                                           # ELSE...
-                        self._tokenizer_pop()                       #   dequeue block and uplevel
-                        continue
-
-                self._token_input_stack[-1][0] += 1     # bump PC for next pass
-                yield block[pc]
+        for kind, result in self._lex_ps(source):
+            if kind == 'open':
+                self._diversion.append([])
                 continue
 
-            # nothing on the stack, so grab the next source code token
-            token = token_list.pop(0)
+            elif kind == 'close':
+                if len(self._diversion) == 0:
+                    raise MapFileFormatError('too many } braces in map definition')
+                result = self._diversion.pop()
 
-            if token.startswith('%'):
-                ignoring_comment=True
-                continue
+            if len(self._diversion) > 0:
+                self._diversion[-1].append(result)
+            else:
+                yield result
 
-            if ignoring_comment:
-                if token == '\n':
-                    ignoring_comment=False
-                continue
+    def _lex_ps(self, source):
+        r'''Generate the tokens in a map source string as (kind, value) tuples, where
+        kind is one of:
+            'number'    value is the int or float value of a numeric constant
+                        (including base#digits constants such as 16#7F)
+            'string'    value is a string constant '(...)', with \\, \(, and \)
+                        changed to \134, \050, and \051
+            'name'      value is any other word, such as a command name or /name
+            'bracket'   value is '[' or ']'
+            'open'      value is '{'
+            'close'     value is '}'
+        Whitespace and comments (from % to the end of the line) are skipped.
+        This is a single pass over the source with _PS_TOKEN.'''
 
-            # maybe it's an int of an explicit base?
-            m = self._INT_BASE.match(token)
-            if m:
+        source = source.replace(r'\\', r'\134').replace(r'\(', r'\050').replace(r'\)', r'\051')
+        for m in self._PS_TOKEN.finditer(source):
+            kind = m.lastgroup
+            if kind == 'space' or kind == 'comment':
+                continue
+            elif kind == 'name':
+                if m.group(kind).isspace():
+                    continue
+                yield 'name', m.group(kind)
+            elif kind == 'int':
+                yield 'number', int(m.group(kind))
+            elif kind == 'float':
+                yield 'number', float(m.group(kind))
+            elif kind == 'radix':
                 try:
-                    result = int(m.group('value'), int(m.group('base')))
+                    yield 'number', int(m.group('digits'), int(m.group('base')))
                 except ValueError as err:
-                    raise MapFileFormatError('Invalid numeric constant "{0}": {1}'.format(token, err))
+                    raise MapFileFormatError('Invalid numeric constant "{0}": {1}'.format(m.group(kind), err))
             else:
-                if token.strip() == '':
+                yield kind, m.group(kind)
+
+
+class MapSource (object):
+    '''The Ragnarok Magic Map as described in RRFC42 and RRFC46.
+    This object class understands the map file format and can
+    render images of the map.'''
+
+    _FIELD_DECL = re.compile(r'^(?P<tag>\w+)\s*:\s*(?P<value>.*?)\s*$')
+    _UNICODE_ESC= re.compile(r'\[#(?P<codepoint>[a-fA-F0-9]{1,6})\]')
+
+    def __init__(self, file=None):
+        "Create map source file manager, optionally reading map in from file."
+
+        self.pages = {}
+        self.room_page = {}
+        self.realm_globals = {}
+        self.profile = None     # set to a MapProfile to collect statistics
+        self.token_count = 0    # tokens executed by the last compile
+        self.loop_iterations = 0
+        self.steps = 0
+        self.operations_removed = 0
+        self.symbols_read = {}  # realm global symbols read by the last compile (name -> value)
+        self.file_symbols = {}  # realm global symbols read and defined by each file added (see add_from_file)
+        self.compile_cache = None   # set to a CompileCache to reuse previously compiled blocks
+        self.optimize_elements = False  # set to pass compiled blocks through optimize_element_list
+        self.diagnostics = None # set to a list to collect MapDiagnostics in (see add_from_file)
+        self.max_steps = None   # limits on each compile (see CompileContext)
+        self.time_limit = None
+        self.record_log = None  # set to a list to collect MapRecordChanges in (see merge)
+        if file is not None:
+            self.add_from_file(file)
+
+    def _clean_dict(self, d):
+        if 'map' in d and d['map'].strip() == '':
+            del d['map']
+
+    def _each_line(self, input_file):
+        '''Generate the lines of a map source file, which may be an open file
+        (or anything else which generates lines of text), or the UTF-8 bytes
+        of one in a bytes, bytearray, or mmap object.  Bytes are decoded a
+        line at a time as we go, so an mmap'd file is never copied whole.'''
+
+        if not isinstance(input_file, (bytes, bytearray, mmap.mmap)):
+            yield from input_file
+            return
+
+        start = 0
+        end = len(input_file)
+        while start < end:
+            stop = input_file.find(b'\n', start)
+            stop = end if stop < 0 else stop + 1
+            yield input_file[start:stop].decode('utf-8')
+            start = stop
+
+    def _each_record(self, input_file, errors=None):
+        '''Scan file for record blocks, generating a MapRecord for each found.
+        input_file may be anything _each_line can read.
+
+        Each line is sorted out by its first character: comments start with #
+        or %, continuation lines (and blank ones) with whitespace, and field
+        declarations with anything else, so only those need _FIELD_DECL.  The
+        lines of a multi-line field are collected in a list and joined once
+        the field is finished.
+
+        If errors is given, problems are collected in it as for _add_records
+        and the lines involved are skipped.'''
+
+        current_record = MapRecord()
+        current_tag = None
+        current_text = None # lines of the current map, also, or bg field so far
+        skipping = False    # skip continuation lines of a field we couldn't read
+
+        for line_no, line in enumerate(self._each_line(input_file), 1):
+            first = line[:1]
+            #
+            # Strip comments and blank lines
+            #
+            if first == '#' or first == '%':
+                continue
+
+            if not first or first.isspace():
+                text = line.strip()
+                if not text or skipping:
                     continue
+                #
+                # continuation of the previous field
+                #
                 try:
-                    result =  int(token)        # try converting to integer if we can
-                except:
-                    try:
-                        result = float(token)  # try converting to float if we can
-                    except:
-                        result = token         # punt
-
-            if token == '{':
-                self._diversion.append([])
+                    if current_tag is None:
+                        raise MapFileFormatError("Continuation line in map file outside containing record block: "+text)
+                    if current_text is None:
+                        raise MapFileFormatError('"'+current_tag+'" fields cannot have multiple lines; only "map", "also" and "bg" can do that.')
+                except MapFileFormatError as problem:
+                    if errors is None:
+                        raise
+                    errors.append((line_no, current_record.get('room'), problem))
+                    skipping = True
+                    continue
+
+                current_text.append(text)
+                current_record.lines[current_tag].append(line_no)
                 continue
 
-            elif token == '}':
-                if len(self._diversion) == 0:
-                    raise MapFileFormatError('too many } braces in map definition')
-                result = self._diversion.pop()
+            #
+            # Recognize beginning of a field (possibly
+            # a new record block)
+            #
+            decl = MapSource._FIELD_DECL.match(line)
+            if decl:
+                if current_text is not None:
+                    if len(current_text) > 1:
+                        current_record[current_tag] = '\n'.join(current_text)
+                    current_text = None
+                current_tag = decl.group('tag')
+                skipping = False
+                if current_tag == 'room':
+                    if current_record:
+                        self._clean_dict(current_record)
+                        yield current_record
+                        current_record = MapRecord()
+                try:
+                    self._read_field(current_record, current_tag, decl.group('value'), line)
+                except MapFileFormatError as problem:
+                    if errors is None:
+                        raise
+                    errors.append((line_no, current_record.get('room', decl.group('value') if current_tag == 'room' else None), problem))
+                    current_tag = None
+                    skipping = True
+                    continue
 
-            if len(self._diversion) > 0:
-                self._diversion[-1].append(result)
+                current_record.lines[current_tag] = [line_no]
+                if current_tag in ('map', 'also', 'bg'):
+                    current_text = [current_record[current_tag]]
             else:
-                yield result
+                #
+                # We're not sure WHAT we just read...
+                #
+                problem = MapFileFormatError("Unrecognizable line in map file at "
+                        + current_record.get('room', 'unknown room')
+                        + ': ' + line.strip())
+                if errors is None:
+                    raise problem
+                errors.append((line_no, current_record.get('room'), problem))
+        #
+        # yield last read block, if any
+        #
+        if current_text is not None and len(current_text) > 1:
+            current_record[current_tag] = '\n'.join(current_text)
+        if current_record:
+            self._clean_dict(current_record)
+            yield current_record
+
+    def _read_field(self, record, tag, value, line):
+        "Store the value of a field declared on a line of a map source file in record."
+        if tag in record:
+            raise MapFileFormatError('Map record for '
+                    +record.get('room', value if tag=='room' else 'unknown room')
+                    +' contains multiple '+tag+' fields.')
+
+        if tag == 'ref':
+            try:
+                ref = tuple([float(i) for i in value.split()])
+            except:
+                raise MapFileFormatError('"ref" field could not be understood: {0}'.format(line.strip()))
+            if len(ref) != 2:
+                raise MapFileFormatError('"ref" field must have two values: {0}'.format(line.strip()))
+            record[tag] = ref
+        else:
+            record[tag] = value
+
+    def _normalize_room_path(self, path, creator=None):
+        """Normalize the pathanme to the room, dealing with ~ syntax, etc.
+        creator is the expected creator name (to expand for ~/)
+        The normalized name should be the same as what the mudlib would
+        represnt it as (which is very important!)
+        NOTE THAT OUR DRIVER RUNS IN COMPAT MODE so these paths are
+        relative to the root dir ("players/<name>", "room/<name>", etc.)
+
+        Returns a tuple (normalized_name, creator_name)"""
+
+        # Sanitize room pathname to /players/<name>/... with no /../
+        # Allowed input forms (all referring to ~<name>/dir/room.c):
+        #   /players/<name>/dir/room    -> players/<name>/dir/room
+        #   ~<name>/dir/room            -> players/<name>/dir/room
+        #   ~/dir/room                  -> players/<name>/dir/room
+        #   dir/room                    -> players/<name>/dir/room
+        # Base map forms (everything else):
+        #   /room/foo                   -> room/foo
+        #    
+        if os.path.sep != '/':
+            # convert from Unix path style to local OS, normalize, then convert back
+            local_path = os.path.join(*(os.path.splitdrive(path.strip())[1].split('/')))
+            room_name = '/'.join(os.path.normpath(local_path).split(os.path.sep))
+            if not room_name.startswith('/'):
+                room_name = '/' + room_name
+        else:
+            # our platform understands the / separators we already have
+            room_name = os.path.normpath(path.strip())
+
+        room_creator = None
+        #
+        # expand ~ syntax and convert to relative path from mudlib root
+        #
+        m_tilde = re.match(r'~(\w*)/(.*)', room_name)
+        if m_tilde:
+            # ~/...
+            # ~<name>/...
+            if not m_tilde.group(1):
+                if creator is None:
+                    raise InvalidRoomPath('Cannot determine creator name to expand path {0}. Please explicitly specify the creator name with --creator option or the "Manage Creator Options" dialog.'.format(room_name))
+                room_creator = creator
+            else:
+                room_creator = m_tilde.group(1)
+                
+            room_name = 'players/'+room_creator+'/'+m_tilde.group(2)
+        else:
+            m_player= re.match(r'/players/(\w+)/', room_name)
+            if m_player:
+                # /players/<name>/...
+                room_creator = m_player.group(1)
+                room_name = room_name[1:]
+            elif room_name.startswith('/'):
+                # /something-other-than-players/...
+                room_creator = None
+                room_name = room_name[1:]
+            else:
+                # relative path in creator's realm
+                if creator is None:
+                    raise InvalidRoomPath('Cannot determine creator name to expand path {0}. Please explicitly specify the creator name with --creator option or the "Manage Creator Options" dialog.'.format(room_name))
+                room_creator = creator
+                room_name = 'players/'+room_creator+'/'+room_name
+
+        return (room_name, room_creator)
+
+    def add_from_file(self, input_file, creator=None, enforce_creator=False, source_date=None, verbosity=0):
+        '''Add rooms and places to this file from a map source file.  input_file
+        is an open file, or the UTF-8 contents of one as bytes or an mmap object.
+
+        The realm global ($) symbols the file used are noted in
+        file_symbols[<input filename>], a dictionary with these keys:
+          reads:   {symbol: value it had before this file was read (None if it was undefined)}
+                   for each symbol the file read
+          defines: {symbol: value} for each symbol the file (re)defined
+          rooms:   {room ID: {symbol: value read}} for each room whose map read any
+          bg:      {page number: {symbol: value read}} for each page whose bg it added to read any
+
+        Normally the first problem found in the file is raised as an exception.
+        If diagnostics is a list, however, a MapDiagnostic for each problem is
+        added to it instead, and we carry on with the next statement in a map
+        or bg field, or the next record, to find all of them in one go.  The
+        rooms and pages we get that way may be incomplete.
+        '''
+        if verbosity > 2:
+            sys.stdout.write("MapSource.add_from_file(creator={0}, enforce_creator={1}, source_date={2}, verbosity={3}\n".format(repr(creator), enforce_creator, repr(source_date), verbosity))
+
+        global_key = creator or '.CORE.'
+        if global_key not in self.realm_globals:
+            self.realm_globals[global_key] = {}
+
+        src_filename = getattr(input_file, 'name', '<input>')
+        incoming = dict(self.realm_globals[global_key])
+        self._file_symbols = {'reads': {}, 'defines': {}, 'rooms': {}, 'bg': {}}
+        errors = None if self.diagnostics is None else []
+        try:
+            if self.profile is None:
+                self._add_records(input_file, creator, enforce_creator, source_date, verbosity, global_key, errors=errors)
+            else:
+                #
+                # Same thing, but keep track of how much work each room and the
+                # file as a whole took.
+                #
+                file_stats = [0, 0, 0, 0, 0, 0] # rooms, tokens, loop_iterations, elements, operations_removed, steps
+                file_start = time.perf_counter()
+                try:
+                    self._add_records(input_file, creator, enforce_creator, source_date, verbosity, global_key, src_filename, file_stats, errors)
+                finally:
+                    self.profile.record_file(src_filename, time.perf_counter() - file_start, *file_stats)
+        finally:
+            if errors:
+                self.diagnostics.extend([MapDiagnostic(src_filename, line, room, problem) for line, room, problem
+                    in sorted(errors, key=lambda e: (e[0] is None, e[0] or 0))])
+            file_symbols = self._file_symbols
+            for symbol in file_symbols['reads']:
+                file_symbols['reads'][symbol] = incoming.get(symbol)
+            for symbol, value in self.realm_globals[global_key].items():
+                if symbol not in incoming or incoming[symbol] is not value:
+                    file_symbols['defines'][symbol] = value
+            self.file_symbols[src_filename] = file_symbols
+            self._file_symbols = None
+
+    def _add_records(self, input_file, creator, enforce_creator, source_date, verbosity, global_key, src_filename=None, file_stats=None, errors=None):
+        '''Add the rooms described in input_file (the body of add_from_file).
+
+        If errors is given, it is a list to collect problems in as (line, room,
+        exception) tuples rather than stopping at the first one, where line is
+        the line number in the file (or None if we don't know it) and room is
+        the room field of the record it was in (or None).'''
+
+        for record in self._each_record(input_file, errors):
+            if errors is None:
+                self._add_record(record, creator, enforce_creator, source_date, verbosity, global_key, src_filename, file_stats)
+                continue
+            try:
+                self._add_record(record, creator, enforce_creator, source_date, verbosity, global_key, src_filename, file_stats, errors)
+            except Exception as problem:
+                errors.append((getattr(record, 'lines', {}).get('room', [None])[0], record.get('room'), problem))
+
+    def _add_record(self, record, creator, enforce_creator, source_date, verbosity, global_key, src_filename=None, file_stats=None, errors=None):
+        "Add the room described by one record read from a map source file (see _add_records)."
+
+        if file_stats is not None:
+            room_start = time.perf_counter()
+            room_stats = [0, 0, 0, 0, 0]    # tokens, loop_iterations, elements, operations_removed, steps
+        for required_field in 'room', 'page':
+            if required_field not in record:
+                raise MapFileFormatError('Map source file record does not contain a "'
+                        +required_field+'" field: ' + repr(record))
+        #
+        # set up containing page first
+        #
+        if verbosity > 2:
+            sys.stdout.write(" room {0}\n".format(record['room']))
+
+        page = self.get_page(record['page'])
+        changes = None
+        if self.record_log is not None:
+            changes = MapRecordChanges(page.page)
+            self.record_log.append(changes)
+
+        if 'bg' in record and record['bg'].strip():
+            if page.bg:
+                # XXX warn that multiple rooms contribute to this page bg
+                pass
+            bg = self._compile_field(record, 'bg', global_key, errors)
+            page.bg.extend(bg)
+            if changes is not None:
+                changes.bg = bg
+                changes.bg_reads = self.symbols_read
+            if self.symbols_read:
+                self._file_symbols['reads'].update(self.symbols_read)
+                self._file_symbols['bg'].setdefault(page.page, {}).update(self.symbols_read)
+            if file_stats is not None:
+                room_stats[0] += self.token_count
+                room_stats[1] += self.loop_iterations
+                room_stats[2] += len(bg)
+                room_stats[3] += self.operations_removed
+                room_stats[4] += self.steps
+
+
+        if 'realm' in record:
+            if page.realm and record['realm'] != page.realm:
+                # XXX warn that room overrides page realm name
+                pass
+            page.realm = record['realm']
+            if changes is not None:
+                changes.realm = page.realm
+
+        if 'orient' in record:
+            orient = LANDSCAPE if 'land' in record['orient'] else PORTRAIT
+            if changes is not None:
+                changes.orient = orient
+            page.orient = orient
+
+        room_name, room_creator = self._normalize_room_path(record['room'], creator)
+        if verbosity > 3:
+            sys.stderr.write("room normalization {0} -> {1} (creator {2} -> {3})\n".format(
+                record['room'], room_name, creator, room_creator))
+        if changes is not None:
+            changes.room = room_name
+        if room_name in self.room_page:
+            raise DuplicateRoomError('Room '+room_name+' was already defined (on page '+repr(self.room_page[room_name])+')')
+
+        if enforce_creator:
+            # Ensure that we don't have user A defining room maps in user B's
+            # realm.
+            # (if path does not match that pattern then it's a base map with
+            # NO creator, which means the creator param must be undefined here)
+            if room_creator != creator:
+                if creator is None:
+                    raise IllegalCreatorReference('Base maps cannot define rooms inside wizard realms: {0}'.format(room_name))
+                else:
+                    raise IllegalCreatorReference("Map in {0}'s realm cannot define rooms for {1}'s realm: {2}".format(creator, room_creator, room_name))
+
+        if room_creator is None:
+            room_creator = "Base World Map"
+
+        if room_creator is not None and room_creator not in page.creators:
+            page.creators.append(room_creator)
+
+        self.room_page[room_name] = page.page
+        if changes is not None:
+            changes.creator = room_creator
+        room_map = self._compile_field(record, 'map', global_key, errors) \
+                if ('map' in record and record['map'].strip()) else None
+        if room_map is not None and self.symbols_read:
+            self._file_symbols['reads'].update(self.symbols_read)
+            self._file_symbols['rooms'][room_name] = self.symbols_read
+            if changes is not None:
+                changes.map_reads = self.symbols_read
+        map_room = MapRoom(room_name, page, record.get('name'), room_map,
+            [self._normalize_room_path(p, creator)[0] 
+                for p in [_f for _f in record.get('also','').split('\n') if _f]],
+            reference_point=record.get('ref'),
+            source_modified_date=source_date)
+        page.add_room(map_room)
+        if changes is not None:
+            changes.map_room = map_room
+
+        if file_stats is not None:
+            if room_map is not None:
+                room_stats[0] += self.token_count
+                room_stats[1] += self.loop_iterations
+                room_stats[2] += len(room_map)
+                room_stats[3] += self.operations_removed
+                room_stats[4] += self.steps
+            self.profile.record_room(room_name, src_filename, time.perf_counter() - room_start, *room_stats)
+            file_stats[0] += 1
+            for i, value in enumerate(room_stats):
+                file_stats[i+1] += value
+
+    def _compile_field(self, record, tag, global_key, errors=None):
+        '''Compile the map or bg field (named by tag) of record.  If errors is
+        given, problems in it are collected there as for _add_records.'''
+        if errors is None:
+            try:
+                return self._compile_block(record[tag], global_key)
+            except CompileLimitError as problem:
+                raise CompileLimitError('{0} field of room {1}: {2}'.format(tag, record.get('room'), problem)) from None
+
+        block_errors = []
+        elements = self._compile_block(record[tag], global_key, block_errors)
+        lines = getattr(record, 'lines', {}).get(tag, [])
+        for line, problem in block_errors:
+            errors.append((lines[line] if line < len(lines) else None, record.get('room'), problem))
+        return elements
+
+    def _compile_block(self, source, global_key, errors=None):
+        '''Compile the source of a map or bg field, from the compile cache if we
+        have one, and run it through optimize_element_list if optimize_elements
+        is set.  If errors is given, it is passed to compile (and the cache
+        isn't used, since what we get may be incomplete).'''
+        if errors is not None:
+            elements = self.compile(source, global_symbols=self.realm_globals[global_key], errors=errors)
+        elif self.compile_cache is None:
+            elements = self.compile(source, global_symbols=self.realm_globals[global_key])
+        else:
+            elements = self.compile_cache.compile(self, source, self.realm_globals[global_key])
+        if self.optimize_elements:
+            elements = optimize_element_list(elements)
+        return elements
+
+    def merge(self, other):
+        '''Merge the pages and rooms of another MapSource into this one.
+
+        This is used to combine map shards which were compiled separately
+        (e.g., in another process).  The pages are combined the same way
+        add_from_file would have combined them had the other map's files
+        been added to this one directly: backgrounds are appended, the
+        realm title is overridden, orientation conflicts raise
+        PageOrientationViolationError, and a room defined in both maps
+        raises DuplicateRoomError.
+
+        If other kept a record_log, its records are replayed in order
+        exactly as add_from_file added them, so this stops at the same
+        point it would have (leaving the records before it added and the
+        page settings of the one it stopped at applied, and other's
+        file_symbols cut down to the symbols those read).  Otherwise, each
+        of other's pages is merged in turn.'''
+
+        for key, symbols in other.realm_globals.items():
+            self.realm_globals.setdefault(key, {}).update(symbols)
+        self.file_symbols.update(other.file_symbols)
+        if other.record_log is not None:
+            self._replay_records(other.record_log, other.file_symbols)
+            return
+
+        for page_no, other_page in other.pages.items():
+            page = self.get_page(page_no)
+            page.bg.extend(other_page.bg)
+            if other_page.realm is not None:
+                page.realm = other_page.realm
+            orient = object.__getattribute__(other_page, 'orient')
+            if orient is not None:
+                page.orient = orient
+            for room_creator in other_page.creators:
+                if room_creator not in page.creators:
+                    page.creators.append(room_creator)
+
+            for room in other_page.rooms.values():
+                if room.id in self.room_page:
+                    raise DuplicateRoomError('Room '+room.id+' was already defined (on page '+repr(self.room_page[room.id])+')')
+                room.page = page
+                page.add_room(room)
+                self.room_page[room.id] = page.page
+
+    def _replay_records(self, record_log, file_symbols):
+        "Apply a record_log's MapRecordChanges to this map (see merge)."
+        for applied, changes in enumerate(record_log):
+            try:
+                self._replay_record(changes)
+            except Exception:
+                for symbols in file_symbols.values():
+                    self._trim_file_symbols(symbols, record_log[:applied], changes)
+                raise
+
+    def _trim_file_symbols(self, symbols, record_log, last_changes):
+        '''Cut the file_symbols entry for a file down to what the records in
+        record_log read, and the bg of the one after them (last_changes),
+        where replaying its records stopped.'''
+        rooms = {}
+        bg = {}
+        for changes in record_log + [last_changes]:
+            if changes.bg_reads:
+                bg.setdefault(changes.page, {}).update(changes.bg_reads)
+            if changes.map_reads and changes is not last_changes:
+                rooms[changes.room] = changes.map_reads
+        read = set()
+        for reads in list(rooms.values()) + list(bg.values()):
+            read.update(reads)
+        symbols['reads'] = dict((symbol, value) for symbol, value in symbols['reads'].items() if symbol in read)
+        symbols['rooms'] = rooms
+        symbols['bg'] = bg
+
+    def _replay_record(self, changes):
+        "Apply one record's MapRecordChanges to this map (see merge)."
+        page = self.get_page(changes.page)
+        if changes.bg is not None:
+            page.bg.extend(changes.bg)
+        if changes.realm is not None:
+            page.realm = changes.realm
+        if changes.orient is not None:
+            page.orient = changes.orient
+        if changes.room is None:
+            return
+        if changes.room in self.room_page:
+            raise DuplicateRoomError('Room '+changes.room+' was already defined (on page '+repr(self.room_page[changes.room])+')')
+        if changes.creator is None:
+            return
+        if changes.creator not in page.creators:
+            page.creators.append(changes.creator)
+        self.room_page[changes.room] = page.page
+        if changes.map_room is not None:
+            changes.map_room.page = page
+            page.add_room(changes.map_room)
+
+    def get_page(self, page_id):
+        "Get page by id (coerced to integer) and return it (creating one if needed)"
+
+        i = int(page_id)
+        if i not in self.pages:
+            self.pages[i] = MapPage(i)
+        return self.pages[i]
+
+    def compile(self, source, allow_test=False, global_symbols=None, errors=None):
+        '''Compile source string -> list of encoded element definitions
+
+        Each call gets its own CompileContext, so this may be called from
+        several threads at once (and compiles may be nested).  The only
+        thing they share is the global_symbols dictionary, which "def"ing
+        a $name symbol changes.  Afterward, token_count, loop_iterations,
+        steps, operations_removed, and symbols_read describe the compile which
+        finished last; use a CompileContext directly to get them for a
+        particular compile.  If errors is given, problems are collected in it
+        instead of raising the first one (see CompileContext.compile).  The
+        max_steps and time_limit attributes, if set, limit the compile
+        (see CompileContext).'''
+
+        context = CompileContext(allow_test, global_symbols, max_steps=self.max_steps, time_limit=self.time_limit)
+        try:
+            return context.compile(source, errors)
+        finally:
+            self.token_count = context.token_count
+            self.loop_iterations = context.loop_iterations
+            self.steps = context.steps
+            self.operations_removed = context.operations_removed
+            self.symbols_read = context.symbols_read
 
 class PostScriptMapSource (MapSource):
     '''Variation of map representation where the room and page data
     are raw PostScript strings instead of token lists'''
 
-    def compile(self, source, allow_test=False, global_symbols=None):
+    def compile(self, source, allow_test=False, global_symbols=None, errors=None):
         "Compile source string -> PostScript string"
         return [source]
 
@@ -1910,51 +2767,132 @@ class PostScriptMapSource (MapSource):
 # S x y text                    show
 # T[c2] x y                     tree/clump
 
+#
+# Element types which don't draw anything, but set the color, dash
+# pattern, font, line width, translation, or scale used for the elements
+# after them.
+#
+_STATE_ELEMENTS = frozenset('CDFLXZ')
+
+#
+# Element types whose renderer resets some of that state as a side
+# effect (area fills and rooms leave the color black, and rooms reset
+# the font to t 8), mapped to the state kinds they reset.
+#
+_STATE_RESET_ELEMENTS = {
+    'A': 'C',
+    'R': 'CF',
+}
+
+def optimize_element_list(element_list):
+    '''Return a shorter element list which draws the same picture as
+    element_list (which is left as it was):
+        - a state change (C, D, F, L, X, Z) which is replaced by another
+          of the same kind before anything is drawn, or which sets what
+          the list had already set, is dropped (so grestore followed by
+          setting something else no longer leaves two changes behind);
+        - a path (P) with fewer than two points is dropped;
+        - a plain polyline (P with no flags) which starts where the
+          plain polyline drawn just before it ended is joined onto that
+          one, unless the list has set a dash pattern which is still in
+          effect (where the pieces meet, a line join is drawn instead of
+          two line ends).
+    State changes left at the end of the list are always kept, since
+    the renderer carries them on to whatever it draws next.  Drawing an
+    area fill (A) or room (R) resets the color (and for rooms, the font),
+    so a change repeated after one of those is kept:
+
+    >>> optimize_element_list([['C', 1, 0, 0], ['P', [10, 10, 20, 20]],
+    ...     ['R', 40, 40, 50, 20, 'A', 'B', []], ['C', 1, 0, 0], ['P', [30, 30, 50, 50]]])
+    [['C', 1, 0, 0], ['P', [10, 10, 20, 20]], ['R', 40, 40, 50, 20, 'A', 'B', []], ['C', 1, 0, 0], ['P', [30, 30, 50, 50]]]
+    >>> optimize_element_list([['Fb', 12], ['S', 10, 10, 'x'],
+    ...     ['R', 40, 40, 50, 20, 'A', 'B', []], ['Fb', 12], ['S', 10, 20, 'y']])
+    [['Fb', 12], ['S', 10, 10, 'x'], ['R', 40, 40, 50, 20, 'A', 'B', []], ['Fb', 12], ['S', 10, 20, 'y']]
+    '''
+
+    result = []
+    settled = {}        # state kind -> the change in effect for what was last drawn
+    pending = {}        # state kind -> index in result of a change nothing was drawn with yet
+    last_line = None    # index in result of the last element drawn if it's a plain polyline
+    for element in element_list:
+        kind = element[0][0]
+        if kind in _STATE_ELEMENTS:
+            if kind in pending:
+                result[pending.pop(kind)] = None
+            if settled.get(kind) != element:
+                pending[kind] = len(result)
+                result.append(element)
+            continue
+
+        if kind == 'P':
+            if len(element[1]) < 4:
+                continue
+            if element[0] == 'P' and last_line is not None and not pending \
+                    and result[last_line][1][-2:] == element[1][:2]:
+                result[last_line] = ['P', result[last_line][1] + element[1][2:]]
+                continue
+
+        for index in pending.values():
+            settled[result[index][0][0]] = result[index]
+        pending.clear()
+        dashed = 'D' in settled and bool(settled['D'][1])
+        last_line = len(result) if element[0] == 'P' and not dashed else None
+        result.append(element)
+        for reset_kind in _STATE_RESET_ELEMENTS.get(kind, ''):
+            settled.pop(reset_kind, None)
+
+    return [element for element in result if element is not None]
+
+
+#
+# Named string escapes (\[...] and the legacy octal codes) and the
+# characters they stand for (see string_escape_translator).
+#
+_SPECIAL_CODES = {
+    '[/c]': 0x00a2,   # cents
+    '[S]':  0x00a7,   # section
+    '[``]': 0x201c,   # open " quotes
+    '[<<]': 0x00ab,   # open << quotes
+    '[-]':  0x2013,   # en-dash
+    '-':    0x2012,   # minus
+    '[+]':  0x2020,   # dagger
+    '[++]': 0x2021,   # double dagger
+    '[P]':  0o266,   # paragraph (pilcrow)
+    '[*]':  0x2022,   # bullet
+    "['']": 0x201d,   # close " quotes
+    '[>>]': 0x00bb,   # close >> quotes
+    '[--]': 0x2014,   # em-dash
+    '[AE]': 0x00c6,   # AE ligature
+    '[ae]': 0x00e6,   # ae ligature
+                      #
+                      # Deprecated legacy codes
+                      #
+    '242': 0x00a2,    # cents
+    '247': 0x00a7,    # section
+    '252': 0x201c,    # open " quotes
+    '253': 0x00ab,    # open << quotes
+    '261': 0x2013,    # en-dash
+    '262': 0x2020,    # dagger
+    '263': 0x2021,    # double dagger
+    '266': 0o266,     # paragraph (pilcrow)
+    '267': 0x2022,    # bullet
+    "272": 0x201d,    # close " quotes
+    '273': 0x00bb,    # close >> quotes
+    '320': 0x2014,    # em-dash
+    '341': 0x00c6,    # AE ligature
+    '361': 0x00e6,    # ae ligature
+}
 
 def string_escape_translator(code):
     r"given a special character code (e.g., the 'n' or '123' part of '\n' or '\123'), return the character it represents."
 
-    special_codes = {
-                        '[/c]': 0x00a2,   # cents
-                        '[S]':  0x00a7,   # section
-                        '[``]': 0x201c,   # open " quotes
-                        '[<<]': 0x00ab,   # open << quotes
-                        '[-]':  0x2013,   # en-dash
-                        '-':    0x2012,   # minus
-                        '[+]':  0x2020,   # dagger
-                        '[++]': 0x2021,   # double dagger
-                        '[P]':  0o266,   # paragraph (pilcrow)
-                        '[*]':  0x2022,   # bullet
-                        "['']": 0x201d,   # close " quotes
-                        '[>>]': 0x00bb,   # close >> quotes
-                        '[--]': 0x2014,   # em-dash
-                        '[AE]': 0x00c6,   # AE ligature
-                        '[ae]': 0x00e6,   # ae ligature
-                                          #
-                                          # Deprecated legacy codes
-                                          #
-                        '242': 0x00a2,    # cents
-                        '247': 0x00a7,    # section
-                        '252': 0x201c,    # open " quotes
-                        '253': 0x00ab,    # open << quotes
-                        '261': 0x2013,    # en-dash
-                        '262': 0x2020,    # dagger
-                        '263': 0x2021,    # double dagger
-                        '266': 0o266,     # paragraph (pilcrow)
-                        '267': 0x2022,    # bullet
-                        "272": 0x201d,    # close " quotes
-                        '273': 0x00bb,    # close >> quotes
-                        '320': 0x2014,    # em-dash
-                        '341': 0x00c6,    # AE ligature
-                        '361': 0x00e6,    # ae ligature
-    }
-
-    if code in special_codes:
-        return chr(special_codes[code])
+    if code in _SPECIAL_CODES:
+        return chr(_SPECIAL_CODES[code])
 
-    u = MapSource._UNICODE_ESC.fullmatch(code)
-    if u:
-        return chr(int(u.group('codepoint'),16))
+    if code.startswith('[#'):
+        u = MapSource._UNICODE_ESC.fullmatch(code)
+        if u:
+            return chr(int(u.group('codepoint'),16))
 
     try:
         ch = int(code, 8)
@@ -1966,6 +2904,22 @@ def string_escape_translator(code):
 
     raise MapFileFormatError(r'Invalid string escape code "\{0}" (out of allowed range of character codes).'.format(code))
 
+def _translate_escape(match):
+    "re.sub() replacement for one escape matched by CompileContext._STRING_ESCAPE"
+    return string_escape_translator(match.group(1))
+
+#
+# Map pages repeat the same labels over and over, so the most recently
+# used decoded literals are kept (shared by every compile; call
+# decode_string_literal.cache_clear() to forget them).
+#
+@functools.lru_cache(maxsize=10000)
+def decode_string_literal(ps_token):
+    "(...) source text of a string literal -> string value with \\ escapes interpreted"
+    if '\\' in ps_token:
+        return CompileContext._STRING_ESCAPE.sub(_translate_escape, ps_token)[1:-1]
+    return ps_token[1:-1]
+
 # state includes everything -- line width, scale, rotation, translation...
 #@[00]@| Ragnarok MagicMapper 6.1.0-alpha.0
 #@[01]@|
@@ -87,6 +87,7 @@
 
 
 from RagnarokMUD.MagicMapper.MapCacheManager import MapCacheManager
+from RagnarokMUD.MagicMapper.MapDataHandler  import footer_fields, DATA_FORMAT_VERSION, BINARY_FORMAT_VERSION, BINARY_FILE_SUFFIX
 from RagnarokMUD.MagicMapper.AnsiParser      import AnsiParser
 import urllib.request, urllib.error, urllib.parse
 import time
@@ -116,7 +117,7 @@ class SocksError (Exception):
     "We failed to get a connection started via SOCKS proxy."
 
 class NetworkIO (object):
-    def __init__(self, base_url, cache_dir=None, cache_age=86400, diag_callback=None, config=None):
+    def __init__(self, base_url, cache_dir=None, cache_age=86400, diag_callback=None, config=None, data_format=DATA_FORMAT_VERSION):
         '''Create Network interface object.
         ------------------------------------------------------------------------------
         base_url:  base url to get map pages and rooms.  We'll append "/room/<id>" 
@@ -135,6 +136,10 @@ class NetworkIO (object):
                           prog: Progress on task so far or None if N/A
                           total: How for "prog" will go or None if N/A
                           msg: Message to show to user
+        data_format: version of the map data format to ask for: 6 (text) or 7
+                   (binary, which is quicker to load but is only on the server
+                   if the map was compiled with binary files enabled).  For 7,
+                   we append ".v7" to each URL.
         '''
         # XXX idea: use page timestamp on server to signal that no room
         # XXX on that page is newer, so we never check rooms on a page
@@ -153,6 +158,13 @@ class NetworkIO (object):
             self.log('NOT using cache!', 8)
 
         self.config = config
+        if data_format == BINARY_FORMAT_VERSION:
+            self.url_suffix = BINARY_FILE_SUFFIX
+        elif data_format == DATA_FORMAT_VERSION:
+            self.url_suffix = ''
+        else:
+            raise ValueError('Map data format version %s is not supported.' % data_format)
+        self.log('Using version %d map data.' % data_format, 8)
 
 
     def log(self, msg, level=1, prog=None, total=None):
@@ -160,6 +172,8 @@ class NetworkIO (object):
             self.diag_callback(level, prog, total, msg)
 
     def _get_data(self, url, key):
+        url += self.url_suffix
+        key += self.url_suffix
         if self.cache:
             self.log('Checking cache ID '+key, 8)
             cache_entry = self.cache.retrieve(key)
@@ -192,13 +206,14 @@ class NetworkIO (object):
             # Get actual data timestamp
             #
             # All we need to know about the file format here is
-            # that the LAST line has the format:
+            # that the footer has the fields
             #   %<checksum> <data-timestamp> <source-timestamp>
+            # (see footer_fields).
             #
             # We want the 2nd field (<data-timestamp>) and will check
             # to see if the server has anything newer than that.
             #
-            cache_data_checksum, cache_data_time = [_f for _f in cached_data.split('\n') if _f][-1].split()[:2]
+            cache_data_checksum, cache_data_time = (footer_fields(cached_data) + ['', ''])[:2]
             if not cache_data_checksum.startswith('%'):
                 self.log('Cache entry "%s" invalid (footer format error), may be corrupt.' % key, 2)
                 self.cache.remove(key)
@@ -285,15 +300,24 @@ class NetworkIO (object):
         return data
 
     def get_page(self, page_no):
-        '''int page_no -> text of page description
+        '''int page_no -> data of page description (bytes)
         This will fetch the page from local cache if it's within the allowed
         timeframe, or if the server's copy is not available.  Otherwise, it
         will contact the remote service, cache the result, and return it.'''
         self.log("Retrieving page %d from server" % page_no)
         return self._get_data('/page/%d' % page_no, '#%d' % page_no)
 
+    def get_bundle(self, page_no):
+        '''int page_no -> data of page bundle (the page and all of its rooms, as bytes)
+        This will fetch the bundle from local cache if it's within the allowed
+        timeframe, or if the server's copy is not available.  Otherwise, it
+        will contact the remote service, cache the result, and return it.
+        The server only has these if the map was compiled with bundles enabled.'''
+        self.log("Retrieving page %d bundle from server" % page_no)
+        return self._get_data('/bundle/%d' % page_no, '*%d' % page_no)
+
     def get_room(self, room_id):
-        '''room_id -> text of room description
+        '''room_id -> data of room description (bytes)
         This will fetch the room from local cache if it's within the allowed
         timeframe, or if the server's copy is not available.  Otherwise, it
         will contact the remote service, cache the result, and return it.'''
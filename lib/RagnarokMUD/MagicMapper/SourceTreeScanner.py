@@ -0,0 +1,221 @@
+########################################################################################
+#  _______  _______  _______ _________ _______  _______  _______  _______              #
+# (       )(  ___  )(  ____ \\__   __/(  ____ \(       )(  ___  )(  ____ ) Ragnarok    #
+# | () () || (   ) || (    \/   ) (   | (    \/| () () || (   ) || (    )| MUD         #
+# | || || || (___) || |         | |   | |      | || || || (___) || (____)| Magic       #
+# | |(_)| ||  ___  || | ____    | |   | |      | |(_)| ||  ___  ||  _____) Mapper      #
+# | |   | || (   ) || | \_  )   | |   | |      | |   | || (   ) || (       Client      #
+# | )   ( || )   ( || (___) |___) (___| (____/\| )   ( || )   ( || )       (rag.com)   #
+# |/     \||/     \|(_______)\_______/(_______/|/     \||/     \||/                    #
+#   ______    __       _______         _______  _        _______           _______     #
+#  / ____ \  /  \     (  __   )       (  ___  )( \      (  ____ )|\     /|(  ___  )    #
+# ( (    \/  \/) )    | (  )  |       | (   ) || (      | (    )|| )   ( || (   ) |    #
+# | (____      | |    | | /   | _____ | (___) || |      | (____)|| (___) || (___) |    #
+# |  ___ \     | |    | (/ /) |(_____)|  ___  || |      |  _____)|  ___  ||  ___  |    #
+# | (   ) )    | |    |   / | |       | (   ) || |      | (      | (   ) || (   ) |    #
+# ( (___) )_ __) (_ _ |  (__) |       | )   ( || (____/\| )      | )   ( || )   ( | _  #
+#  \_____/(_)\____/(_)(_______)       |/     \|(_______/|/       |/     \||/     \|(_) #
+#                                                                                      #
+########################################################################################
+#
+# RAGNAROK MAGIC MAPPER SOURCE CODE: Search mudlib trees for map source files
+#
+
+import os, os.path, re, sys
+from fnmatch import fnmatch
+
+#
+# What we know about a directory while descending through the tree,
+# from the pathname components leading up to it.
+#
+BASE_DIR    = 0     # outside any player's area
+PLAYERS_DIR = 1     # .../players
+CREATOR_DIR = 2     # .../players/<name>
+CREATOR_MAP = 3     # .../players/<name>/map/...
+SKIP_DIR    = 4     # .../players/<name>/<anything else>/...
+
+class SourceTreeScanner (object):
+    '''Find the map source files in a set of directory trees.
+
+    If creator_from_path is set, only the files we would compile for the
+    real MUD are reported:
+      .../players/<name>/realm.map      (realm file for creator <name>)
+      .../players/<name>/map/...        (any map file in there for <name>)
+      .../map/...                       (base world maps anywhere outside
+                                         player directories; no creator)
+    and any player subtree which can't hold one of those is not descended
+    into at all.  Otherwise, every file matching pattern is reported with
+    no creator.  Directories whose names begin with "." are only searched
+    if hidden_dirs is set, and symbolic links to directories are only
+    followed if follow_links is set (in which case each directory is still
+    searched only once, so links can't send us round in circles).
+
+    Files are reported in the same order os.walk would find them.  After
+    a scan, entries_visited is the number of directory entries examined
+    and dirs_visited the number of directories read.
+
+    Usage:
+        scanner = SourceTreeScanner(creator_from_path=True)
+        for filename, creator_name in scanner.scan(source_trees):
+            ...
+    '''
+
+    def __init__(self, creator_from_path=False, pattern='*.map', verbosity=0, follow_links=False, hidden_dirs=False):
+        self.creator_from_path = creator_from_path
+        self.pattern = pattern
+        self.verbosity = verbosity
+        self.follow_links = follow_links
+        self.hidden_dirs = hidden_dirs
+        self.entries_visited = 0
+        self.dirs_visited = 0
+
+    def scan(self, source_trees):
+        "Generate (filename, creator_name) for each map source file under the source_trees."
+
+        self.entries_visited = 0
+        self.dirs_visited = 0
+        seen_dirs = set()   # (device, inode) of the directories searched, if following links
+
+        for source_tree in source_trees:
+            #
+            # The source tree's own pathname might already put it
+            # inside a player's area.
+            #
+            state, in_map, creator_name = BASE_DIR, False, None
+            for component in os.path.splitdrive(source_tree)[1].split(os.path.sep):
+                if component:
+                    state, in_map, creator_name = self._descend(state, in_map, creator_name, component)
+
+            stack = [(source_tree, state, in_map, creator_name)]
+            while stack:
+                root, state, in_map, creator_name = stack.pop()
+                try:
+                    if self.follow_links:
+                        root_stat = os.stat(root)
+                        if (root_stat.st_dev, root_stat.st_ino) in seen_dirs:
+                            continue
+                        seen_dirs.add((root_stat.st_dev, root_stat.st_ino))
+                    with os.scandir(root) as dir_iter:
+                        entries = list(dir_iter)
+                except OSError:
+                    continue
+
+                self.dirs_visited += 1
+                self.entries_visited += len(entries)
+                subdirs = []
+                filenames = []
+                for entry in entries:
+                    try:
+                        is_dir = entry.is_dir()
+                    except OSError:
+                        is_dir = False
+                    if not is_dir:
+                        filenames.append(entry.name)
+                    elif self.hidden_dirs or not entry.name.startswith('.'):
+                        try:
+                            if entry.is_symlink() and not self.follow_links:
+                                continue
+                        except OSError:
+                            continue
+                        subdirs.append(entry)
+
+                yield from self._scan_files(root, state, in_map, creator_name, filenames)
+
+                for entry in reversed(subdirs):
+                    substate = self._descend(state, in_map, creator_name, entry.name)
+                    if substate[0] == SKIP_DIR:
+                        if self.verbosity > 2:
+                            sys.stderr.write("Skipping non-map dir "+entry.path+"\n")
+                        continue
+                    stack.append((entry.path,) + substate)
+
+    def _descend(self, state, in_map, creator_name, name):
+        "Given what we know about a directory, return (state, in_map, creator_name) for its subdirectory name."
+
+        if not self.creator_from_path:
+            return BASE_DIR, False, None
+
+        if state == BASE_DIR:
+            if name == 'players':
+                return PLAYERS_DIR, in_map, None
+            return BASE_DIR, in_map or name == 'map', None
+
+        if state == PLAYERS_DIR:
+            if re.match(r'\w+$', name):
+                return CREATOR_DIR, in_map, name
+            return SKIP_DIR, in_map, None
+
+        if state == CREATOR_DIR:
+            if name == 'map':
+                return CREATOR_MAP, in_map, creator_name
+            return SKIP_DIR, in_map, creator_name
+
+        return state, in_map, creator_name
+
+    def _scan_files(self, root, state, in_map, creator_name, filenames):
+        "Generate (filename, creator_name) for the wanted files in the directory root."
+
+        if self.creator_from_path:
+            if state == CREATOR_DIR:
+                if 'realm.map' in filenames:
+                    filenames = ['realm.map']
+                else:
+                    if self.verbosity > 2:
+                        sys.stderr.write(root+" is player area w/o realm.map file; Skipping\n")
+                    return
+            elif state in (BASE_DIR, PLAYERS_DIR) and not in_map:
+                if self.verbosity > 2:
+                    sys.stderr.write("Skipping base mudlib non-map dir "+root+"\n")
+                return
+
+        if self.verbosity > 1:
+            sys.stderr.write("Scanning {0}, creator={1}\n".format(root, creator_name))
+
+        for filename in filenames:
+            if fnmatch(filename, self.pattern):
+                if self.verbosity:
+                    sys.stderr.write("   "+filename+"\n")
+                yield os.path.join(root, filename), creator_name
+            elif self.verbosity > 2:
+                sys.stderr.write("   (Skipping {0})\n".format(filename))
+
+#@[00]@| Ragnarok MagicMapper 6.1.0-alpha.0
+#@[01]@|
+#@[10]@| Copyright © 2010, 2018, 2020, 2021, 2022 by Steven L. Willoughby, Aloha, Oregon, USA.
+#@[11]@| All Rights Reserved. Licensed under the terms and conditions of the BSD-3-Clause
+#@[12]@| License as described in the accompanying LICENSE file distributed with MagicMapper.
+#@[13]@|
+#@[20]@| Based on earlier code from the Ragnarok MudShell (MSH) client,
+#@[21]@| Copyright © 1993, 2000-2003 by Steven L. Willoughby, Aloha, Oregon, USA.
+#@[22]@| MSH is licensed under the terms and conditions of the BSD-3-Clause
+#@[23]@|
+#@[30]@| Redistribution and use in source and binary forms, with or without
+#@[31]@| modification, are permitted provided that the following conditions
+#@[32]@| are met:
+#@[33]@| 1. Redistributions of source code must retain the above copyright
+#@[34]@|    notice, this list of conditions and the following disclaimer.
+#@[35]@| 2. Redistributions in binary form must reproduce the above copy-
+#@[36]@|    right notice, this list of conditions and the following dis-
+#@[37]@|    claimer in the documentation and/or other materials provided
+#@[38]@|    with the distribution.
+#@[39]@| 3. Neither the name of the copyright holder nor the names of its
+#@[40]@|    contributors may be used to endorse or promote products derived
+#@[41]@|    from this software without specific prior written permission.
+#@[42]@|
+#@[43]@| THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND
+#@[44]@| CONTRIBUTORS “AS IS” AND ANY EXPRESS OR IMPLIED WARRANTIES,
+#@[45]@| INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+#@[46]@| MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+#@[47]@| DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS
+#@[48]@| BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY,
+#@[49]@| OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+#@[50]@| PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+#@[51]@| PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+#@[52]@| THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+#@[53]@| TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF
+#@[54]@| THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+#@[55]@| SUCH DAMAGE.
+#@[56]@|
+#@[60]@| This software is not intended for any use or application in which
+#@[61]@| the safety of lives or property would be at risk due to failure or
+#@[62]@| defect of the software.
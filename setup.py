@@ -52,6 +52,7 @@ setup(
         'RagnarokMUD.MagicMapper',
     ],
     scripts = [
+        'dist_bin/mkmagicmap',
         'dist_bin/viewmap',
         'dist_bin/viewmap.py',
     ],